@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Query Plan Audit
+Seeds a throwaway database with 100k rows per table, runs EXPLAIN QUERY PLAN on
+every query registered with `register_query`, and exits non-zero if any of
+them scans a whole table or sorts its output through a temporary b-tree.
+
+Usage: python audit_query_plans.py [--rows 100000] [--verbose]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+
+def seed(conn, rows: int):
+    """Fill the hot tables with `rows` rows each"""
+    conn.executemany(
+        "INSERT INTO users (username, email, password_hash, name) VALUES (?, ?, 'x', ?)",
+        ((f"user{i}", f"user{i}@example.com", f"User {i}") for i in range(rows))
+    )
+    conn.executemany(
+        "INSERT INTO articles (user_id, title, content, tags, published_at) VALUES (1, ?, ?, 'running', ?)",
+        ((f"Article {i}", f"Body {i}", f"2020-01-01 00:00:{i % 60:02d}") for i in range(rows))
+    )
+    conn.executemany(
+        "INSERT INTO races (user_id, race_name, date) VALUES (1, ?, ?)",
+        ((f"Race {i}", f"20{10 + i % 15}-0{1 + i % 9}-1{i % 10}") for i in range(rows))
+    )
+    conn.executemany(
+        "INSERT INTO workouts (user_id, strava_id, type, date) VALUES (1, ?, 'Run', ?)",
+        ((str(i) if i % 2 else None, f"20{10 + i % 15}-0{1 + i % 9}-1{i % 10}") for i in range(rows))
+    )
+    conn.executemany(
+        "INSERT INTO songs (user_id, track_name, artist, pinned_at) VALUES (1, ?, 'Artist', ?)",
+        ((f"Song {i}", f"2020-01-01 00:00:{i % 60:02d}") for i in range(rows))
+    )
+    for table in ("strava_tokens", "spotify_tokens"):
+        conn.executemany(
+            f"INSERT INTO {table} (user_id, access_token, refresh_token, expires_at) VALUES (?, 'a', 'r', '2030-01-01')",
+            ((i,) for i in range(rows))
+        )
+    conn.executemany(
+        "INSERT INTO strava_activities (user_id, strava_id, name, type, start_date) VALUES (?, ?, 'Run', 'Run', ?)",
+        ((i % 100, str(i), f"2020-01-01T00:00:{i % 60:02d}Z") for i in range(rows))
+    )
+    conn.commit()
+
+
+def problems(plan) -> list:
+    """Plan steps that touch every row of a table or sort outside an index"""
+    # Relevance-ranked full-text queries sort only the rows the MATCH returned
+    ranked_match = any(" VIRTUAL TABLE INDEX " in row[3] and ":M" in row[3] for row in plan)
+    # Subquery results and materialized views are scanned, but they aren't tables
+    intermediate = {
+        row[3].split(" ", 1)[1] for row in plan
+        if row[3].startswith(("CO-ROUTINE ", "MATERIALIZE "))
+    }
+    found = []
+    for row in plan:
+        detail = row[3]
+        if detail.startswith("SCAN ") and " USING " not in detail and " VIRTUAL TABLE " not in detail:
+            if detail[len("SCAN "):] not in intermediate:
+                found.append(detail)  # full table scan
+        elif detail.startswith("USE TEMP B-TREE FOR ORDER BY") and not ranked_match:
+            found.append(detail)  # output order not served by an index
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="rows to seed per table")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    # Point the app at a throwaway database before anything is imported
+    workdir = tempfile.mkdtemp(prefix="query-audit-")
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "website.db")
+    os.environ.setdefault("SPOTIFY_CLIENT_ID", "audit")
+    os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "audit")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import main as app_module  # noqa: F401 - registers every hot query
+    from database import QUERY_REGISTRY, get_pool
+    from migrations import run_migrations
+
+    run_migrations()
+    print(f"🔄 Seeding {args.rows} rows per table...")
+    failures = 0
+    with get_pool().connection() as conn:
+        seed(conn, args.rows)
+        for name, sql in sorted(QUERY_REGISTRY.items()):
+            params = (None,) * sql.count("?")
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            found = problems(plan)
+            if found:
+                failures += 1
+                print(f"❌ {name}: {'; '.join(found)}")
+            else:
+                print(f"✅ {name}")
+            if args.verbose or found:
+                for row in plan:
+                    print(f"     {row[3]}")
+
+    print(f"{len(QUERY_REGISTRY) - failures}/{len(QUERY_REGISTRY)} queries use an index")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Race Latency Benchmark
+Measures /api/races latency while a slow Strava sync queued through
+/api/strava/sync is running on a job worker, to check that blocking work stays
+off the event loop.
+
+Usage: python benchmark_races_latency.py [--sync-seconds 3] [--requests 200]
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(base_url: str, count: int):
+    """Issue `count` sequential GET /api/races requests and return latencies in ms"""
+    latencies = []
+    with requests.Session() as session:
+        for _ in range(count):
+            start = time.perf_counter()
+            response = session.get(f"{base_url}/api/races")
+            response.raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(label, latencies):
+    print(f"{label:<28} p50={statistics.median(latencies):7.2f}ms  "
+          f"p99={percentile(latencies, 99):7.2f}ms  max={max(latencies):7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sync-seconds", type=float, default=3.0, help="simulated Strava sync duration")
+    parser.add_argument("--requests", type=int, default=200, help="race requests per measurement")
+    parser.add_argument("--races", type=int, default=500, help="races to seed")
+    args = parser.parse_args()
+
+    # Point the app at a throwaway database before it is imported
+    workdir = tempfile.mkdtemp(prefix="races-bench-")
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "website.db")
+    os.environ.setdefault("SPOTIFY_CLIENT_ID", "benchmark")
+    os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "benchmark")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import uvicorn
+    import main as app_module
+    from database import get_pool
+
+    app_module.init_db()
+    with get_pool().connection() as conn:
+        conn.executemany(
+            "INSERT INTO races (user_id, race_name, date) VALUES (1, ?, ?)",
+            [(f"Race {i}", f"20{10 + i % 15}-0{1 + i % 9}-1{i % 10}") for i in range(args.races)]
+        )
+        conn.commit()
+
+    # Simulate a slow upstream Strava sync
+    def slow_backfill(user_id, per_page=50, max_pages=None, progress=None):
+        time.sleep(args.sync_seconds)
+        return {
+            "synced_count": 0, "total_activities": 0, "pages": 1, "backfill_complete": True,
+            "activities_synced": 0, "deferred_until": None,
+        }
+
+    app_module.strava_sync.backfill = slow_backfill
+    # The sync endpoint only queues work for a connected account
+    app_module.strava_sync.save_tokens(1, {"access_token": "benchmark", "refresh_token": "benchmark", "expires_in": 3600})
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    base_url = f"http://127.0.0.1:{port}"
+
+    report("idle", measure(base_url, args.requests))
+
+    job = requests.post(f"{base_url}/api/strava/sync").json()
+    time.sleep(0.1)  # let a worker claim the job
+    report("during /api/strava/sync", measure(base_url, args.requests))
+    while requests.get(f"{base_url}{job['status_url']}").json()["status"] in ("queued", "running"):
+        time.sleep(0.1)
+
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
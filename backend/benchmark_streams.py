@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Stream Store Benchmark
+Grows a throwaway archive of synthetic 1 Hz activities and, at each size, times
+"sum heart rate over all activities" through both stream backends: SQLite
+BLOBs (decompressed per activity) and memory-mapped channel files.
+
+Usage: python benchmark_streams.py [--sizes 100 1000 5000] [--samples 3600] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def synthetic_streams(rng, samples: int) -> dict:
+    """A plausible run: steady HR and cadence, wandering GPS and altitude"""
+    seconds = np.arange(samples)
+    return {
+        "time": {"data": seconds},
+        "heartrate": {"data": 140 + 10 * np.sin(seconds / 300) + rng.integers(-2, 3, samples)},
+        "cadence": {"data": 85 + rng.integers(-2, 3, samples)},
+        "altitude": {"data": 30 + np.cumsum(rng.uniform(-0.2, 0.2, samples))},
+        "velocity_smooth": {"data": 3 + rng.uniform(-0.1, 0.1, samples)},
+        "latlng": {"data": np.column_stack([
+            51.5 + np.cumsum(rng.uniform(0, 2e-5, samples)),
+            -0.12 + np.cumsum(rng.uniform(-1e-5, 1e-5, samples)),
+        ])},
+    }
+
+
+def timed_sum(store, user_id: int, repeat: int):
+    """Best-of-`repeat` milliseconds to sum one channel across every activity"""
+    best, total = None, 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        total = sum(int(values.sum()) for _, values in store.channel(user_id, "heartrate"))
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000], help="archive sizes to measure")
+    parser.add_argument("--samples", type=int, default=3600, help="samples per activity")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    # Point the app at a throwaway database before anything is imported
+    workdir = tempfile.mkdtemp(prefix="stream-bench-")
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "website.db")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from database import get_pool
+    from migrations import run_migrations
+    from streams import MmapStreamStore, SQLiteStreamStore
+
+    run_migrations()
+    stores = {
+        "sqlite": SQLiteStreamStore(),
+        "mmap": MmapStreamStore(os.path.join(workdir, "streams")),
+    }
+    rng = np.random.default_rng(0)
+    user_id = 1
+    stored = 0
+
+    print(f"{'activities':>10} {'backend':>8} {'sum HR ms':>10} {'us/activity':>12} {'MB stored':>10}")
+    with get_pool().connection() as conn:
+        for size in sorted(args.sizes):
+            cursor = conn.cursor()
+            while stored < size:
+                streams = synthetic_streams(rng, args.samples)
+                for name, store in stores.items():
+                    store.save(cursor, user_id, str(stored), streams)
+                stored += 1
+            conn.commit()
+
+            for name, store in stores.items():
+                elapsed, total = timed_sum(store, user_id, args.repeat)
+                if name == "sqlite":
+                    on_disk = conn.execute("SELECT SUM(length(data)) FROM strava_streams").fetchone()[0]
+                else:
+                    on_disk = sum(
+                        os.path.getsize(os.path.join(store.directory, entry)) for entry in os.listdir(store.directory)
+                    )
+                print(f"{size:>10} {name:>8} {elapsed:>10.1f} {elapsed * 1000 / size:>12.1f} "
+                      f"{on_disk / 1e6:>10.1f}   (sum={total})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Database connection management.
+
+Connections are opened once, configured for WAL journaling and handed out from
+a bounded pool, so request handlers and the Strava/Spotify sync classes share
+the same set of connections instead of reconnecting on every call.
+"""
+
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def sqlite_path(url: str) -> str:
+    """File path from a sqlite:/// URL, or the value itself when it is already a path"""
+    return url[len("sqlite:///"):] if url.startswith("sqlite:///") else url
+
+
+# DATABASE_URL (a path or a sqlite:/// URL) is still honored when DATABASE_PATH isn't set
+DATABASE_PATH = os.getenv("DATABASE_PATH") or sqlite_path(os.getenv("DATABASE_URL", "database/website.db"))
+
+POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+BUSY_TIMEOUT_SECONDS = 30.0
+
+# Applied to every connection when it is opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # 16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_SECONDS * 1000)}",
+)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available in time"""
+
+
+class ConnectionPool:
+    """Bounded pool of pre-configured SQLite connections"""
+
+    def __init__(self, db_path: str = DATABASE_PATH, max_size: int = POOL_SIZE,
+                 timeout: float = BUSY_TIMEOUT_SECONDS):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open and configure a new connection"""
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # This allows accessing columns by name
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take a connection from the pool, opening one if the pool isn't full yet"""
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+    def release(self, conn: sqlite3.Connection):
+        """Return a connection to the pool, discarding any uncommitted work"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        if self._closed:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection for the duration of a `with` block; an exception rolls back its uncommitted writes"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # Never hand the next borrower a half-finished transaction (or its write lock)
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def reset(self):
+        """Close idle connections so the next callers get fresh ones"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def close(self):
+        """Close every idle connection and refuse new checkouts"""
+        self._closed = True
+        self.reset()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: Optional[str] = None) -> ConnectionPool:
+    """Get the shared connection pool for a database file"""
+    db_path = db_path or DATABASE_PATH
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(db_path)
+            _pools[db_path] = pool
+        return pool
+
+
+def close_pools():
+    """Close every pool and the database executor (called on application shutdown)"""
+    global _executor
+    # Queued run_db calls need _pools_lock (in get_pool) to finish, so the executor is
+    # drained outside it, and before the pools they use are closed
+    with _pools_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+# Hot queries by name; audit_query_plans.py checks each one's EXPLAIN QUERY PLAN
+QUERY_REGISTRY: Dict[str, str] = {}
+
+
+def register_query(name: str, sql: str) -> str:
+    """Record a hot query for the query-plan audit and return it unchanged"""
+    QUERY_REGISTRY[name] = sql
+    return sql
+
+
+def get_db() -> Iterator[sqlite3.Connection]:
+    """FastAPI dependency that lends a pooled connection for one request"""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+# Dedicated threads for database work, sized to the pool so a query never
+# waits on a thread while holding a connection
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _pools_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="sqlite")
+        return _executor
+
+
+def _call_with_connection(fn: Callable, args: tuple) -> Any:
+    with get_pool().connection() as conn:
+        return fn(conn, *args)
+
+
+async def run_db(fn: Callable, *args) -> Any:
+    """Run fn(conn, *args) on the database executor and await the result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), _call_with_connection, fn, args)
@@ -0,0 +1,101 @@
+"""
+Identity resolution cache.
+
+Decoded JWT claims are kept in a bounded LRU keyed by the raw token until the
+token's `exp`, and user rows are cached by username and id, so route
+dependencies resolve the caller without decoding or querying again. Anything
+that writes to `users` must call `invalidate()`.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import jwt
+
+from repositories import UserRepository
+
+CLAIMS_CACHE_SIZE = 1024
+
+
+class ClaimsCache:
+    """Bounded LRU of decoded token claims that drops entries once they expire"""
+
+    def __init__(self, max_size: int = CLAIMS_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Dict]:
+        with self._lock:
+            claims = self._entries.get(token)
+            if claims is None:
+                return None
+            if "exp" in claims and claims["exp"] <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return claims
+
+    def put(self, token: str, claims: Dict):
+        with self._lock:
+            self._entries[token] = claims
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class IdentityService:
+    """Resolves tokens and usernames to user rows, hitting the database once per user"""
+
+    def __init__(self, secret_key: str, algorithm: str, users: UserRepository = None):
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+        self.users = users or UserRepository()
+        self.claims = ClaimsCache()
+        self._by_username: Dict[str, Dict] = {}
+        self._by_id: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+
+    def decode(self, token: str) -> Dict:
+        """Decode and verify a JWT; raises jwt.PyJWTError if it is invalid or expired"""
+        claims = self.claims.get(token)
+        if claims is None:
+            claims = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+            self.claims.put(token, claims)
+        return claims
+
+    async def get_user(self, username: str) -> Optional[Dict]:
+        """Get a user row by username, from cache when possible"""
+        user = self._by_username.get(username)
+        if user is None:
+            user = await self.users.get_by_username(username)
+            if user:
+                self._remember(user)
+        return user
+
+    def get_cached_user(self, user_id: int) -> Optional[Dict]:
+        """Get a previously resolved user row by id without touching the database"""
+        return self._by_id.get(user_id)
+
+    def _remember(self, user: Dict):
+        with self._lock:
+            self._by_username[user["username"]] = user
+            self._by_id[user["id"]] = user
+
+    def invalidate(self, username: str = None):
+        """Forget one cached user, or every user and token when no name is given"""
+        with self._lock:
+            if username is None:
+                self._by_username.clear()
+                self._by_id.clear()
+                self.claims.clear()
+                return
+            user = self._by_username.pop(username, None)
+            if user:
+                self._by_id.pop(user["id"], None)
@@ -0,0 +1,105 @@
+"""
+Single-flight request coalescing.
+
+When many requests ask a provider for the same thing at once (a shared page
+bringing in a burst of visitors), only the first actually calls upstream; the
+rest wait for that call and get its result, or its exception. Calls are keyed
+by (provider, method, arguments, token identity), so different users or
+different arguments never share a response; nor do Strava calls made at
+different rate-limit priorities, since only background ones may be deferred. A key is only shared while its
+call is in flight; nothing is cached once it completes.
+
+`SingleFlight.do` serves threads (the sync clients used by sync jobs) and
+`SingleFlight.do_async` coroutines on one event loop (the request handlers).
+Every caller gets its own copy of the result, so one handler changing the
+payload can't affect another.
+"""
+
+import asyncio
+import copy
+import functools
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+
+def token_identity(access_token: str) -> str:
+    """Stable short fingerprint of a token, so keys never hold the token itself"""
+    return hashlib.sha256(access_token.encode()).hexdigest()[:16]
+
+
+def call_key(client, method: str, access_token: str, args: tuple, kwargs: Dict) -> Hashable:
+    # repr keeps list arguments (stream keys) usable in a key
+    return (client.provider, getattr(client, 'priority', None), method, token_identity(access_token), repr(args), repr(sorted(kwargs.items())))
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._tasks: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """fn(*args, **kwargs), unless another thread is already running it for key"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+        return copy.deepcopy(future.result())
+
+    async def do_async(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """await fn(*args, **kwargs), unless a coroutine on this loop is already awaiting it for key"""
+        key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        # A caller that gives up (client disconnected) mustn't cancel the call for everyone else
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def stats(self) -> Dict:
+        """Upstream calls made, callers that shared one, and calls in flight now"""
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._calls) + len(self._tasks),
+        }
+
+
+# One registry for every provider client in the process
+upstream_calls = SingleFlight()
+
+
+def coalesced(method: Callable) -> Callable:
+    """Coalesce identical concurrent calls to a client read method taking (self, access_token, ...)"""
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(self, access_token: str, *args, **kwargs):
+            key = call_key(self, method.__name__, access_token, args, kwargs)
+            return await upstream_calls.do_async(key, method, self, access_token, *args, **kwargs)
+    else:
+        @functools.wraps(method)
+        def wrapper(self, access_token: str, *args, **kwargs):
+            key = call_key(self, method.__name__, access_token, args, kwargs)
+            return upstream_calls.do(key, method, self, access_token, *args, **kwargs)
+    return wrapper
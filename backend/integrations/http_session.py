@@ -0,0 +1,176 @@
+"""
+Shared HTTP session for the Strava and Spotify clients.
+
+One pooled `requests.Session` is created at startup and reused by every
+client, so calls ride on kept-alive connections instead of paying a new TCP +
+TLS handshake each time. Every request gets connect/read timeouts, and
+idempotent requests are retried with jittered exponential backoff on 429 and
+5xx responses (honoring Retry-After). A Retry-After longer than
+MAX_RETRY_AFTER_SECONDS isn't slept through: `RetryAfterExceeded` is raised
+instead. `close_session()` runs at shutdown.
+
+Clients that schedule calls against a quota themselves (Strava, see
+rate_limit.py) ask for `retry_rate_limited=False`: their 429s come straight
+back so the rate limiter sees them and defers, rather than being retried
+behind its back.
+
+`AsyncPooledClient` is the httpx counterpart for the async clients, with the
+same pool size, timeouts and retry policy; `get_async_client()` /
+`close_async_client()` manage the shared instances.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+CONNECT_TIMEOUT_SECONDS = 3.05
+READ_TIMEOUT_SECONDS = 15.0
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+SERVER_ERROR_STATUSES = (500, 502, 503, 504)
+RETRY_STATUSES = (429,) + SERVER_ERROR_STATUSES
+# Longest Retry-After slept through before giving up with RetryAfterExceeded
+MAX_RETRY_AFTER_SECONDS = 10.0
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+class RetryAfterExceeded(Exception):
+    """The server asked to wait longer than MAX_RETRY_AFTER_SECONDS; try again at `retry_at` (epoch seconds)"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Server asked to retry after {retry_after:.0f}s")
+        self.retry_at = time.time() + retry_after
+
+
+def retry_statuses(retry_rate_limited: bool):
+    return RETRY_STATUSES if retry_rate_limited else SERVER_ERROR_STATUSES
+
+
+class JitteredRetry(Retry):
+    """Retry whose exponential backoff is spread uniformly over [0, backoff] (full jitter)"""
+
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        # urllib3 would otherwise retry any 429/503 carrying Retry-After, even outside status_forcelist
+        return super().is_retry(method, status_code, has_retry_after and status_code in self.status_forcelist)
+
+    def sleep_for_retry(self, response) -> bool:
+        retry_after = self.get_retry_after(response)
+        if retry_after is not None and retry_after > MAX_RETRY_AFTER_SECONDS:
+            raise RetryAfterExceeded(retry_after)
+        return super().sleep_for_retry(response)
+
+
+class PooledSession(requests.Session):
+    """Session with a bounded keep-alive pool, default timeouts and retries"""
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE,
+                 timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS), retry_rate_limited: bool = True):
+        super().__init__()
+        self.timeout = timeout
+        retry = JitteredRetry(
+            total=MAX_RETRIES,
+            backoff_factor=BACKOFF_FACTOR,
+            status_forcelist=retry_statuses(retry_rate_limited),
+            respect_retry_after_header=True,
+            raise_on_status=False,  # hand the last response back so callers can report it
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+def _retry_after(response) -> Optional[float]:
+    """Seconds from a numeric Retry-After header, if any"""
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class AsyncPooledClient(httpx.AsyncClient):
+    """httpx client with the same pool bounds, timeouts and retry policy as PooledSession"""
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, retry_rate_limited: bool = True):
+        self.retry_statuses = retry_statuses(retry_rate_limited)
+        super().__init__(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(READ_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+
+    async def request(self, method: str, url, **kwargs) -> httpx.Response:
+        retries = MAX_RETRIES if method.upper() in IDEMPOTENT_METHODS else 0
+        for attempt in range(retries + 1):
+            response = await super().request(method, url, **kwargs)
+            if response.status_code not in self.retry_statuses or attempt == retries:
+                return response
+            delay = _retry_after(response)
+            if delay is not None and delay > MAX_RETRY_AFTER_SECONDS:
+                await response.aclose()
+                raise RetryAfterExceeded(delay)
+            if delay is None:
+                delay = random.uniform(0, BACKOFF_FACTOR * (2 ** attempt))
+            await response.aclose()
+            await asyncio.sleep(delay)
+        return response
+
+
+# One shared instance per retry policy, keyed by retry_rate_limited
+_sessions: Dict[bool, PooledSession] = {}
+_session_lock = threading.Lock()
+
+
+def get_session(retry_rate_limited: bool = True) -> PooledSession:
+    """The shared session, created on first use"""
+    session = _sessions.get(retry_rate_limited)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(retry_rate_limited)
+            if session is None:
+                session = _sessions[retry_rate_limited] = PooledSession(retry_rate_limited=retry_rate_limited)
+    return session
+
+
+def close_session():
+    """Close the shared sessions and their pooled connections (called at shutdown)"""
+    with _session_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+_async_clients: Dict[bool, AsyncPooledClient] = {}
+
+
+def get_async_client(retry_rate_limited: bool = True) -> AsyncPooledClient:
+    """The shared async client, created on first use inside the running event loop"""
+    client = _async_clients.get(retry_rate_limited)
+    if client is None or client.is_closed:
+        client = _async_clients[retry_rate_limited] = AsyncPooledClient(retry_rate_limited=retry_rate_limited)
+    return client
+
+
+async def close_async_client():
+    """Close the shared async clients (called at shutdown)"""
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.aclose()
@@ -0,0 +1,122 @@
+"""
+Provider connection health.
+
+The status endpoints used to prove a connection with a live profile call on
+every poll. Now each provider has an `UpstreamHealth` that the API clients
+report every response to, and "connected" is answered from memory: cached
+tokens that haven't expired, plus whether the provider last accepted them.
+A background probe calls the provider only when nothing else has recently
+(and at most once per PROBE_INTERVAL_SECONDS), and the provider identity
+shown by the status endpoints comes from that probe.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+# A real call this recent proves the connection; probes are at least this far apart
+PROBE_INTERVAL_SECONDS = 15 * 60
+# How often the probe loop checks whether a probe is due
+PROBE_CHECK_SECONDS = 30
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+
+
+class UpstreamHealth:
+    """Last outcomes of one provider's API calls, and the liveness probe that fills gaps"""
+
+    def __init__(self, provider: str, identity_key: str):
+        self.provider = provider
+        self.identity_key = identity_key
+        self.identity: Optional[Dict] = None
+        self.last_success: Optional[float] = None
+        self.last_failure: Optional[float] = None
+        self.rejected_at: Optional[float] = None
+        self.last_probe: Optional[float] = None
+        self.probes = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, status_code: int):
+        """Note an API response: 401 means the token was rejected, 5xx an outage, anything else success"""
+        now = time.time()
+        if status_code == 401:
+            self.rejected_at = now
+        elif status_code >= 500:
+            self.last_failure = now
+        else:
+            self.last_success = now
+
+    def forget(self):
+        """Drop what is known about the connection (after disconnecting)"""
+        self.identity = None
+        self.last_success = self.last_failure = self.rejected_at = self.last_probe = None
+
+    def probe_due(self, now: float) -> bool:
+        if self.last_probe and now - self.last_probe < PROBE_INTERVAL_SECONDS:
+            return False
+        return self.identity is None or not self.last_success or now - self.last_success >= PROBE_INTERVAL_SECONDS
+
+    async def probe(self, check: Callable[[], Awaitable[Optional[Dict]]]) -> bool:
+        """Run check() if a probe is due; it returns the provider identity, or None when not connected"""
+        now = time.time()
+        if not self.probe_due(now):
+            return False
+        self.last_probe = now
+        try:
+            identity = await check()
+        except Exception as e:
+            self.probes += 1
+            print(f"⚠️ {self.provider.capitalize()} liveness probe failed: {e}")
+            return True
+        if identity is None:
+            self.last_probe = None  # not connected, so nothing was probed; look again next time
+            return False
+        self.identity = identity
+        self.probes += 1
+        return True
+
+    async def _run(self, check: Callable[[], Awaitable[Optional[Dict]]]):
+        while True:
+            await self.probe(check)
+            await asyncio.sleep(PROBE_CHECK_SECONDS)
+
+    def start(self, check: Callable[[], Awaitable[Optional[Dict]]]):
+        """Start the background probe loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(check))
+
+    async def close(self):
+        """Stop the probe loop (called at shutdown)"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self, tokens: Optional[Dict]) -> Dict:
+        """Connection status from cached tokens (as TokenManager.peek returns them); never calls the provider"""
+        if not tokens:
+            return {"connected": False, "message": "No tokens found"}
+        expires_at = tokens['expires_at']
+        if datetime.now() >= expires_at:
+            return {"connected": False, "message": "Token expired", "expired_at": expires_at.isoformat()}
+        if self.rejected_at and self.rejected_at > (self.last_success or 0):
+            return {
+                "connected": False,
+                "message": f"Token invalid: rejected by {self.provider.capitalize()}",
+                "rejected_at": _iso(self.rejected_at),
+            }
+        return {
+            "connected": True,
+            self.identity_key: self.identity,
+            "token_expires": expires_at.isoformat(),
+            "last_success": _iso(self.last_success),
+            "last_probe": _iso(self.last_probe),
+        }
+
+
+# One per provider, shared by its sync and async clients
+strava_health = UpstreamHealth('strava', 'athlete')
+spotify_health = UpstreamHealth('spotify', 'profile')
@@ -0,0 +1,215 @@
+"""
+Strava rate-limit scheduler.
+
+Strava allows a fixed number of requests per 15-minute window (resetting on
+the quarter hour, UTC) and per day (resetting at midnight UTC), and reports
+both limits and the current usage on every response in `X-RateLimit-Limit` /
+`X-RateLimit-Usage` ("short,daily"). `RateLimiter` keeps a token bucket per
+window: each request takes a token up front, every response resynchronizes the
+buckets from those headers, and a 429 drains the window it hit and is raised
+to the caller as `RateLimitExceeded` (interactive) or `RateLimitDeferred`
+(background), so Strava is never asked again before the window resets.
+
+Interactive reads may use the whole budget. Background work (sync, backfill,
+stream ingestion) has to leave a reserve for them; when it can't, it waits for
+the window to reset, or raises `RateLimitDeferred` when that is further away
+than it is willing to wait, so the caller can stop and resume later.
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Strava's default application limits, used until a response reports the real ones
+DEFAULT_LIMITS = (200, 2000)
+SHORT_WINDOW_SECONDS = 15 * 60
+DAILY_WINDOW_SECONDS = 24 * 60 * 60
+# Share of each window background work leaves for interactive requests
+BACKGROUND_RESERVE = (0.25, 0.10)
+# Longest background work sleeps for a reset before it is deferred instead
+MAX_BACKGROUND_WAIT_SECONDS = 60.0
+
+
+class RateLimitExceeded(Exception):
+    """The request can't be sent before `retry_at` (epoch seconds)"""
+
+    def __init__(self, message: str, retry_at: float):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, int(self.retry_at - time.time() + 0.999))
+
+
+class RateLimitDeferred(RateLimitExceeded):
+    """Background work should stop and resume at `retry_at`"""
+
+
+class Window:
+    """Token bucket for one fixed Strava window"""
+
+    def __init__(self, name: str, seconds: int, limit: int, reserve: float):
+        self.name = name
+        self.seconds = seconds
+        self.limit = limit
+        self.reserve = reserve
+        self.usage = 0
+        self.started = self._window_start(time.time())
+
+    def _window_start(self, now: float) -> float:
+        return now - now % self.seconds  # both windows are aligned to UTC
+
+    def roll(self, now: float):
+        """Start a fresh bucket once the window has reset"""
+        start = self._window_start(now)
+        if start != self.started:
+            self.started = start
+            self.usage = 0
+
+    @property
+    def resets_at(self) -> float:
+        return self.started + self.seconds
+
+    def available(self, priority: int) -> int:
+        floor = int(self.limit * self.reserve) if priority == BACKGROUND else 0
+        return self.limit - floor - self.usage
+
+    def snapshot(self) -> Dict:
+        return {
+            'limit': self.limit,
+            'usage': self.usage,
+            'remaining': max(0, self.limit - self.usage),
+            'background_reserve': int(self.limit * self.reserve),
+            'resets_at': datetime.fromtimestamp(self.resets_at, timezone.utc).isoformat(),
+        }
+
+
+class RateLimiter:
+    """Shared Strava quota accounting for the sync and async clients"""
+
+    def __init__(self, limits=DEFAULT_LIMITS, reserve=BACKGROUND_RESERVE,
+                 max_background_wait: float = MAX_BACKGROUND_WAIT_SECONDS):
+        self.windows = (
+            Window("short", SHORT_WINDOW_SECONDS, limits[0], reserve[0]),
+            Window("daily", DAILY_WINDOW_SECONDS, limits[1], reserve[1]),
+        )
+        self.max_background_wait = max_background_wait
+        self.counts = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.deferred = 0
+        self.rejected = 0
+        self.updated_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, priority: int) -> float:
+        """Take a token from every window, or return how long to wait (epoch seconds of the reset)"""
+        with self._lock:
+            now = time.time()
+            blocked_until = 0.0
+            for window in self.windows:
+                window.roll(now)
+                if window.available(priority) <= 0:
+                    blocked_until = max(blocked_until, window.resets_at)
+            if blocked_until:
+                return blocked_until
+            for window in self.windows:
+                window.usage += 1
+            self.counts[PRIORITY_NAMES[priority]] += 1
+            return 0.0
+
+    def _blocked(self, priority: int, retry_at: float) -> float:
+        """Seconds to sleep before retrying, or raise when waiting isn't allowed"""
+        wait = retry_at - time.time()
+        if priority == INTERACTIVE:
+            with self._lock:
+                self.rejected += 1
+            raise RateLimitExceeded("Strava rate limit reached", retry_at)
+        if wait > self.max_background_wait:
+            with self._lock:
+                self.deferred += 1
+            raise RateLimitDeferred("Strava budget for background work is used up", retry_at)
+        return max(wait, 0.0) + 0.5  # land just after the reset
+
+    def acquire(self, priority: int = INTERACTIVE):
+        """Block until a request may be sent (background only); raises RateLimitExceeded/Deferred"""
+        while True:
+            retry_at = self._try_acquire(priority)
+            if not retry_at:
+                return
+            time.sleep(self._blocked(priority, retry_at))
+
+    async def acquire_async(self, priority: int = INTERACTIVE):
+        """acquire() for coroutines; waits with asyncio.sleep instead of blocking a thread"""
+        while True:
+            retry_at = self._try_acquire(priority)
+            if not retry_at:
+                return
+            await asyncio.sleep(self._blocked(priority, retry_at))
+
+    def record(self, status_code: int, headers):
+        """Resynchronize the buckets from a Strava response"""
+        limit = headers.get("X-RateLimit-Limit")
+        usage = headers.get("X-RateLimit-Usage")
+        with self._lock:
+            now = time.time()
+            for window in self.windows:
+                window.roll(now)
+            try:
+                if limit:
+                    for window, value in zip(self.windows, limit.split(",")):
+                        window.limit = int(value)
+                if usage:
+                    for window, value in zip(self.windows, usage.split(",")):
+                        window.usage = int(value)
+            except ValueError:
+                pass  # malformed header; keep our own count
+            if status_code == 429:
+                # Whichever window is full (or both, if the headers didn't say) is done until it resets
+                full = [window for window in self.windows if window.usage >= window.limit] or self.windows
+                for window in full:
+                    window.usage = window.limit
+            if limit or usage:
+                self.updated_at = now
+
+    def rejection(self, priority: int, headers) -> RateLimitExceeded:
+        """The exception for a 429 (after record()), retrying at Retry-After or when the full windows reset"""
+        with self._lock:
+            now = time.time()
+            retry_at = max(
+                [window.resets_at for window in self.windows if window.usage >= window.limit] or [now]
+            )
+            try:
+                retry_at = now + float(headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                pass  # no usable Retry-After; wait for the windows
+            if priority == INTERACTIVE:
+                self.rejected += 1
+                return RateLimitExceeded("Strava rate limit reached", retry_at)
+            self.deferred += 1
+            return RateLimitDeferred("Strava rate limit reached", retry_at)
+
+    def snapshot(self) -> Dict:
+        """Current quota usage for the status endpoint"""
+        with self._lock:
+            now = time.time()
+            for window in self.windows:
+                window.roll(now)
+            return {
+                **{window.name: window.snapshot() for window in self.windows},
+                'requests': dict(self.counts),
+                'deferred': self.deferred,
+                'rejected': self.rejected,
+                'updated_at': (
+                    datetime.fromtimestamp(self.updated_at, timezone.utc).isoformat() if self.updated_at else None
+                ),
+            }
+
+
+# One budget per application: shared by every Strava client in the process
+strava_rate_limiter = RateLimiter()
@@ -1,22 +1,64 @@
 import os
+import httpx
 import requests
+from datetime import datetime
 from typing import Dict, List, Optional
-from datetime import datetime, timedelta
-import sqlite3
 from dotenv import load_dotenv
+from database import DATABASE_PATH, get_pool, register_query
+from integrations.coalesce import coalesced
+from integrations.http_session import get_async_client, get_session
+from integrations.liveness import spotify_health
+from integrations.tokens import TokenManager
 
 load_dotenv()
 
+LATEST_PLAY = register_query(
+    "spotify_plays.latest", "SELECT MAX(played_at) FROM spotify_plays WHERE user_id = ?"
+)
+
+TOP_TRACK_IDS = register_query(
+    "spotify_tracks.ids", "SELECT spotify_id FROM spotify_tracks WHERE user_id = ? ORDER BY id"
+)
+
+INSERT_PLAY = """
+    INSERT OR IGNORE INTO spotify_plays
+    (user_id, played_at, spotify_id, track_name, artist, album, album_art, duration_ms)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Spotify's page size limit for recently played
+RECENTLY_PLAYED_LIMIT = 50
+
+
+def _played_at_ms(played_at: str) -> int:
+    """Unix milliseconds of a Spotify ISO-8601 played_at"""
+    return int(datetime.fromisoformat(played_at.replace('Z', '+00:00')).timestamp() * 1000)
+
+
 class SpotifyAPI:
+    provider = 'spotify'
+    
     def __init__(self):
         self.client_id = os.getenv('SPOTIFY_CLIENT_ID')
         self.client_secret = os.getenv('SPOTIFY_CLIENT_SECRET')
         self.redirect_uri = os.getenv('SPOTIFY_REDIRECT_URI', 'http://localhost:8000/api/spotify/callback')
         self.base_url = "https://api.spotify.com/v1"
+        self.health = spotify_health
         
         if not self.client_id or not self.client_secret:
             raise ValueError("Spotify credentials not configured")
     
+    @property
+    def session(self) -> requests.Session:
+        """Shared keep-alive session (see integrations/http_session.py)"""
+        return get_session()
+    
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """GET an API endpoint and record its outcome for the status endpoint"""
+        response = self.session.get(url, **kwargs)
+        self.health.record(response.status_code)
+        return response
+    
     def get_auth_url(self) -> str:
         """Generate Spotify authorization URL"""
         scope = "user-read-private user-read-email user-top-read user-read-recently-played user-read-playback-state user-read-currently-playing"
@@ -52,7 +94,7 @@ class SpotifyAPI:
         print(f"🔄 Redirect URI: {self.redirect_uri}")
         
         try:
-            response = requests.post(url, data=data)
+            response = self.session.post(url, data=data)
             print(f"🔄 Response status: {response.status_code}")
             print(f"🔄 Response headers: {dict(response.headers)}")
             print(f"🔄 Full response text: {response.text}")
@@ -84,23 +126,25 @@ class SpotifyAPI:
             'client_secret': self.client_secret
         }
         
-        response = requests.post(url, data=data)
+        response = self.session.post(url, data=data)
         
         if response.status_code != 200:
             raise Exception(f"Failed to refresh token: {response.text}")
             
         return response.json()
     
+    @coalesced
     def get_user_profile(self, access_token: str) -> Dict:
         """Get current user profile"""
         headers = {'Authorization': f'Bearer {access_token}'}
-        response = requests.get(f"{self.base_url}/me", headers=headers)
+        response = self._get(f"{self.base_url}/me", headers=headers)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get user profile: {response.text}")
             
         return response.json()
     
+    @coalesced
     def get_top_tracks(self, access_token: str, time_range: str = 'short_term', limit: int = 20) -> List[Dict]:
         """Get user's top tracks"""
         headers = {'Authorization': f'Bearer {access_token}'}
@@ -109,29 +153,33 @@ class SpotifyAPI:
             'limit': limit
         }
         
-        response = requests.get(f"{self.base_url}/me/top/tracks", headers=headers, params=params)
+        response = self._get(f"{self.base_url}/me/top/tracks", headers=headers, params=params)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get top tracks: {response.text}")
             
         return response.json()['items']
     
-    def get_recently_played(self, access_token: str, limit: int = 20) -> List[Dict]:
-        """Get user's recently played tracks"""
+    @coalesced
+    def get_recently_played(self, access_token: str, limit: int = 20, after: Optional[int] = None) -> List[Dict]:
+        """Get user's recently played tracks, optionally only those played after a Unix-ms timestamp"""
         headers = {'Authorization': f'Bearer {access_token}'}
         params = {'limit': limit}
+        if after is not None:
+            params['after'] = after
         
-        response = requests.get(f"{self.base_url}/me/player/recently-played", headers=headers, params=params)
+        response = self._get(f"{self.base_url}/me/player/recently-played", headers=headers, params=params)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get recently played: {response.text}")
             
         return response.json()['items']
     
+    @coalesced
     def get_current_playback(self, access_token: str) -> Optional[Dict]:
         """Get current playback state"""
         headers = {'Authorization': f'Bearer {access_token}'}
-        response = requests.get(f"{self.base_url}/me/player", headers=headers)
+        response = self._get(f"{self.base_url}/me/player", headers=headers)
         
         if response.status_code == 204:  # No content (not playing)
             return None
@@ -140,142 +188,121 @@ class SpotifyAPI:
             
         return response.json()
     
+    @coalesced
     def get_playlist(self, access_token: str, playlist_id: str) -> Dict:
         """Get playlist details and tracks"""
         headers = {'Authorization': f'Bearer {access_token}'}
-        response = requests.get(f"{self.base_url}/playlists/{playlist_id}", headers=headers)
+        response = self._get(f"{self.base_url}/playlists/{playlist_id}", headers=headers)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get playlist: {response.text}")
             
         return response.json()
 
+class AsyncSpotifyAPI(SpotifyAPI):
+    """SpotifyAPI with coroutine methods on the shared async HTTP client (config and get_auth_url are inherited)"""
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return get_async_client()
+    
+    async def _get(self, access_token: str, path: str, params: Optional[Dict] = None) -> httpx.Response:
+        response = await self.client.get(
+            f"{self.base_url}{path}", headers={'Authorization': f'Bearer {access_token}'}, params=params
+        )
+        self.health.record(response.status_code)
+        return response
+    
+    async def _get_json(self, access_token: str, path: str, action: str, params: Optional[Dict] = None):
+        response = await self._get(access_token, path, params)
+        if response.status_code != 200:
+            raise Exception(f"Failed to {action}: {response.text}")
+        return response.json()
+    
+    async def _post_token(self, data: Dict, action: str) -> Dict:
+        try:
+            response = await self.client.post("https://accounts.spotify.com/api/token", data={
+                **data, 'client_id': self.client_id, 'client_secret': self.client_secret
+            })
+        except httpx.HTTPError as e:
+            print(f"❌ Network error during {action}: {e}")
+            raise Exception(f"Network error during {action}: {e}")
+        if response.status_code != 200:
+            print(f"❌ {action.capitalize()} failed with status {response.status_code}")
+            raise Exception(f"Failed to {action}: {response.text}")
+        return response.json()
+    
+    async def exchange_code_for_token(self, code: str) -> Dict:
+        """Exchange authorization code for access token"""
+        print(f"🔄 Making Spotify token exchange request (code {code[:10]}..., redirect {self.redirect_uri})")
+        result = await self._post_token({
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': self.redirect_uri
+        }, "exchange code for token")
+        print(f"✅ Token exchange successful: {list(result.keys())}")
+        return result
+    
+    async def refresh_token(self, refresh_token: str) -> Dict:
+        """Refresh access token using refresh token"""
+        return await self._post_token({'grant_type': 'refresh_token', 'refresh_token': refresh_token}, "refresh token")
+    
+    @coalesced
+    async def get_user_profile(self, access_token: str) -> Dict:
+        """Get current user profile"""
+        return await self._get_json(access_token, "/me", "get user profile")
+    
+    @coalesced
+    async def get_top_tracks(self, access_token: str, time_range: str = 'short_term', limit: int = 20) -> List[Dict]:
+        """Get user's top tracks"""
+        params = {'time_range': time_range, 'limit': limit}
+        return (await self._get_json(access_token, "/me/top/tracks", "get top tracks", params))['items']
+    
+    @coalesced
+    async def get_recently_played(self, access_token: str, limit: int = 20, after: Optional[int] = None) -> List[Dict]:
+        """Get user's recently played tracks, optionally only those played after a Unix-ms timestamp"""
+        params = {'limit': limit}
+        if after is not None:
+            params['after'] = after
+        return (await self._get_json(access_token, "/me/player/recently-played", "get recently played", params))['items']
+    
+    @coalesced
+    async def get_current_playback(self, access_token: str) -> Optional[Dict]:
+        """Get current playback state"""
+        response = await self._get(access_token, "/me/player")
+        if response.status_code == 204:  # No content (not playing)
+            return None
+        if response.status_code != 200:
+            raise Exception(f"Failed to get playback state: {response.text}")
+        return response.json()
+    
+    @coalesced
+    async def get_playlist(self, access_token: str, playlist_id: str) -> Dict:
+        """Get playlist details and tracks"""
+        return await self._get_json(access_token, f"/playlists/{playlist_id}", "get playlist")
+
 class SpotifyDataSync:
-    def __init__(self, db_path: str = "database/website.db"):
+    def __init__(self, db_path: str = DATABASE_PATH):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
         self.spotify_api = SpotifyAPI()
+        self.tokens = TokenManager(
+            'spotify', 'spotify_tokens', lambda refresh_token: self.spotify_api.refresh_token(refresh_token), db_path
+        )
     
     def save_tokens(self, user_id: int, tokens: Dict):
-        """Save Spotify tokens to database"""
-        conn = None
-        try:
-            conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
-            cursor = conn.cursor()
-            
-            # Create spotify_tokens table if it doesn't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS spotify_tokens (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    access_token TEXT NOT NULL,
-                    refresh_token TEXT NOT NULL,
-                    expires_at TIMESTAMP NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            """)
-            
-            # Calculate expiration time
-            expires_at = datetime.now() + timedelta(seconds=tokens['expires_in'])
-            
-            # Insert or update tokens
-            cursor.execute("""
-                INSERT OR REPLACE INTO spotify_tokens 
-                (user_id, access_token, refresh_token, expires_at)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, tokens['access_token'], tokens['refresh_token'], expires_at))
-            
-            conn.commit()
-        finally:
-            if conn:
-                conn.close()
+        """Save Spotify tokens (cached in memory and written through to the database)"""
+        self.tokens.save(user_id, tokens)
     
     def get_valid_tokens(self, user_id: int) -> Optional[Dict]:
-        """Get valid access token for user, refresh if needed"""
-        conn = None
-        try:
-            conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT access_token, refresh_token, expires_at 
-                FROM spotify_tokens 
-                WHERE user_id = ?
-            """, (user_id,))
-            
-            result = cursor.fetchone()
-            
-            if not result:
-                return None
-                
-            access_token, refresh_token, expires_at = result
-            expires_at = datetime.fromisoformat(expires_at)
-            
-            # Check if token is expired or will expire soon (within 5 minutes)
-            if datetime.now() + timedelta(minutes=5) >= expires_at:
-                # Refresh token
-                try:
-                    print(f"🔄 Refreshing expired Spotify token for user {user_id}")
-                    new_tokens = self.spotify_api.refresh_token(refresh_token)
-                    
-                    # Update tokens in the same connection
-                    cursor.execute("""
-                        UPDATE spotify_tokens 
-                        SET access_token = ?, refresh_token = ?, expires_at = ?
-                        WHERE user_id = ?
-                    """, (
-                        new_tokens['access_token'], 
-                        new_tokens.get('refresh_token', refresh_token),  # Spotify might not return refresh_token
-                        (datetime.now() + timedelta(seconds=new_tokens['expires_in'])).isoformat(),
-                        user_id
-                    ))
-                    conn.commit()
-                    
-                    return {
-                        'access_token': new_tokens['access_token'],
-                        'refresh_token': new_tokens.get('refresh_token', refresh_token)
-                    }
-                except Exception as e:
-                    print(f"❌ Failed to refresh Spotify token: {e}")
-                    return None
-            
-            # Return current valid token
-            return {
-                'access_token': access_token,
-                'refresh_token': refresh_token
-            }
-        except Exception as e:
-            print(f"❌ Database error in get_valid_spotify_tokens: {e}")
-            return None
-        finally:
-            if conn:
-                conn.close()
+        """Get valid access token for user, refresh if needed (single-flight, see integrations/tokens.py)"""
+        return self.tokens.get(user_id)
     
     def save_user_profile(self, user_id: int, profile: Dict):
         """Save Spotify user profile to database"""
-        conn = None
-        try:
-            conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
-            cursor = conn.cursor()
-            
-            # Create spotify_profiles table if it doesn't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS spotify_profiles (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    spotify_id TEXT NOT NULL,
-                    display_name TEXT,
-                    email TEXT,
-                    country TEXT,
-                    profile_image TEXT,
-                    followers_count INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            """)
-            
+        with self.pool.connection() as conn:
             # Insert or update profile
-            cursor.execute("""
+            conn.execute("""
                 INSERT OR REPLACE INTO spotify_profiles 
                 (user_id, spotify_id, display_name, email, country, profile_image, followers_count)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -284,36 +311,13 @@ class SpotifyDataSync:
                 profile.get('country'), profile.get('images', [{}])[0].get('url') if profile.get('images') else None,
                 profile.get('followers', {}).get('total', 0)
             ))
-            
             conn.commit()
-        finally:
-            if conn:
-                conn.close()
     
     def save_top_tracks(self, user_id: int, tracks: List[Dict]):
         """Save top tracks to database"""
-        conn = None
-        try:
-            conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             
-            # Create spotify_tracks table if it doesn't exist
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS spotify_tracks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    track_id TEXT NOT NULL,
-                    track_name TEXT NOT NULL,
-                    artist_name TEXT NOT NULL,
-                    album_name TEXT,
-                    album_art TEXT,
-                    popularity INTEGER,
-                    duration_ms INTEGER,
-                    saved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            """)
-            
             # Clear existing tracks for this user
             cursor.execute("DELETE FROM spotify_tracks WHERE user_id = ?", (user_id,))
             
@@ -321,17 +325,54 @@ class SpotifyDataSync:
             for track in tracks:
                 cursor.execute("""
                     INSERT INTO spotify_tracks 
-                    (user_id, track_id, track_name, artist_name, album_name, album_art, popularity, duration_ms)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    (user_id, spotify_id, track_name, artist, album, album_art, popularity, duration_ms, preview_url)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
                     user_id, track['id'], track['name'], 
                     track['artists'][0]['name'] if track['artists'] else 'Unknown',
                     track['album']['name'] if track['album'] else 'Unknown',
                     track['album']['images'][0]['url'] if track['album'] and track['album']['images'] else None,
-                    track.get('popularity', 0), track.get('duration_ms', 0)
+                    track.get('popularity', 0), track.get('duration_ms', 0), track.get('preview_url')
                 ))
             
             conn.commit()
-        finally:
-            if conn:
-                conn.close() 
\ No newline at end of file
+    
+    def sync_top_tracks(self, user_id: int, time_range: str = 'short_term', limit: int = 20) -> Dict:
+        """Snapshot the user's current top tracks into spotify_tracks"""
+        tokens = self.get_valid_tokens(user_id)
+        if not tokens:
+            raise Exception("No valid Spotify tokens found")
+        
+        tracks = self.spotify_api.get_top_tracks(tokens['access_token'], time_range, limit)
+        with self.pool.connection() as conn:
+            previous = [row[0] for row in conn.execute(TOP_TRACK_IDS, (user_id,))]
+        self.save_top_tracks(user_id, tracks)
+        return {'tracks': len(tracks), 'changed': previous != [track['id'] for track in tracks]}
+    
+    def sync_recently_played(self, user_id: int) -> Dict:
+        """Store plays since the newest one already in spotify_plays (one page of up to 50)"""
+        tokens = self.get_valid_tokens(user_id)
+        if not tokens:
+            raise Exception("No valid Spotify tokens found")
+        
+        with self.pool.connection() as conn:
+            after = conn.execute(LATEST_PLAY, (user_id,)).fetchone()[0]
+        items = self.spotify_api.get_recently_played(tokens['access_token'], RECENTLY_PLAYED_LIMIT, after)
+        
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            stored = 0
+            for item in items:
+                track = item['track']
+                album = track.get('album') or {}
+                images = album.get('images') or []
+                cursor.execute(INSERT_PLAY, (
+                    user_id, _played_at_ms(item['played_at']), track['id'], track['name'],
+                    track['artists'][0]['name'] if track.get('artists') else 'Unknown',
+                    album.get('name'), images[0]['url'] if images else None, track.get('duration_ms')
+                ))
+                stored += cursor.rowcount
+            conn.commit()
+        
+        print(f"✅ Stored {stored} new Spotify plays")
+        return {'plays': stored, 'more': len(items) == RECENTLY_PLAYED_LIMIT}
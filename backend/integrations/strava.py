@@ -1,17 +1,168 @@
 import os
+import httpx
 import requests
 import json
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Dict, Optional
+from database import DATABASE_PATH, get_pool, register_query
+from streams import STREAM_TYPES, open_stream_store
+from integrations.coalesce import coalesced
+from integrations.http_session import get_async_client, get_session
+from integrations.liveness import strava_health
+from integrations.tokens import TokenManager
+from integrations.rate_limit import BACKGROUND, INTERACTIVE, RateLimitDeferred, strava_rate_limiter
+
+SYNC_STATE_BY_USER = register_query(
+    "strava.sync_state", "SELECT * FROM strava_sync_state WHERE user_id = ?"
+)
+
+# Typed columns copied from a Strava activity summary into strava_activities
+ACTIVITY_COLUMNS = (
+    'name', 'type', 'distance', 'moving_time', 'elapsed_time', 'total_elevation_gain',
+    'start_date', 'start_date_local', 'average_speed', 'max_speed',
+    'average_heartrate', 'max_heartrate', 'calories'
+)
+
+UPSERT_ACTIVITY = f"""
+    INSERT INTO strava_activities (user_id, strava_id, {', '.join(ACTIVITY_COLUMNS)})
+    VALUES (?, ?, {', '.join('?' for _ in ACTIVITY_COLUMNS)})
+    ON CONFLICT (strava_id) DO UPDATE SET
+        user_id = excluded.user_id,
+        {', '.join(f'{column} = excluded.{column}' for column in ACTIVITY_COLUMNS)}
+"""
+
+# Mirror a batch of strava_activities (strava ids as a JSON array) into workouts
+UPSERT_WORKOUTS_FROM_ACTIVITIES = """
+    INSERT INTO workouts (user_id, strava_id, type, distance, duration, date, elevation, route_data)
+    SELECT user_id, strava_id, type, COALESCE(distance, 0) / 1000, COALESCE(moving_time, 0),
+           substr(start_date, 1, 10), COALESCE(total_elevation_gain, 0),
+           json_object(
+               'name', name,
+               'average_speed', COALESCE(average_speed, 0),
+               'max_speed', COALESCE(max_speed, 0),
+               'average_heartrate', COALESCE(average_heartrate, 0),
+               'max_heartrate', COALESCE(max_heartrate, 0),
+               'calories', COALESCE(calories, 0)
+           )
+    FROM strava_activities
+    WHERE strava_id IN (SELECT value FROM json_each(?))
+    ON CONFLICT (strava_id) DO UPDATE SET
+        type = excluded.type,
+        distance = excluded.distance,
+        duration = excluded.duration,
+        date = excluded.date,
+        elevation = excluded.elevation,
+        route_data = excluded.route_data
+"""
+register_query("workouts.from_activities", UPSERT_WORKOUTS_FROM_ACTIVITIES)
+
+COUNT_KNOWN_ACTIVITIES = register_query(
+    "strava_activities.count_known",
+    "SELECT COUNT(*) FROM strava_activities WHERE strava_id IN (SELECT value FROM json_each(?))"
+)
+
+# Per-type totals over a start_date_local window; served by the covering index
+ACTIVITY_SUMMARY = register_query("strava_activities.summary", """
+    SELECT type, COUNT(*) as count,
+           COALESCE(SUM(distance), 0) as distance,
+           COALESCE(SUM(moving_time), 0) as moving_time,
+           COALESCE(SUM(total_elevation_gain), 0) as elevation
+    FROM strava_activities
+    WHERE user_id = ? AND start_date_local >= ? AND start_date_local < ?
+    GROUP BY type
+""")
+
+# Activities whose streams haven't been ingested yet, newest first
+PENDING_STREAMS = register_query("strava_activities.streams_pending", """
+    SELECT strava_id FROM strava_activities
+    WHERE user_id = ? AND streams_synced_at IS NULL
+    ORDER BY start_date DESC
+    LIMIT ?
+""")
+
+COUNT_PENDING_STREAMS = register_query(
+    "strava_activities.count_streams_pending",
+    "SELECT COUNT(*) FROM strava_activities WHERE user_id = ? AND streams_synced_at IS NULL"
+)
+
+# Strava's timestamp layout, which sorts correctly as text
+ACTIVITY_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+SUMMARY_PERIODS = ('week', 'month', 'year')
+
+# Strava's maximum page size
+BACKFILL_PAGE_SIZE = 200
+
+
+def _activity_row(user_id: int, activity: Dict) -> tuple:
+    return (user_id, str(activity['id']), *(activity.get(column) for column in ACTIVITY_COLUMNS))
+
+
+def summary_window(days: int = 30, start: Optional[str] = None, end: Optional[str] = None,
+                   period: Optional[str] = None, now: Optional[datetime] = None):
+    """[start, end) datetimes for an activity summary.
+    
+    `period` is the current calendar week (from Monday), month or year; `start`/`end`
+    are inclusive YYYY-MM-DD dates (either may be omitted); otherwise the last `days` days.
+    Raises ValueError for anything it can't interpret.
+    """
+    now = now or datetime.now()
+    if period:
+        today = datetime(now.year, now.month, now.day)
+        if period == 'week':
+            return today - timedelta(days=today.weekday()), now
+        if period == 'month':
+            return today.replace(day=1), now
+        if period == 'year':
+            return today.replace(month=1, day=1), now
+        raise ValueError(f"period must be one of {', '.join(SUMMARY_PERIODS)}")
+    
+    if start or end:
+        window_end = datetime.fromisoformat(end) + timedelta(days=1) if end else now
+        window_start = datetime.fromisoformat(start) if start else window_end - timedelta(days=days)
+        if window_start >= window_end:
+            raise ValueError("start must be before end")
+        return window_start, window_end
+    
+    if days < 1:
+        raise ValueError("days must be positive")
+    return now - timedelta(days=days), now
+
+
+def _epoch(start_date: str) -> int:
+    """Unix timestamp of a Strava ISO-8601 start_date"""
+    return int(datetime.fromisoformat(start_date.replace('Z', '+00:00')).timestamp())
+
+
 
 class StravaAPI:
-    def __init__(self):
+    provider = 'strava'
+    
+    def __init__(self, priority: int = INTERACTIVE):
         self.client_id = os.getenv('STRAVA_CLIENT_ID')
         self.client_secret = os.getenv('STRAVA_CLIENT_SECRET')
         self.redirect_uri = os.getenv('STRAVA_REDIRECT_URI', '').strip('"').strip("'")
         self.base_url = "https://www.strava.com/api/v3"
-        
+        # API calls are scheduled against the shared Strava quota at this priority
+        self.priority = priority
+        self.limiter = strava_rate_limiter
+        self.health = strava_health
+    
+    @property
+    def session(self) -> requests.Session:
+        """Shared keep-alive session (see integrations/http_session.py); 429s are left to the rate limiter"""
+        return get_session(retry_rate_limited=False)
+    
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """GET an API endpoint once the rate limiter allows it, and record the quota and outcome it reports"""
+        self.limiter.acquire(self.priority)
+        response = self.session.get(url, **kwargs)
+        self.limiter.record(response.status_code, response.headers)
+        self.health.record(response.status_code)
+        if response.status_code == 429:
+            raise self.limiter.rejection(self.priority, response.headers)
+        return response
+    
     def get_auth_url(self) -> str:
         """Generate Strava OAuth authorization URL"""
         if not self.client_id:
@@ -49,7 +200,7 @@ class StravaAPI:
         print(f"🔄 Full data being sent: {data}")
         
         try:
-            response = requests.post(url, data=data)
+            response = self.session.post(url, data=data)
             print(f"🔄 Response status: {response.status_code}")
             print(f"🔄 Response headers: {dict(response.headers)}")
             print(f"🔄 Full response text: {response.text}")
@@ -80,259 +231,415 @@ class StravaAPI:
             'grant_type': 'refresh_token'
         }
         
-        response = requests.post(url, data=data)
+        response = self.session.post(url, data=data)
         if response.status_code != 200:
             raise Exception(f"Failed to refresh token: {response.text}")
             
         return response.json()
     
+    @coalesced
     def get_athlete(self, access_token: str) -> Dict:
         """Get athlete profile information"""
         headers = {'Authorization': f'Bearer {access_token}'}
-        response = requests.get(f"{self.base_url}/athlete", headers=headers)
+        response = self._get(f"{self.base_url}/athlete", headers=headers)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get athlete: {response.text}")
             
         return response.json()
     
-    def get_activities(self, access_token: str, page: int = 1, per_page: int = 30) -> List[Dict]:
-        """Get athlete activities"""
+    @coalesced
+    def get_activities(self, access_token: str, page: int = 1, per_page: int = 30,
+                       after: Optional[int] = None, before: Optional[int] = None) -> List[Dict]:
+        """Get athlete activities, optionally only those started after/before an epoch timestamp"""
         headers = {'Authorization': f'Bearer {access_token}'}
         params = {
             'page': page,
             'per_page': per_page
         }
+        if after is not None:
+            params['after'] = after
+        if before is not None:
+            params['before'] = before
         
-        response = requests.get(f"{self.base_url}/athlete/activities", headers=headers, params=params)
+        response = self._get(f"{self.base_url}/athlete/activities", headers=headers, params=params)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get activities: {response.text}")
             
         return response.json()
     
+    @coalesced
     def get_activity(self, access_token: str, activity_id: int) -> Dict:
         """Get specific activity details"""
         headers = {'Authorization': f'Bearer {access_token}'}
-        response = requests.get(f"{self.base_url}/activities/{activity_id}", headers=headers)
+        response = self._get(f"{self.base_url}/activities/{activity_id}", headers=headers)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get activity: {response.text}")
             
         return response.json()
     
+    @coalesced
+    def get_streams(self, access_token: str, activity_id, keys=STREAM_TYPES) -> Dict:
+        """Get an activity's streams keyed by type; empty when the activity has none (manual entries)"""
+        headers = {'Authorization': f'Bearer {access_token}'}
+        params = {'keys': ','.join(keys), 'key_by_type': 'true'}
+        response = self._get(f"{self.base_url}/activities/{activity_id}/streams", headers=headers, params=params)
+        
+        if response.status_code == 404:
+            return {}
+        if response.status_code != 200:
+            raise Exception(f"Failed to get streams: {response.text}")
+            
+        return response.json()
+    
+    @coalesced
     def get_stats(self, access_token: str, athlete_id: int) -> Dict:
         """Get athlete statistics"""
         headers = {'Authorization': f'Bearer {access_token}'}
-        response = requests.get(f"{self.base_url}/athletes/{athlete_id}/stats", headers=headers)
+        response = self._get(f"{self.base_url}/athletes/{athlete_id}/stats", headers=headers)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get stats: {response.text}")
             
         return response.json()
 
+class AsyncStravaAPI(StravaAPI):
+    """StravaAPI with coroutine methods on the shared async HTTP client (config and get_auth_url are inherited)"""
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return get_async_client(retry_rate_limited=False)
+    
+    async def _get(self, url: str, **kwargs) -> httpx.Response:
+        await self.limiter.acquire_async(self.priority)
+        response = await self.client.get(url, **kwargs)
+        self.limiter.record(response.status_code, response.headers)
+        self.health.record(response.status_code)
+        if response.status_code == 429:
+            raise self.limiter.rejection(self.priority, response.headers)
+        return response
+    
+    async def _get_json(self, access_token: str, path: str, action: str, params: Optional[Dict] = None):
+        response = await self._get(
+            f"{self.base_url}{path}", headers={'Authorization': f'Bearer {access_token}'}, params=params
+        )
+        if response.status_code != 200:
+            raise Exception(f"Failed to {action}: {response.text}")
+        return response.json()
+    
+    async def _post_token(self, data: Dict, action: str) -> Dict:
+        try:
+            response = await self.client.post("https://www.strava.com/oauth/token", data=data)
+        except httpx.HTTPError as e:
+            print(f"❌ Network error during {action}: {e}")
+            raise Exception(f"Network error during {action}: {e}")
+        if response.status_code != 200:
+            print(f"❌ {action.capitalize()} failed with status {response.status_code}")
+            raise Exception(f"Failed to {action}: {response.text}")
+        return response.json()
+    
+    async def exchange_code_for_token(self, code: str) -> Dict:
+        """Exchange authorization code for access token"""
+        if not self.client_secret:
+            raise ValueError("STRAVA_CLIENT_SECRET not configured")
+        
+        print(f"🔄 Making token exchange request (code {code[:10]}..., redirect {self.redirect_uri})")
+        result = await self._post_token({
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'code': code,
+            'grant_type': 'authorization_code'
+        }, "exchange code for token")
+        print(f"✅ Token exchange successful: {list(result.keys())}")
+        return result
+    
+    async def refresh_token(self, refresh_token: str) -> Dict:
+        """Refresh access token using refresh token"""
+        return await self._post_token({
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'refresh_token': refresh_token,
+            'grant_type': 'refresh_token'
+        }, "refresh token")
+    
+    @coalesced
+    async def get_athlete(self, access_token: str) -> Dict:
+        """Get athlete profile information"""
+        return await self._get_json(access_token, "/athlete", "get athlete")
+    
+    @coalesced
+    async def get_activities(self, access_token: str, page: int = 1, per_page: int = 30,
+                             after: Optional[int] = None, before: Optional[int] = None) -> List[Dict]:
+        """Get athlete activities, optionally only those started after/before an epoch timestamp"""
+        params = {'page': page, 'per_page': per_page}
+        if after is not None:
+            params['after'] = after
+        if before is not None:
+            params['before'] = before
+        return await self._get_json(access_token, "/athlete/activities", "get activities", params)
+    
+    @coalesced
+    async def get_activity(self, access_token: str, activity_id: int) -> Dict:
+        """Get specific activity details"""
+        return await self._get_json(access_token, f"/activities/{activity_id}", "get activity")
+    
+    @coalesced
+    async def get_streams(self, access_token: str, activity_id, keys=STREAM_TYPES) -> Dict:
+        """Get an activity's streams keyed by type; empty when the activity has none (manual entries)"""
+        response = await self._get(
+            f"{self.base_url}/activities/{activity_id}/streams",
+            headers={'Authorization': f'Bearer {access_token}'},
+            params={'keys': ','.join(keys), 'key_by_type': 'true'}
+        )
+        if response.status_code == 404:
+            return {}
+        if response.status_code != 200:
+            raise Exception(f"Failed to get streams: {response.text}")
+        return response.json()
+    
+    @coalesced
+    async def get_stats(self, access_token: str, athlete_id: int) -> Dict:
+        """Get athlete statistics"""
+        return await self._get_json(access_token, f"/athletes/{athlete_id}/stats", "get stats")
+
 class StravaDataSync:
-    def __init__(self, db_path: str = "database/website.db"):
+    def __init__(self, db_path: str = DATABASE_PATH):
         self.db_path = db_path
-        self.strava_api = StravaAPI()
+        self.pool = get_pool(db_path)
+        self.strava_api = StravaAPI(priority=BACKGROUND)
+        self.streams = open_stream_store(db_path)
+        self.tokens = TokenManager(
+            'strava', 'strava_tokens', lambda refresh_token: self.strava_api.refresh_token(refresh_token), db_path
+        )
     
     def save_tokens(self, user_id: int, tokens: Dict):
-        """Save Strava tokens to database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create strava_tokens table if it doesn't exist
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS strava_tokens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                access_token TEXT NOT NULL,
-                refresh_token TEXT NOT NULL,
-                expires_at TIMESTAMP NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        """)
+        """Save Strava tokens (cached in memory and written through to the database)"""
+        self.tokens.save(user_id, tokens)
+    
+    def save_athlete(self, user_id: int, athlete: Dict):
+        """Save Strava athlete profile to database"""
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO strava_athletes 
+                (id, user_id, strava_id, username, firstname, lastname, city, state, country, sex, premium, profile_medium, profile)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                athlete['id'], user_id, str(athlete['id']), athlete.get('username'), athlete.get('firstname'),
+                athlete.get('lastname'), athlete.get('city'), athlete.get('state'),
+                athlete.get('country'), athlete.get('sex'), athlete.get('premium', False),
+                athlete.get('profile_medium'), athlete.get('profile')
+            ))
+            conn.commit()
+    
+    def get_valid_tokens(self, user_id: int) -> Optional[Dict]:
+        """Get valid access token for user, refresh if needed (single-flight, see integrations/tokens.py)"""
+        return self.tokens.get(user_id)
+    
+    def _store_activities(self, cursor, user_id: int, activities: List[Dict]) -> int:
+        """Upsert a page of activities into strava_activities and workouts; returns how many were new"""
+        if not activities:
+            return 0
+        strava_ids = json.dumps([str(activity['id']) for activity in activities])
         
-        # Calculate expiration time
-        expires_at = datetime.now() + timedelta(seconds=tokens['expires_in'])
+        cursor.execute(COUNT_KNOWN_ACTIVITIES, (strava_ids,))
+        known = cursor.fetchone()[0]
         
-        # Insert or update tokens
+        # Later edits on Strava overwrite what we stored
+        cursor.executemany(UPSERT_ACTIVITY, [_activity_row(user_id, activity) for activity in activities])
+        cursor.execute(UPSERT_WORKOUTS_FROM_ACTIVITIES, (strava_ids,))
+        return len(activities) - known
+    
+    def get_sync_state(self, user_id: int) -> Dict:
+        """Get the backfill/incremental sync checkpoint for a user"""
+        with self.pool.connection() as conn:
+            row = conn.execute(SYNC_STATE_BY_USER, (user_id,)).fetchone()
+        if row:
+            return dict(row)
+        return {
+            'user_id': user_id, 'oldest_start': None, 'newest_start': None,
+            'backfill_pages': 0, 'backfill_complete': False,
+            'incremental_after': None, 'incremental_page': 0,
+            'activities_synced': 0, 'updated_at': None
+        }
+    
+    def _save_sync_state(self, cursor, state: Dict):
         cursor.execute("""
-            INSERT OR REPLACE INTO strava_tokens 
-            (user_id, access_token, refresh_token, expires_at)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, tokens['access_token'], tokens['refresh_token'], expires_at))
-        
-        conn.commit()
-        conn.close()
+            INSERT OR REPLACE INTO strava_sync_state
+            (user_id, oldest_start, newest_start, backfill_pages, backfill_complete,
+             incremental_after, incremental_page, activities_synced, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """, (
+            state['user_id'], state['oldest_start'], state['newest_start'],
+            state['backfill_pages'], state['backfill_complete'],
+            state['incremental_after'], state['incremental_page'], state['activities_synced']
+        ))
     
-    def get_valid_tokens(self, user_id: int) -> Optional[Dict]:
-        """Get valid access token for user, refresh if needed"""
-        conn = None
-        try:
-            conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
+    def _sync_page(self, user_id: int, state: Dict, activities: List[Dict]) -> int:
+        """Store one page of activities and the updated checkpoint in a single transaction"""
+        starts = [_epoch(activity['start_date']) for activity in activities]
+        if starts:
+            state['newest_start'] = max(starts + [state['newest_start'] or 0])
+            state['oldest_start'] = min(starts + [state['oldest_start'] or starts[0]])
+        
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT access_token, refresh_token, expires_at 
-                FROM strava_tokens 
-                WHERE user_id = ?
-            """, (user_id,))
-            
-            result = cursor.fetchone()
-            
-            if not result:
-                return None
-                
-            access_token, refresh_token, expires_at = result
-            expires_at = datetime.fromisoformat(expires_at)
-            
-            # Check if token is expired or will expire soon (within 5 minutes)
-            if datetime.now() + timedelta(minutes=5) >= expires_at:
-                # Refresh token
-                try:
-                    print(f"🔄 Refreshing expired token for user {user_id}")
-                    new_tokens = self.strava_api.refresh_token(refresh_token)
-                    
-                    # Update tokens in the same connection
-                    cursor.execute("""
-                        UPDATE strava_tokens 
-                        SET access_token = ?, refresh_token = ?, expires_at = ?
-                        WHERE user_id = ?
-                    """, (
-                        new_tokens['access_token'], 
-                        new_tokens['refresh_token'],
-                        (datetime.now() + timedelta(seconds=new_tokens['expires_in'])).isoformat(),
-                        user_id
-                    ))
-                    conn.commit()
-                    
-                    return {
-                        'access_token': new_tokens['access_token'],
-                        'refresh_token': new_tokens['refresh_token']
-                    }
-                except Exception as e:
-                    print(f"❌ Failed to refresh token: {e}")
-                    return None
-            
-            # Return current valid token
-            return {
-                'access_token': access_token,
-                'refresh_token': refresh_token
-            }
-        except Exception as e:
-            print(f"❌ Database error in get_valid_tokens: {e}")
-            return None
-        finally:
-            if conn:
-                conn.close()
+            synced_count = self._store_activities(cursor, user_id, activities)
+            state['activities_synced'] += synced_count
+            self._save_sync_state(cursor, state)
+            conn.commit()
+        return synced_count
     
-    def sync_activities(self, user_id: int, limit: int = 50) -> Dict:
-        """Sync Strava activities to local database"""
+    def backfill(self, user_id: int, per_page: int = BACKFILL_PAGE_SIZE, max_pages: Optional[int] = None,
+                 progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Sync new activities, then keep walking back through the history.
+        
+        Every page is committed together with its checkpoint, so an interrupted
+        run resumes where it stopped. New activities are fetched with `after=`
+        the newest start seen; older history with `before=` the oldest start seen.
+        max_pages caps the history pages fetched per call (None walks it all).
+        """
         tokens = self.get_valid_tokens(user_id)
         if not tokens:
             raise Exception("No valid Strava tokens found")
         
-        # Get activities from Strava
-        activities = self.strava_api.get_activities(tokens['access_token'], per_page=limit)
+        state = self.get_sync_state(user_id)
+        pages = 0
+        history_pages = 0
+        synced_count = 0
+        fetched = 0
+        deferred_until = None
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        def report(phase):
+            print(f"🔄 Strava {phase}: page {pages}, {synced_count} new, {state['activities_synced']} synced in total")
+            if progress:
+                progress({**state, 'phase': phase, 'pages': pages, 'synced_count': synced_count})
         
-        synced_count = 0
-        for activity in activities:
-            # Check if activity already exists
-            cursor.execute("SELECT id FROM workouts WHERE strava_id = ?", (str(activity['id']),))
-            if cursor.fetchone():
-                continue  # Skip if already synced
-            
-            # Convert Strava activity to workout format
-            workout_data = {
-                'user_id': user_id,
-                'strava_id': str(activity['id']),
-                'type': activity['type'],
-                'distance': activity.get('distance', 0) / 1000,  # Convert to km
-                'duration': activity.get('moving_time', 0),
-                'date': activity['start_date'][:10],  # YYYY-MM-DD
-                'elevation': activity.get('total_elevation_gain', 0),
-                'route_data': json.dumps({
-                    'name': activity.get('name', ''),
-                    'description': activity.get('description', ''),
-                    'average_speed': activity.get('average_speed', 0),
-                    'max_speed': activity.get('max_speed', 0),
-                    'average_heartrate': activity.get('average_heartrate', 0),
-                    'max_heartrate': activity.get('max_heartrate', 0),
-                    'calories': activity.get('calories', 0)
-                })
-            }
-            
-            cursor.execute("""
-                INSERT INTO workouts 
-                (user_id, strava_id, type, distance, duration, date, elevation, route_data)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                workout_data['user_id'],
-                workout_data['strava_id'],
-                workout_data['type'],
-                workout_data['distance'],
-                workout_data['duration'],
-                workout_data['date'],
-                workout_data['elevation'],
-                workout_data['route_data']
-            ))
-            
-            synced_count += 1
+        try:
+            # Incremental pass: everything since the newest activity we have. The
+            # `after` anchor stays fixed (with the page number) until the pass ends.
+            if state['newest_start'] is not None or state['incremental_after'] is not None:
+                if state['incremental_after'] is None:
+                    state['incremental_after'] = state['newest_start']
+                    state['incremental_page'] = 0
+                while True:
+                    activities = self.strava_api.get_activities(
+                        tokens['access_token'], page=state['incremental_page'] + 1,
+                        per_page=per_page, after=state['incremental_after']
+                    )
+                    pages += 1
+                    fetched += len(activities)
+                    state['incremental_page'] += 1
+                    if len(activities) < per_page:
+                        state['incremental_after'] = None
+                        state['incremental_page'] = 0
+                    synced_count += self._sync_page(user_id, state, activities)
+                    report("incremental")
+                    if state['incremental_after'] is None:
+                        break
         
-        conn.commit()
-        conn.close()
+            # History pass: walk backwards from the oldest activity seen so far
+            while not state['backfill_complete'] and (max_pages is None or history_pages < max_pages):
+                activities = self.strava_api.get_activities(
+                    tokens['access_token'], per_page=per_page, before=state['oldest_start']
+                )
+                pages += 1
+                history_pages += 1
+                fetched += len(activities)
+                state['backfill_pages'] += 1
+                if len(activities) < per_page:
+                    state['backfill_complete'] = True
+                synced_count += self._sync_page(user_id, state, activities)
+                report("backfill")
+        except RateLimitDeferred as e:
+            # Every page so far is checkpointed; the next run picks up from here
+            deferred_until = datetime.fromtimestamp(e.retry_at, timezone.utc).isoformat()
+            report(f"deferred until {deferred_until}")
         
         return {
             'synced_count': synced_count,
-            'total_activities': len(activities)
+            'total_activities': fetched,
+            'pages': pages,
+            'backfill_complete': bool(state['backfill_complete']),
+            'activities_synced': state['activities_synced'],
+            'deferred_until': deferred_until
         }
     
-    def get_activity_summary(self, user_id: int, days: int = 30) -> Dict:
-        """Get activity summary for the last N days"""
+    def sync_activities(self, user_id: int, limit: int = 50) -> Dict:
+        """Sync new Strava activities plus one more page of older history"""
+        return self.backfill(user_id, per_page=limit, max_pages=1)
+    
+    def sync_streams(self, user_id: int, limit: int = 20) -> Dict:
+        """Fetch and store streams for up to `limit` synced activities that don't have them yet.
+        
+        Each activity's streams are requested once: the activity is marked as
+        ingested in the same transaction that stores its channels, even when
+        Strava has no streams for it.
+        """
         tokens = self.get_valid_tokens(user_id)
         if not tokens:
             raise Exception("No valid Strava tokens found")
         
-        # Get recent activities
-        activities = self.strava_api.get_activities(tokens['access_token'], per_page=200)
+        with self.pool.connection() as conn:
+            pending = [row['strava_id'] for row in conn.execute(PENDING_STREAMS, (user_id, limit))]
         
-        # Filter activities from last N days
-        cutoff_date = datetime.now() - timedelta(days=days)
-        recent_activities = [
-            activity for activity in activities
-            if datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00')) > cutoff_date
-        ]
+        stored_bytes = 0
+        ingested = 0
+        deferred_until = None
+        for strava_id in pending:
+            try:
+                streams = self.strava_api.get_streams(tokens['access_token'], strava_id)
+            except RateLimitDeferred as e:
+                deferred_until = datetime.fromtimestamp(e.retry_at, timezone.utc).isoformat()
+                print(f"⏸️ Stream ingestion deferred until {deferred_until}")
+                break
+            ingested += 1
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                stored_bytes += self.streams.save(cursor, user_id, strava_id, streams)
+                cursor.execute(
+                    "UPDATE strava_activities SET streams_synced_at = CURRENT_TIMESTAMP WHERE strava_id = ?",
+                    (strava_id,)
+                )
+                conn.commit()
         
-        # Calculate summary statistics
-        total_distance = sum(activity.get('distance', 0) for activity in recent_activities) / 1000  # km
-        total_time = sum(activity.get('moving_time', 0) for activity in recent_activities) / 3600  # hours
-        total_elevation = sum(activity.get('total_elevation_gain', 0) for activity in recent_activities)
+        with self.pool.connection() as conn:
+            remaining = conn.execute(COUNT_PENDING_STREAMS, (user_id,)).fetchone()[0]
         
-        # Group by activity type
-        activity_types = {}
-        for activity in recent_activities:
-            activity_type = activity['type']
-            if activity_type not in activity_types:
-                activity_types[activity_type] = {
-                    'count': 0,
-                    'distance': 0,
-                    'time': 0
-                }
-            
-            activity_types[activity_type]['count'] += 1
-            activity_types[activity_type]['distance'] += activity.get('distance', 0) / 1000
-            activity_types[activity_type]['time'] += activity.get('moving_time', 0) / 3600
+        print(f"✅ Ingested streams for {ingested} activities ({stored_bytes} bytes), {remaining} remaining")
+        return {'activities': ingested, 'bytes': stored_bytes, 'remaining': remaining, 'deferred_until': deferred_until}
+    
+    def get_streams(self, user_id: int, strava_id: str, channels: Optional[List[str]] = None) -> Dict:
+        """NumPy arrays for an activity's stored streams, from whichever stream backend is active"""
+        return self.streams.load(user_id, strava_id, channels)
+    
+    def get_activity_summary(self, user_id: int, days: int = 30, start: Optional[str] = None,
+                             end: Optional[str] = None, period: Optional[str] = None) -> Dict:
+        """Summarize synced activities over a window, from the local store only"""
+        window_start, window_end = summary_window(days, start, end, period)
+        
+        with self.pool.connection() as conn:
+            rows = conn.execute(ACTIVITY_SUMMARY, (
+                user_id, window_start.strftime(ACTIVITY_TIME_FORMAT), window_end.strftime(ACTIVITY_TIME_FORMAT)
+            )).fetchall()
+        
+        activity_types = {
+            row['type']: {
+                'count': row['count'],
+                'distance': row['distance'] / 1000,  # km
+                'time': row['moving_time'] / 3600  # hours
+            }
+            for row in rows
+        }
         
         return {
-            'period_days': days,
-            'total_activities': len(recent_activities),
-            'total_distance_km': round(total_distance, 2),
-            'total_time_hours': round(total_time, 2),
-            'total_elevation_m': round(total_elevation, 0),
+            'period_days': (window_end - window_start).days,
+            'start': window_start.date().isoformat(),
+            'end': (window_end - timedelta(seconds=1)).date().isoformat(),
+            'total_activities': sum(row['count'] for row in rows),
+            'total_distance_km': round(sum(row['distance'] for row in rows) / 1000, 2),
+            'total_time_hours': round(sum(row['moving_time'] for row in rows) / 3600, 2),
+            'total_elevation_m': round(sum(row['elevation'] for row in rows), 0),
             'activity_types': activity_types
-        } 
\ No newline at end of file
+        }
@@ -0,0 +1,180 @@
+"""
+OAuth token manager.
+
+Keeps each user's provider tokens in memory so request handlers don't query
+SQLite for them, and refreshes them single-flight: a per-user lock means that
+when a token nears expiry only one caller (or the background refresher) calls
+the provider, and everyone else waiting on the lock picks up the new token.
+A background thread refreshes tokens ahead of expiry so requests rarely wait
+at all. Every change is written through to the provider's token table.
+
+Other processes (uvicorn workers, `python -m worker`) share that table and
+keep their own caches. Providers rotate refresh tokens, so before refreshing,
+and again after a refresh fails, the row is re-read in case another process
+has already refreshed it.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from database import get_pool
+
+# Requests refresh a token themselves only inside this margin...
+REQUEST_REFRESH_MARGIN = timedelta(minutes=5)
+# ...the background refresher starts earlier so they normally don't have to
+BACKGROUND_REFRESH_AHEAD = timedelta(minutes=10)
+BACKGROUND_INTERVAL_SECONDS = 60
+
+
+class TokenManager:
+    """In-memory, write-through OAuth tokens for one provider"""
+
+    def __init__(self, provider: str, table: str, refresh: Callable[[str], Dict], db_path: str = None):
+        self.provider = provider
+        self.table = table
+        self.refresh = refresh
+        self.pool = get_pool(db_path)
+        self._tokens: Dict[int, Dict] = {}
+        self._locks: Dict[int, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refresh_count = 0
+
+    def _lock(self, user_id: int) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(user_id, threading.Lock())
+
+    def _load(self, user_id: int) -> Optional[Dict]:
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                f"SELECT access_token, refresh_token, expires_at FROM {self.table} WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            'access_token': row['access_token'],
+            'refresh_token': row['refresh_token'],
+            'expires_at': datetime.fromisoformat(str(row['expires_at'])),
+        }
+
+    def _cached(self, user_id: int) -> Optional[Dict]:
+        if user_id not in self._tokens:
+            return self._reload(user_id)
+        return self._tokens[user_id]
+
+    def _reload(self, user_id: int) -> Optional[Dict]:
+        """Replace the cached tokens with what is in the database now"""
+        entry = self._load(user_id)
+        # A missing row isn't cached: another process may connect the user at any moment
+        if entry is None:
+            self._tokens.pop(user_id, None)
+        else:
+            self._tokens[user_id] = entry
+        return entry
+
+    def save(self, user_id: int, tokens: Dict):
+        """Store tokens from an OAuth exchange or refresh (keeps the old refresh token if none was returned)"""
+        with self._lock(user_id):
+            self._store(user_id, tokens)
+
+    def _store(self, user_id: int, tokens: Dict) -> Dict:
+        previous = self._tokens.get(user_id) or {}
+        entry = {
+            'access_token': tokens['access_token'],
+            'refresh_token': tokens.get('refresh_token') or previous.get('refresh_token'),
+            'expires_at': datetime.now() + timedelta(seconds=tokens['expires_in']),
+        }
+        with self.pool.connection() as conn:
+            conn.execute(f"""
+                INSERT OR REPLACE INTO {self.table} (user_id, access_token, refresh_token, expires_at)
+                VALUES (?, ?, ?, ?)
+            """, (user_id, entry['access_token'], entry['refresh_token'], entry['expires_at'].isoformat()))
+            conn.commit()
+        self._tokens[user_id] = entry
+        return entry
+
+    def _refresh_if_due(self, user_id: int, margin: timedelta) -> Optional[Dict]:
+        """Refresh under the user's lock unless another caller already did"""
+        with self._lock(user_id):
+            entry = self._cached(user_id)
+            if not entry or datetime.now() + margin < entry['expires_at']:
+                return entry
+            # Another process may have refreshed (and rotated the refresh token) already
+            entry = self._reload(user_id)
+            if not entry or datetime.now() + margin < entry['expires_at']:
+                return entry
+            try:
+                print(f"🔄 Refreshing {self.provider} token for user {user_id}")
+                self.refresh_count += 1
+                return self._store(user_id, self.refresh(entry['refresh_token']))
+            except Exception as e:
+                print(f"❌ Failed to refresh {self.provider} token: {e}")
+                # Our refresh token may have been rotated by a refresh in another process meanwhile
+                entry = self._reload(user_id) or entry
+                # A token that hasn't actually expired yet is still usable
+                return entry if datetime.now() < entry['expires_at'] else None
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Valid tokens for a user, refreshing first if they are about to expire"""
+        entry = self._tokens.get(user_id)
+        if entry is None or datetime.now() + REQUEST_REFRESH_MARGIN >= entry['expires_at']:
+            try:
+                entry = self._refresh_if_due(user_id, REQUEST_REFRESH_MARGIN)
+            except Exception as e:
+                print(f"❌ Database error loading {self.provider} tokens: {e}")
+                return None
+        if not entry:
+            return None
+        return {'access_token': entry['access_token'], 'refresh_token': entry['refresh_token']}
+
+    def peek(self, user_id: int) -> Optional[Dict]:
+        """Cached tokens and expiry without touching the database or the provider"""
+        entry = self._tokens.get(user_id)
+        return dict(entry) if entry else None
+
+    def state(self, user_id: int) -> Optional[Dict]:
+        """Like peek(), but reads the database for users without cached tokens (never refreshes)"""
+        if user_id not in self._tokens:
+            self._cached(user_id)
+        return self.peek(user_id)
+    
+    def forget(self, user_id: int = None):
+        """Drop cached tokens for one user, or all users (after the table was cleared)"""
+        with self._locks_lock:
+            if user_id is None:
+                self._tokens.clear()
+            else:
+                self._tokens.pop(user_id, None)
+
+    def refresh_due(self):
+        """Refresh every known token that expires within BACKGROUND_REFRESH_AHEAD"""
+        with self.pool.connection() as conn:
+            user_ids = [row[0] for row in conn.execute(f"SELECT user_id FROM {self.table}")]
+        for user_id in user_ids:
+            self._refresh_if_due(user_id, BACKGROUND_REFRESH_AHEAD)
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.refresh_due()
+            except Exception as e:
+                print(f"❌ Background {self.provider} token refresh failed: {e}")
+
+    def start(self, interval: float = BACKGROUND_INTERVAL_SECONDS):
+        """Start the background refresher thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name=f"{self.provider}-token-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background refresher and wait for it to finish"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,342 @@
+"""
+Durable job queue.
+
+Long work (a Strava or Spotify sync) used to run inside the request that asked for it, so
+a slow upstream held the request open and a crash lost the work. Now the
+request enqueues a row in the `jobs` table and returns its id, and a
+`WorkerPool` claims and runs it: in the web process, or on its own with
+`python -m worker`. Any number of pools may share the database.
+
+Claiming a job hides it from other workers for the job's timeout (its
+visibility timeout). The pool running it keeps pushing that deadline forward,
+so a job only becomes claimable again if its worker dies. A job that raises is
+retried with exponential backoff until it has used max_attempts; one deferred
+by the Strava rate limiter waits for the quota without using an attempt.
+While a job with a dedup key is unfinished, enqueueing the same key returns
+that job instead of adding another. Higher priority jobs are claimed first.
+"""
+
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from database import get_pool, register_query
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+DEFAULT_TIMEOUT_SECONDS = 5 * 60
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30.0
+RETRY_MAX_SECONDS = 60 * 60.0
+# Idle workers look for due jobs this often; enqueueing in-process wakes them at once
+POLL_SECONDS = 2.0
+# Running jobs' visibility is extended this often
+HEARTBEAT_SECONDS = 15.0
+# Finished jobs stay visible to the status endpoint this long
+RETENTION_SECONDS = 7 * 24 * 60 * 60
+PRUNE_SECONDS = 60 * 60
+
+# A second unfinished job with the same dedup key is dropped here and looked up instead
+INSERT_JOB = """
+    INSERT INTO jobs (kind, payload, priority, dedup_key, max_attempts, timeout, run_at, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (dedup_key) WHERE status IN ('queued', 'running') DO NOTHING
+"""
+
+ACTIVE_JOB_BY_DEDUP_KEY = register_query(
+    "jobs.active_by_dedup_key",
+    "SELECT id FROM jobs WHERE dedup_key = ? AND status IN ('queued', 'running')"
+)
+
+# Next due job, including running ones whose visibility timeout lapsed; one statement, so
+# two workers can never claim the same job
+CLAIM_JOB = register_query("jobs.claim", """
+    UPDATE jobs SET status = 'running', attempts = attempts + 1, claimed_by = ?, run_at = ? + timeout, updated_at = ?
+    WHERE id = (
+        SELECT id FROM jobs WHERE status IN ('queued', 'running') AND run_at <= ?
+        ORDER BY priority DESC, run_at LIMIT 1
+    )
+    RETURNING *
+""")
+
+EXTEND_JOB = register_query(
+    "jobs.extend",
+    "UPDATE jobs SET run_at = ? + timeout, updated_at = ? WHERE id = ? AND claimed_by = ?"
+)
+
+SUCCEED_JOB = register_query("jobs.succeed", """
+    UPDATE jobs SET status = 'succeeded', result = ?, error = NULL, claimed_by = NULL, updated_at = ?
+    WHERE id = ? AND claimed_by = ?
+""")
+
+RETRY_JOB = register_query("jobs.retry", """
+    UPDATE jobs SET status = 'queued', attempts = attempts - ?, run_at = ?, error = ?, claimed_by = NULL, updated_at = ?
+    WHERE id = ? AND claimed_by = ?
+""")
+
+FAIL_JOB = register_query("jobs.fail", """
+    UPDATE jobs SET status = 'failed', error = ?, claimed_by = NULL, updated_at = ?
+    WHERE id = ? AND claimed_by = ?
+""")
+
+JOB_BY_ID = register_query("jobs.get", "SELECT * FROM jobs WHERE id = ?")
+
+PRUNE_JOBS = register_query(
+    "jobs.prune",
+    "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?"
+)
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds before retrying a job that has failed `attempts` times (exponential, jittered)"""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobKind:
+    """How to run one kind of job: handler(payload) returns a JSON-serializable result"""
+
+    def __init__(self, name: str, handler: Callable[[Dict], Any], max_attempts: int, timeout: float):
+        self.name = name
+        self.handler = handler
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+
+class JobQueue:
+    """Jobs table operations; claimed jobs are identified by (id, claim token)"""
+
+    def __init__(self, db_path: str = None):
+        self.pool = get_pool(db_path)
+        self.kinds: Dict[str, JobKind] = {}
+        self.wakeup = threading.Event()
+
+    def register(self, kind: str, handler: Callable[[Dict], Any], max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 timeout: float = DEFAULT_TIMEOUT_SECONDS):
+        """Make a kind of job runnable; every process with workers must register the same kinds"""
+        self.kinds[kind] = JobKind(kind, handler, max_attempts, timeout)
+
+    def enqueue(self, kind: str, payload: Dict, priority: int = PRIORITY_NORMAL, dedup_key: Optional[str] = None,
+                delay: float = 0) -> Tuple[int, bool]:
+        """Add a job; returns (job id, created), where created is False if dedup_key matched an unfinished job"""
+        job_kind = self.kinds[kind]
+        now = time.time()
+        with self.pool.connection() as conn:
+            cursor = conn.execute(INSERT_JOB, (
+                kind, json.dumps(payload), priority, dedup_key, job_kind.max_attempts, job_kind.timeout,
+                now + delay, now, now
+            ))
+            if cursor.rowcount:
+                job_id, created = cursor.lastrowid, True
+            else:
+                # Still inside the insert's write transaction, so the job can't finish in between
+                job_id, created = conn.execute(ACTIVE_JOB_BY_DEDUP_KEY, (dedup_key,)).fetchone()['id'], False
+            conn.commit()
+        if created:
+            self.wakeup.set()
+        return job_id, created
+
+    def claim(self, token: str) -> Optional[Dict]:
+        """Take the next due job under claim token `token`, or None when nothing is due"""
+        while True:
+            now = time.time()
+            with self.pool.connection() as conn:
+                rows = conn.execute(CLAIM_JOB, (token, now, now, now)).fetchall()
+                conn.commit()
+            if not rows:
+                return None
+            job = dict(rows[0])
+            if job['attempts'] <= job['max_attempts']:
+                return job
+            # Its worker died on the last attempt
+            self.fail(job['id'], token, "Timed out on the final attempt")
+
+    def extend(self, job_id: int, token: str) -> bool:
+        """Push a running job's visibility deadline forward; False if the claim was lost"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            extended = conn.execute(EXTEND_JOB, (now, now, job_id, token)).rowcount
+            conn.commit()
+        return extended == 1
+
+    def ack(self, job_id: int, token: str, result: Any) -> bool:
+        """Mark a claimed job succeeded; False if the claim was lost (it timed out and was reclaimed)"""
+        with self.pool.connection() as conn:
+            acked = conn.execute(SUCCEED_JOB, (json.dumps(result), time.time(), job_id, token)).rowcount
+            conn.commit()
+        return acked == 1
+
+    def retry(self, job: Dict, token: str, error: str, retry_at: Optional[float] = None) -> bool:
+        """Requeue a claimed job after a failure, or fail it for good once it has used its attempts.
+
+        With retry_at (a deferral rather than a failure) the job runs again then,
+        and the attempt isn't counted. Returns True if the job will run again.
+        """
+        if retry_at is None and job['attempts'] >= job['max_attempts']:
+            self.fail(job['id'], token, error)
+            return False
+        refund = 1 if retry_at is not None else 0
+        run_at = retry_at if retry_at is not None else time.time() + retry_delay(job['attempts'])
+        with self.pool.connection() as conn:
+            conn.execute(RETRY_JOB, (refund, run_at, error, time.time(), job['id'], token))
+            conn.commit()
+        return True
+
+    def fail(self, job_id: int, token: str, error: str):
+        """Mark a claimed job failed without further retries"""
+        with self.pool.connection() as conn:
+            conn.execute(FAIL_JOB, (error, time.time(), job_id, token))
+            conn.commit()
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        """A job as the status endpoint shows it, or None"""
+        with self.pool.connection() as conn:
+            row = conn.execute(JOB_BY_ID, (job_id,)).fetchone()
+        if not row:
+            return None
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'priority': row['priority'],
+            'attempts': row['attempts'],
+            'max_attempts': row['max_attempts'],
+            'payload': json.loads(row['payload']),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            # Queued: when it may next run; running: its visibility deadline
+            'run_at': _iso(row['run_at']) if row['status'] in ('queued', 'running') else None,
+            'created_at': _iso(row['created_at']),
+            'updated_at': _iso(row['updated_at']),
+        }
+
+    def prune(self, older_than: float = RETENTION_SECONDS) -> int:
+        """Delete jobs that finished more than older_than seconds ago"""
+        with self.pool.connection() as conn:
+            deleted = conn.execute(PRUNE_JOBS, (time.time() - older_than,)).rowcount
+            conn.commit()
+        return deleted
+
+
+class WorkerPool:
+    """Threads that claim and run jobs, plus one that keeps their claims alive"""
+
+    def __init__(self, queue: JobQueue, concurrency: int = 2, name: Optional[str] = None):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._running: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _execute(self, job: Dict, token: str):
+        kind = self.queue.kinds.get(job['kind'])
+        if kind is None:
+            print(f"❌ Job {job['id']} has unknown kind {job['kind']}")
+            self.queue.fail(job['id'], token, f"Unknown job kind: {job['kind']}")
+            self.failed += 1
+            return
+        try:
+            result = kind.handler(json.loads(job['payload']))
+        except Exception as e:
+            # The Strava rate limiter's exceptions say when the quota frees up
+            retry_at = getattr(e, 'retry_at', None)
+            if self.queue.retry(job, token, str(e), retry_at):
+                self.retried += 1
+                if retry_at is not None:
+                    print(f"⏸️ Job {job['id']} ({job['kind']}) deferred: {e}")
+                else:
+                    print(f"⚠️ Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed, will retry: {e}")
+            else:
+                self.failed += 1
+                print(f"❌ Job {job['id']} ({job['kind']}) failed after {job['attempts']} attempts: {e}")
+            return
+        if self.queue.ack(job['id'], token, result):
+            self.succeeded += 1
+        else:
+            print(f"⚠️ Job {job['id']} ({job['kind']}) finished after its claim lapsed; result discarded")
+
+    def _work(self):
+        while not self._stopping.is_set():
+            self.queue.wakeup.clear()
+            token = f"{self.name}:{uuid.uuid4().hex[:8]}"
+            try:
+                job = self.queue.claim(token)
+            except Exception as e:
+                print(f"⚠️ Job claim failed: {e}")
+                job = None
+            if job is None:
+                self.queue.wakeup.wait(POLL_SECONDS)
+                continue
+            with self._lock:
+                self._running[job['id']] = token
+            try:
+                self._execute(job, token)
+            except Exception as e:
+                print(f"❌ Job {job['id']} could not be recorded: {e}")
+            finally:
+                with self._lock:
+                    del self._running[job['id']]
+
+    def _heartbeat(self):
+        last_prune = 0.0
+        while not self._stopping.wait(HEARTBEAT_SECONDS):
+            with self._lock:
+                running = list(self._running.items())
+            try:
+                for job_id, token in running:
+                    self.queue.extend(job_id, token)
+                if time.time() - last_prune >= PRUNE_SECONDS:
+                    last_prune = time.time()
+                    self.queue.prune()
+            except Exception as e:
+                print(f"⚠️ Job heartbeat failed: {e}")
+
+    def start(self):
+        """Start the worker and heartbeat threads"""
+        if self._threads:
+            return
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            for index in range(self.concurrency)
+        ]
+        self._threads.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        print(f"👷 Job workers started ({self.concurrency})")
+
+    def stop(self, timeout: float = 10.0):
+        """Stop claiming jobs and wait up to timeout for running ones (any left are reclaimed after their timeout)"""
+        self._stopping.set()
+        self.queue.wakeup.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def stats(self) -> Dict:
+        """Worker counters for this process"""
+        return {
+            'workers': self.concurrency if self._threads else 0,
+            'running': len(self._running),
+            'succeeded': self.succeeded,
+            'retried': self.retried,
+            'failed': self.failed,
+        }
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Request Coalescing Load Test
+Points the API clients at a local fake Strava/Spotify server that answers
+slowly, fires N simultaneous identical requests at /api/strava/athlete and
+/api/spotify/top-tracks (through the ASGI app) and at the sync Strava client
+(from N threads), and reports how many upstream calls each burst produced.
+Exits non-zero unless every burst made exactly one.
+
+Usage: python loadtest_coalescing.py [--requests 200] [--delay 0.2]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_upstream(delay: float):
+    """Threaded HTTP server answering the athlete and top-tracks endpoints after `delay` seconds"""
+    hits = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        wbufsize = 1 << 16
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            hits[path] += 1
+            time.sleep(delay)
+            if path == "/me/top/tracks":
+                payload = {"items": [{
+                    "id": "t1", "name": "Song", "artists": [{"name": "Artist"}],
+                    "album": {"name": "Album", "images": []}, "external_urls": {"spotify": ""},
+                }]}
+            else:
+                payload = {"id": 7, "firstname": "Maya", "lastname": "Ramirez"}
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            self.wfile.flush()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="simultaneous identical requests per burst")
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds the fake upstream takes to answer")
+    args = parser.parse_args()
+
+    # Point the app at a throwaway database before anything is imported
+    workdir = tempfile.mkdtemp(prefix="coalesce-load-")
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "website.db")
+    os.environ.setdefault("SPOTIFY_CLIENT_ID", "load-test")
+    os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "load-test")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import httpx
+    import main as app_module
+    from integrations.coalesce import upstream_calls
+    from integrations.strava import StravaAPI
+
+    server, hits = fake_upstream(args.delay)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    app_module.strava_api.base_url = base_url
+    app_module.spotify_api.base_url = base_url
+
+    async def burst(client, path, upstream_path):
+        """(ok responses, upstream calls, seconds) for N simultaneous GETs of path"""
+        before, start = hits[upstream_path], time.perf_counter()
+        responses = await asyncio.gather(*(client.get(path) for _ in range(args.requests)))
+        ok = sum(response.status_code == 200 for response in responses)
+        return ok, hits[upstream_path] - before, time.perf_counter() - start
+
+    async def run_async():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with app_module.lifespan(app_module.app):
+            user_id = (await app_module.get_admin_user())['id']
+            tokens = {"access_token": "load-test", "refresh_token": "load-test", "expires_in": 3600}
+            app_module.strava_sync.save_tokens(user_id, tokens)
+            app_module.spotify_sync.save_tokens(user_id, tokens)
+            async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+                return {
+                    "GET /api/strava/athlete": await burst(client, "/api/strava/athlete", "/athlete"),
+                    "GET /api/spotify/top-tracks": await burst(client, "/api/spotify/top-tracks", "/me/top/tracks"),
+                }
+
+    results = asyncio.run(run_async())
+
+    # The sync client, as sync jobs use it: one thread per caller
+    api = StravaAPI()
+    api.base_url = base_url
+    before, start = hits["/athlete"], time.perf_counter()
+    with ThreadPoolExecutor(args.requests) as pool:
+        athletes = list(pool.map(lambda _: api.get_athlete("load-test"), range(args.requests)))
+    results["StravaAPI.get_athlete (threads)"] = (
+        sum(athlete["id"] == 7 for athlete in athletes), hits["/athlete"] - before, time.perf_counter() - start
+    )
+
+    print(f"{'burst':<32} {'requests':>8} {'ok':>5} {'upstream':>9} {'seconds':>8}")
+    failed = False
+    for name, (ok, upstream, elapsed) in results.items():
+        failed |= upstream != 1 or ok != args.requests
+        print(f"{name:<32} {args.requests:>8} {ok:>5} {upstream:>9} {elapsed:>8.2f}")
+    print(f"coalescing: {upstream_calls.stats()}")
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,35 @@
-﻿from fastapi import FastAPI, HTTPException, Depends, status, Request
+﻿from fastapi import FastAPI, HTTPException, Depends, Query, status, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
-import sqlite3
+from typing import Awaitable, Generic, List, Optional, Dict, Tuple, TypeVar, Union
+import asyncio
+import json
 import os
 from datetime import datetime
 import jwt
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from integrations.strava import StravaAPI, StravaDataSync
-from integrations.spotify import SpotifyAPI, SpotifyDataSync as SpotifyDataSyncClass
+from integrations.strava import BACKFILL_PAGE_SIZE, AsyncStravaAPI, StravaDataSync
+from integrations.rate_limit import BACKGROUND, RateLimitDeferred, RateLimitExceeded, strava_rate_limiter
+from integrations.spotify import AsyncSpotifyAPI, SpotifyDataSync as SpotifyDataSyncClass
+from fastapi.concurrency import run_in_threadpool
+from database import get_pool, close_pools, run_db
+from integrations.http_session import get_session, close_session, close_async_client
+from integrations.coalesce import upstream_calls
+from integrations.liveness import spotify_health, strava_health
+from migrations import run_migrations
+from identity import IdentityService
+from response_cache import ResponseCache
+from now_playing import PlaybackPoller
+from scheduler import Job, Lease, Scheduler
+from job_queue import PRIORITY_HIGH, PRIORITY_NORMAL, JobQueue, WorkerPool
+from repositories import (
+    UserRepository, ArticleRepository, RaceRepository, WorkoutRepository,
+    SongRepository, TokenRepository, FitnessRepository, count_rows, split_tags,
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, USER_BY_USERNAME
+)
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +39,15 @@ async def lifespan(app: FastAPI):
     # Startup
     init_db()
     print("âœ… Database initialized!")
+    get_session()
+    strava_sync.tokens.start()
+    spotify_sync.tokens.start()
+    strava_health.start(probe_strava)
+    spotify_health.start(probe_spotify)
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+    if JOB_WORKERS > 0:
+        job_workers.start()
     print("ðŸš€ FastAPI server starting...")
     print("ðŸ“š API documentation available at: http://localhost:8000/docs")
     
@@ -34,6 +61,17 @@ async def lifespan(app: FastAPI):
     
     yield
     # Shutdown
+    await spotify_cache.close()
+    await now_playing.close()
+    await scheduler.close()
+    await run_in_threadpool(job_workers.stop)
+    await strava_health.close()
+    await spotify_health.close()
+    strava_sync.tokens.stop()
+    spotify_sync.tokens.stop()
+    close_session()
+    await close_async_client()
+    close_pools()
     print("ðŸ›‘ Server shutting down...")
 
 # Initialize FastAPI app
@@ -64,281 +102,10 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 security = HTTPBearer()
 
-# Database setup
-DATABASE_URL = "database/website.db"
-
-def get_db():
-    """Get database connection"""
-    # Ensure database directory exists
-    os.makedirs("database", exist_ok=True)
-    
-    conn = sqlite3.connect(DATABASE_URL, timeout=30.0, check_same_thread=False)
-    conn.row_factory = sqlite3.Row  # This allows accessing columns by name
-    return conn
-
 def init_db():
-    """Initialize database with tables"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            name TEXT NOT NULL,
-            bio TEXT,
-            profile_photo TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Strava tokens table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS strava_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            access_token TEXT NOT NULL,
-            refresh_token TEXT NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    
-    # Strava athletes table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS strava_athletes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            strava_id TEXT NOT NULL,
-            username TEXT,
-            firstname TEXT,
-            lastname TEXT,
-            city TEXT,
-            state TEXT,
-            country TEXT,
-            sex TEXT,
-            premium BOOLEAN DEFAULT FALSE,
-            profile_medium TEXT,
-            profile TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    
-    # Strava activities table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS strava_activities (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            strava_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            type TEXT NOT NULL,
-            distance REAL,
-            moving_time INTEGER,
-            elapsed_time INTEGER,
-            total_elevation_gain REAL,
-            start_date TIMESTAMP,
-            start_date_local TIMESTAMP,
-            average_speed REAL,
-            max_speed REAL,
-            average_heartrate REAL,
-            max_heartrate REAL,
-            calories INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    
-    # Workouts table (for manual entries)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS workouts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            strava_id TEXT,
-            type TEXT NOT NULL,
-            distance REAL,
-            duration INTEGER,
-            date DATE NOT NULL,
-            elevation REAL,
-            route_data TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    
-    # Songs table (for Spotify integration)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS songs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            spotify_id TEXT,
-            track_name TEXT NOT NULL,
-            artist TEXT NOT NULL,
-            album TEXT,
-            album_art TEXT,
-            personal_note TEXT,
-            pinned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    
-    # Photos table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS photos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            race_id INTEGER,
-            filename TEXT NOT NULL,
-            caption TEXT,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (race_id) REFERENCES races (id)
-        )
-    """)
-    
-    # Articles table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS articles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            content TEXT,
-            type TEXT DEFAULT 'manual',
-            url TEXT,
-            tags TEXT,
-            published_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    
-    # Races table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS races (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            race_name TEXT NOT NULL,
-            date DATE NOT NULL,
-            location TEXT,
-            time TEXT,
-            placement TEXT,
-            notes TEXT,
-            race_type TEXT DEFAULT 'running',
-            distance TEXT DEFAULT '5k',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    
-    # Spotify tokens table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS spotify_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            access_token TEXT NOT NULL,
-            refresh_token TEXT NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-
-    # Spotify profiles table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS spotify_profiles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            spotify_id TEXT NOT NULL,
-            display_name TEXT NOT NULL,
-            email TEXT,
-            country TEXT,
-            profile_image TEXT,
-            followers_count INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-
-    # Spotify tracks table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS spotify_tracks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            spotify_id TEXT NOT NULL,
-            track_name TEXT NOT NULL,
-            artist TEXT NOT NULL,
-            album TEXT,
-            album_art TEXT,
-            duration_ms INTEGER,
-            popularity INTEGER,
-            preview_url TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """)
-    
-    # Insert default admin user if not exists
-    cursor.execute("SELECT * FROM users WHERE username = 'admin'")
-    if not cursor.fetchone():
-        # In production, use proper password hashing
-        cursor.execute("""
-            INSERT INTO users (username, email, password_hash, name, bio)
-            VALUES (?, ?, ?, ?, ?)
-        """, ("admin", "admin@example.com", "admin123", "Maya A. Ramirez", "Admin user"))
-    
-    conn.commit()
-    conn.close()
-    
-    # Run database migrations
+    """Bring the database schema up to date"""
     run_migrations()
 
-def run_migrations():
-    """Run database migrations to update existing tables"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    try:
-        # Check if spotify_profiles table exists and has the right columns
-        cursor.execute("PRAGMA table_info(spotify_profiles)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        # Add missing columns if they don't exist
-        if 'profile_image' not in columns:
-            print("ðŸ”„ Adding profile_image column to spotify_profiles table...")
-            cursor.execute("ALTER TABLE spotify_profiles ADD COLUMN profile_image TEXT")
-        
-        if 'followers_count' not in columns:
-            print("ðŸ”„ Adding followers_count column to spotify_profiles table...")
-            cursor.execute("ALTER TABLE spotify_profiles ADD COLUMN followers_count INTEGER")
-        
-        # Check if spotify_tracks table has the right columns
-        cursor.execute("PRAGMA table_info(spotify_tracks)")
-        track_columns = [column[1] for column in cursor.fetchall()]
-        
-        if 'duration_ms' not in track_columns:
-            print("ðŸ”„ Adding duration_ms column to spotify_tracks table...")
-            cursor.execute("ALTER TABLE spotify_tracks ADD COLUMN duration_ms INTEGER")
-        
-        if 'popularity' not in track_columns:
-            print("ðŸ”„ Adding popularity column to spotify_tracks table...")
-            cursor.execute("ALTER TABLE spotify_tracks ADD COLUMN popularity INTEGER")
-        
-        if 'preview_url' not in track_columns:
-            print("ðŸ”„ Adding preview_url column to spotify_tracks table...")
-            cursor.execute("ALTER TABLE spotify_tracks ADD COLUMN preview_url TEXT")
-        
-        conn.commit()
-        print("âœ… Database migrations completed successfully")
-        
-    except Exception as e:
-        print(f"âš ï¸ Warning: Some migrations failed: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
-
 # Pydantic models for request/response
 class UserBase(BaseModel):
     username: str
@@ -475,28 +242,250 @@ class Song(SongBase):
     class Config:
         from_attributes = True
 
-# Authentication helper
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+PageItem = TypeVar("PageItem")
+
+class Page(BaseModel, Generic[PageItem]):
+    items: List[PageItem]
+    next_cursor: Optional[str] = None
+
+class SectionError(BaseModel):
+    status: int
+    detail: str
+    retry_after: Optional[int] = None
+
+class StravaDashboard(BaseModel):
+    athlete: Optional[StravaAthlete] = None
+    activities: Optional[List[StravaActivity]] = None
+    errors: Dict[str, SectionError] = {}
+
+# Async data-access layer
+users_repo = UserRepository()
+articles_repo = ArticleRepository()
+races_repo = RaceRepository()
+workouts_repo = WorkoutRepository()
+songs_repo = SongRepository()
+fitness_repo = FitnessRepository()
+tokens_repo = TokenRepository()
+
+# Cached token claims and user rows
+identity = IdentityService(SECRET_KEY, ALGORITHM, users_repo)
+
+# Authentication helpers
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict:
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return username
+        payload = identity.decode(credentials.credentials)
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    username: str = payload.get("sub")
+    if username is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    user = await identity.get_user(username)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+async def get_admin_user() -> Optional[Dict]:
+    """The site owner's user row (None if it doesn't exist yet)"""
+    return await identity.get_user('admin')
+
+# Pagination helper
+async def fetch_page(page, limit: Optional[int], cursor: Optional[str]) -> Dict:
+    """Fetch one keyset page as {"items", "next_cursor"}"""
+    try:
+        items, next_cursor = await page(limit or DEFAULT_PAGE_SIZE, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"items": items, "next_cursor": next_cursor}
+
+def rate_limited(error: RateLimitExceeded) -> HTTPException:
+    """429 telling the client when the Strava quota frees up"""
+    return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+def section_error(error: BaseException) -> Dict:
+    """How a failed dashboard section is reported"""
+    if isinstance(error, RateLimitExceeded):
+        return {"status": 429, "detail": str(error), "retry_after": error.retry_after}
+    if isinstance(error, HTTPException):
+        return {"status": error.status_code, "detail": str(error.detail)}
+    return {"status": 502, "detail": str(error)}
+
+async def compose_dashboard(sections: Dict[str, Awaitable]) -> Dict:
+    """Await every section concurrently; a failed section is None and reported under errors"""
+    results = await asyncio.gather(*sections.values(), return_exceptions=True)
+    payload, errors = {}, {}
+    for name, result in zip(sections, results):
+        if isinstance(result, Exception):
+            print(f"⚠️ Dashboard section {name} failed: {result}")
+            payload[name], errors[name] = None, section_error(result)
+        else:
+            payload[name] = result
+    return {**payload, "errors": errors}
 
 # Initialize Strava services
-strava_api = StravaAPI()
+strava_api = AsyncStravaAPI()
 strava_sync = StravaDataSync()
 
 # Initialize Spotify services
-spotify_api = SpotifyAPI()
+spotify_api = AsyncSpotifyAPI()
 spotify_sync = SpotifyDataSyncClass()
 
 # Override the redirect URI to match Spotify's requirements
 spotify_api.redirect_uri = "http://127.0.0.1:3000/auth/spotify/callback"
 
+# Spotify reads go through a memory + disk cache; seconds each response stays fresh
+spotify_cache = ResponseCache()
+SPOTIFY_CACHE_TTLS = {
+    "profile": 60 * 60,
+    "top_tracks": 6 * 60 * 60,  # Spotify recomputes these about once a day
+    "recently_played": 60,
+}
+
+async def spotify_read(user_id: int, endpoint: str, fetch, *args, access_token: Optional[str] = None):
+    """Cached Spotify read; fetch(access_token, *args) runs on a miss or when the entry goes stale"""
+    async def load():
+        if access_token:
+            return await fetch(access_token, *args)
+        tokens = await run_in_threadpool(spotify_sync.get_valid_tokens, user_id)
+        if not tokens:
+            raise HTTPException(status_code=401, detail="Spotify not connected")
+        return await fetch(tokens['access_token'], *args)
+    
+    key = ":".join(["spotify", str(user_id), endpoint, *map(str, args)])
+    return await spotify_cache.get(key, SPOTIFY_CACHE_TTLS[endpoint], load)
+
+async def spotify_top_tracks(user_id: int, time_range: str, limit: int, access_token: Optional[str] = None):
+    """Cached top tracks; every fresh fetch is also saved to the songs table"""
+    async def fetch_top_tracks(access_token, time_range, limit):
+        tracks = await spotify_api.get_top_tracks(access_token, time_range, limit)
+        # Keep the stored copy in step with every fresh fetch
+        try:
+            await run_in_threadpool(spotify_sync.save_top_tracks, user_id, tracks)
+        except Exception as save_error:
+            print(f"⚠️ Warning: Could not save tracks to database: {save_error}")
+        return tracks
+    
+    return await spotify_read(user_id, "top_tracks", fetch_top_tracks, time_range, limit, access_token=access_token)
+
+async def fetch_owner_playback() -> Optional[Dict]:
+    """The site owner's Spotify playback (None when nothing is playing)"""
+    user = await get_admin_user()
+    tokens = await run_in_threadpool(spotify_sync.get_valid_tokens, user['id']) if user else None
+    if not tokens:
+        raise HTTPException(status_code=401, detail="Spotify not connected")
+    return await spotify_api.get_current_playback(tokens['access_token'])
+
+# Liveness probes: only run when no other call has reached the provider lately
+strava_probe_api = AsyncStravaAPI(priority=BACKGROUND)
+
+async def probe_strava() -> Optional[Dict]:
+    """The athlete behind the owner's Strava token (None when not connected)"""
+    user = await get_admin_user()
+    tokens = await run_in_threadpool(strava_sync.get_valid_tokens, user['id']) if user else None
+    if not tokens:
+        return None
+    athlete = await strava_probe_api.get_athlete(tokens['access_token'])
+    return {"id": athlete.get('id'), "firstname": athlete.get('firstname'), "lastname": athlete.get('lastname')}
+
+async def probe_spotify() -> Optional[Dict]:
+    """The profile behind the owner's Spotify token (None when not connected)"""
+    user = await get_admin_user()
+    tokens = await run_in_threadpool(spotify_sync.get_valid_tokens, user['id']) if user else None
+    if not tokens:
+        return None
+    profile = await spotify_api.get_user_profile(tokens['access_token'])
+    return {"id": profile.get('id'), "display_name": profile.get('display_name'), "email": profile.get('email')}
+
+# One upstream poller for now-playing, however many visitors are watching
+now_playing = PlaybackPoller(fetch_owner_playback)
+NOW_PLAYING_HEARTBEAT_SECONDS = 15
+
+def run_strava_sync(payload: Dict) -> Dict:
+    """New activities plus up to max_pages pages of older history (one for a plain sync)"""
+    result = strava_sync.backfill(payload['user_id'], per_page=payload['limit'], max_pages=payload.get('max_pages', 1))
+    if result.get('deferred_until'):
+        # Pages so far are checkpointed; requeue the job to carry on once the quota resets
+        raise RateLimitDeferred(
+            f"Strava sync deferred until {result['deferred_until']} after {result['synced_count']} new activities",
+            datetime.fromisoformat(result['deferred_until']).timestamp()
+        )
+    return result
+
+def run_spotify_plays(payload: Dict) -> Dict:
+    return spotify_sync.sync_recently_played(payload['user_id'])
+
+def run_top_tracks(payload: Dict) -> Dict:
+    return spotify_sync.sync_top_tracks(payload['user_id'])
+
+# Syncs only ever run as queued jobs, so two can't work the same user's checkpoint at once
+job_queue = JobQueue()
+job_queue.register("strava.sync", run_strava_sync, timeout=15 * 60)
+job_queue.register("spotify.recently_played", run_spotify_plays)
+job_queue.register("spotify.top_tracks", run_top_tracks)
+# Job workers in this process; 0 leaves the queue to `python -m worker`
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+job_workers = WorkerPool(job_queue, JOB_WORKERS)
+
+def enqueue_strava_sync(user_id: int, limit: int, priority: int, max_pages: int = 1) -> Tuple[int, bool]:
+    """Queue a Strava sync or backfill, or return the one already queued or running for this user"""
+    return job_queue.enqueue(
+        "strava.sync", {'user_id': user_id, 'limit': limit, 'max_pages': max_pages}, priority, f"strava.sync:{user_id}"
+    )
+
+# Background sync jobs; these run in a worker thread, so they use the sync clients
+def owner_id() -> Optional[int]:
+    """The site owner's user id (background jobs can't use the async identity cache)"""
+    with get_pool().connection() as conn:
+        row = conn.execute(USER_BY_USERNAME, ('admin',)).fetchone()
+    return row['id'] if row else None
+
+# The scheduler's last queued job of each kind, whose result sets the next interval
+last_scheduled_jobs: Dict[str, int] = {}
+
+def enqueue_scheduled(kind: str, payload: Dict) -> Dict:
+    """Queue a scheduled job (sharing one already queued for the user) and report what the previous one found"""
+    previous = job_queue.get(last_scheduled_jobs[kind]) if kind in last_scheduled_jobs else None
+    job_id, created = job_queue.enqueue(kind, payload, PRIORITY_NORMAL, f"{kind}:{payload['user_id']}")
+    last_scheduled_jobs[kind] = job_id
+    return {'job_id': job_id, 'deduplicated': not created, 'previous': previous and previous['result']}
+
+def scheduled_strava_sync() -> Dict:
+    user_id = owner_id()
+    if not user_id or not strava_sync.get_valid_tokens(user_id):
+        return {'skipped': 'Strava not connected'}
+    return enqueue_scheduled("strava.sync", {'user_id': user_id, 'limit': 50, 'max_pages': 1})
+
+def scheduled_spotify_plays() -> Dict:
+    user_id = owner_id()
+    if not user_id or not spotify_sync.get_valid_tokens(user_id):
+        return {'skipped': 'Spotify not connected'}
+    return enqueue_scheduled("spotify.recently_played", {'user_id': user_id})
+
+def scheduled_top_tracks() -> Dict:
+    user_id = owner_id()
+    if not user_id or not spotify_sync.get_valid_tokens(user_id):
+        return {'skipped': 'Spotify not connected'}
+    return enqueue_scheduled("spotify.top_tracks", {'user_id': user_id})
+
+def previous_result(result: Dict) -> Dict:
+    """What the previously queued job found ({} while it hasn't finished)"""
+    return result.get('previous') or {}
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() not in ("0", "false", "no")
+# Only one uvicorn worker (the lease holder) queues these; the job workers run them
+scheduler = Scheduler([
+    Job("strava_sync", scheduled_strava_sync, lambda result: previous_result(result).get('synced_count', 0) > 0,
+        min_interval=15 * 60, max_interval=6 * 60 * 60),
+    # Spotify only returns the last 50 plays, so this can't back off much further than a couple of hours
+    Job("spotify_recently_played", scheduled_spotify_plays,
+        lambda result: previous_result(result).get('plays', 0) > 0 or previous_result(result).get('more', False),
+        min_interval=10 * 60, max_interval=2 * 60 * 60),
+    Job("spotify_top_tracks", scheduled_top_tracks, lambda result: previous_result(result).get('changed', False),
+        min_interval=6 * 60 * 60, max_interval=24 * 60 * 60),
+], Lease("background-sync"))
+
 # Test endpoint
 @app.get("/")
 async def root():
@@ -509,11 +498,7 @@ async def health_check():
     # Test database connection
     db_status = "healthy"
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.fetchone()
-        conn.close()
+        await run_db(lambda conn: conn.execute("SELECT 1").fetchone())
     except Exception as e:
         db_status = f"error: {str(e)}"
     
@@ -522,7 +507,10 @@ async def health_check():
         "timestamp": datetime.now().isoformat(),
         "database": db_status,
         "strava_configured": bool(os.getenv('STRAVA_CLIENT_ID') and os.getenv('STRAVA_CLIENT_SECRET')),
-        "spotify_configured": bool(os.getenv('SPOTIFY_CLIENT_ID') and os.getenv('SPOTIFY_CLIENT_SECRET'))
+        "spotify_configured": bool(os.getenv('SPOTIFY_CLIENT_ID') and os.getenv('SPOTIFY_CLIENT_SECRET')),
+        "upstream_calls": upstream_calls.stats(),
+        "now_playing": now_playing.stats(),
+        "job_workers": job_workers.stats()
     }
 
 @app.get("/debug/strava-config")
@@ -556,37 +544,20 @@ async def debug_spotify_config():
 @app.get("/api/test/db")
 async def test_database():
     """Test database connection"""
-    conn = None
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Test basic query
-        cursor.execute("SELECT COUNT(*) as count FROM users")
-        user_count = cursor.fetchone()['count']
-        
-        # Test Strava tables
-        cursor.execute("SELECT COUNT(*) as count FROM strava_tokens")
-        token_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM strava_athletes")
-        athlete_count = cursor.fetchone()['count']
-        
-        # Test Spotify tables
-        cursor.execute("SELECT COUNT(*) as count FROM spotify_tokens")
-        spotify_token_count = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM spotify_tracks")
-        spotify_track_count = cursor.fetchone()['count']
+        # Test basic query plus the Strava and Spotify tables
+        counts = await count_rows([
+            "users", "strava_tokens", "strava_athletes", "spotify_tokens", "spotify_tracks"
+        ])
         
         return {
             "status": "success",
             "database": "connected",
-            "user_count": user_count,
-            "strava_tokens_count": token_count,
-            "strava_athletes_count": athlete_count,
-            "spotify_tokens_count": spotify_token_count,
-            "spotify_tracks_count": spotify_track_count
+            "user_count": counts["users"],
+            "strava_tokens_count": counts["strava_tokens"],
+            "strava_athletes_count": counts["strava_athletes"],
+            "spotify_tokens_count": counts["spotify_tokens"],
+            "spotify_tracks_count": counts["spotify_tracks"]
         }
     except Exception as e:
         print(f"âŒ Database test error: {e}")
@@ -597,27 +568,11 @@ async def test_database():
             "database": "failed",
             "error": str(e)
         }
-    finally:
-        if conn:
-            conn.close()
 
 # Users endpoints
 @app.get("/api/users/me", response_model=User)
-async def get_current_user_info(current_user: str = Depends(get_current_user)):
-    conn = None
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = ?", (current_user,))
-        user = cursor.fetchone()
-        
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        return dict(user)
-    finally:
-        if conn:
-            conn.close()
+async def get_current_user_info(user: Dict = Depends(get_current_user)):
+    return dict(user)
 
 # Strava API endpoints
 @app.get("/api/strava/auth")
@@ -637,7 +592,7 @@ async def strava_auth():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/strava/callback")
-async def strava_callback(code: str, state: Optional[str] = None):
+async def strava_callback(code: str, state: Optional[str] = None, user: Optional[Dict] = Depends(get_admin_user)):
     """Handle Strava OAuth callback"""
     try:
         print(f"ðŸ” Callback received with code: {code[:10]}...")
@@ -645,17 +600,11 @@ async def strava_callback(code: str, state: Optional[str] = None):
         
         # Exchange code for tokens
         print("ðŸ”„ Exchanging code for tokens...")
-        tokens = strava_api.exchange_code_for_token(code)
+        tokens = await strava_api.exchange_code_for_token(code)
         print(f"âœ… Tokens received: {list(tokens.keys())}")
         
         # For now, use the default admin user (you can enhance this later)
         print("ðŸ‘¤ Getting admin user...")
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
-        
         if not user:
             raise HTTPException(status_code=404, detail="Default user not found")
         
@@ -664,7 +613,7 @@ async def strava_callback(code: str, state: Optional[str] = None):
         # Save tokens to database
         print("ðŸ’¾ Saving tokens to database...")
         try:
-            strava_sync.save_tokens(user['id'], tokens)
+            await run_in_threadpool(strava_sync.save_tokens, user['id'], tokens)
             print("âœ… Tokens saved successfully")
         except Exception as token_error:
             print(f"âŒ Token save error: {token_error}")
@@ -673,7 +622,7 @@ async def strava_callback(code: str, state: Optional[str] = None):
         # Get athlete info
         print("ï¿½ï¿½â€â™€ï¸ Getting athlete info...")
         try:
-            athlete = strava_api.get_athlete(tokens['access_token'])
+            athlete = await strava_api.get_athlete(tokens['access_token'])
             print(f"âœ… Athlete info received: {athlete.get('firstname', 'Unknown')} {athlete.get('lastname', 'Unknown')}")
         except Exception as athlete_error:
             print(f"âŒ Athlete fetch error: {athlete_error}")
@@ -682,20 +631,7 @@ async def strava_callback(code: str, state: Optional[str] = None):
         # Save athlete info to database
         print("ðŸ’¾ Saving athlete info to database...")
         try:
-            conn = get_db()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT OR REPLACE INTO strava_athletes 
-                (id, user_id, username, firstname, lastname, city, state, country, sex, premium, profile_medium, profile)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                athlete['id'], user['id'], athlete.get('username'), athlete.get('firstname'),
-                athlete.get('lastname'), athlete.get('city'), athlete.get('state'),
-                athlete.get('country'), athlete.get('sex'), athlete.get('premium', False),
-                athlete.get('profile_medium'), athlete.get('profile')
-            ))
-            conn.commit()
-            conn.close()
+            await run_in_threadpool(strava_sync.save_athlete, user['id'], athlete)
             print("âœ… Athlete info saved successfully")
         except Exception as db_error:
             print(f"âŒ Database save error: {db_error}")
@@ -721,377 +657,372 @@ async def strava_callback(code: str, state: Optional[str] = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/strava/athlete", response_model=StravaAthlete)
-async def get_strava_athlete():
+async def get_strava_athlete(user: Optional[Dict] = Depends(get_admin_user)):
     """Get Strava athlete profile"""
-    conn = None
     try:
-        # Get user ID and tokens
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         print(f"ðŸ” Checking tokens for user {user['id']}")
-        tokens = strava_sync.get_valid_tokens(user['id'])
+        tokens = await run_in_threadpool(strava_sync.get_valid_tokens, user['id'])
         if not tokens:
             print("âŒ No valid tokens found")
             raise HTTPException(status_code=401, detail="Strava not connected")
         
         print(f"âœ… Tokens found, fetching athlete info...")
         # Get athlete info
-        athlete = strava_api.get_athlete(tokens['access_token'])
+        athlete = await strava_api.get_athlete(tokens['access_token'])
         print(f"âœ… Athlete info retrieved: {athlete.get('firstname', 'Unknown')}")
         
         return athlete
+    except RateLimitExceeded as e:
+        raise rate_limited(e)
     except Exception as e:
         print(f"âŒ Error in get_strava_athlete: {e}")
         import traceback
         print(f"âŒ Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
 
 @app.get("/api/strava/activities", response_model=List[StravaActivity])
 async def get_strava_activities(
     page: int = 1, 
     per_page: int = 30,
     after: Optional[int] = None,
-    before: Optional[int] = None
+    before: Optional[int] = None,
+    user: Optional[Dict] = Depends(get_admin_user)
 ):
     """Get Strava activities"""
-    conn = None
     try:
-        # Get user ID and tokens
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         print(f"ðŸ” Checking tokens for user {user['id']} to get activities")
-        tokens = strava_sync.get_valid_tokens(user['id'])
+        tokens = await run_in_threadpool(strava_sync.get_valid_tokens, user['id'])
         if not tokens:
             print("âŒ No valid tokens found for activities")
             raise HTTPException(status_code=401, detail="Strava not connected")
         
         print(f"âœ… Tokens found, fetching activities (page {page}, per_page {per_page})...")
         # Get activities from Strava
-        activities = strava_api.get_activities(tokens['access_token'], page, per_page)
+        activities = await strava_api.get_activities(tokens['access_token'], page, per_page, after, before)
         print(f"âœ… Retrieved {len(activities)} activities")
         
         return activities
+    except RateLimitExceeded as e:
+        raise rate_limited(e)
     except Exception as e:
         print(f"âŒ Error in get_strava_activities: {e}")
         import traceback
         print(f"âŒ Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
 
 @app.get("/api/strava/activities/{activity_id}", response_model=StravaActivity)
-async def get_strava_activity(activity_id: int):
+async def get_strava_activity(activity_id: int, user: Optional[Dict] = Depends(get_admin_user)):
     """Get specific Strava activity"""
-    conn = None
     try:
-        # Get user ID and tokens
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        tokens = strava_sync.get_valid_tokens(user['id'])
+        tokens = await run_in_threadpool(strava_sync.get_valid_tokens, user['id'])
         if not tokens:
             raise HTTPException(status_code=401, detail="Strava not connected")
         
         # Get activity from Strava
-        activity = strava_api.get_activity(activity_id, tokens['access_token'])
+        activity = await strava_api.get_activity(tokens['access_token'], activity_id)
         
         return activity
+    except RateLimitExceeded as e:
+        raise rate_limited(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
 
-@app.post("/api/strava/sync")
-async def sync_strava_activities(limit: int = 50):
-    """Sync Strava activities to local database"""
+@app.get("/api/strava/activities/{activity_id}/streams")
+async def get_strava_activity_streams(
+    activity_id: str,
+    channels: Optional[str] = Query(None, description="Comma-separated stream types (default: all stored)"),
+    user: Optional[Dict] = Depends(get_admin_user)
+):
+    """Get an activity's stored streams"""
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    wanted = [channel.strip() for channel in channels.split(',') if channel.strip()] if channels else None
+    streams = await run_in_threadpool(strava_sync.get_streams, user['id'], activity_id, wanted)
+    if not streams:
+        raise HTTPException(status_code=404, detail="No streams stored for this activity")
+    return {channel: values.tolist() for channel, values in streams.items()}
+
+@app.post("/api/strava/streams/sync")
+async def sync_strava_streams(limit: int = Query(20, ge=1, le=200), user: Optional[Dict] = Depends(get_admin_user)):
+    """Fetch streams for synced activities that don't have them yet"""
     try:
-        # Get user ID
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
         
+        return await run_in_threadpool(strava_sync.sync_streams, user['id'], limit)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/strava/sync", status_code=202)
+async def sync_strava_activities(limit: int = Query(50, ge=1, le=BACKFILL_PAGE_SIZE), user: Optional[Dict] = Depends(get_admin_user)):
+    """Queue a Strava activity sync; GET /api/jobs/{job_id} for its progress and result"""
+    try:
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
+        if not await run_in_threadpool(strava_sync.tokens.state, user['id']):
+            raise HTTPException(status_code=401, detail="Strava not connected")
         
-        # Sync activities
-        result = strava_sync.sync_activities(user['id'], limit)
+        # A sync already queued or running for this user is reused rather than repeated
+        job_id, created = await run_in_threadpool(enqueue_strava_sync, user['id'], limit, PRIORITY_HIGH)
+        return {
+            "message": "Strava sync queued" if created else "Strava sync already in progress",
+            "job_id": job_id,
+            "deduplicated": not created,
+            "status_url": f"/api/jobs/{job_id}"
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/strava/backfill", status_code=202)
+async def backfill_strava_activities(max_pages: int = Query(10, ge=1), user: Optional[Dict] = Depends(get_admin_user)):
+    """Queue a sync of new activities plus up to max_pages pages further back through the history"""
+    try:
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        if not await run_in_threadpool(strava_sync.tokens.state, user['id']):
+            raise HTTPException(status_code=401, detail="Strava not connected")
         
+        # Shares the sync's dedup key: a sync or backfill already queued or running is reused
+        job_id, created = await run_in_threadpool(
+            enqueue_strava_sync, user['id'], BACKFILL_PAGE_SIZE, PRIORITY_HIGH, max_pages
+        )
         return {
-            "message": f"Synced {result['synced_count']} new activities",
-            "synced_count": result['synced_count'],
-            "total_activities": result['total_activities']
+            "message": "Strava backfill queued" if created else "Strava sync already in progress",
+            "job_id": job_id,
+            "deduplicated": not created,
+            "status_url": f"/api/jobs/{job_id}"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/strava/backfill")
+async def get_strava_backfill_status(user: Optional[Dict] = Depends(get_admin_user)):
+    """Get the Strava backfill checkpoint"""
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    state = await run_in_threadpool(strava_sync.get_sync_state, user['id'])
+    state['backfill_complete'] = bool(state['backfill_complete'])
+    return state
+
+@app.get("/api/strava/dashboard", response_model=StravaDashboard)
+async def get_strava_dashboard(
+    per_page: int = Query(10, ge=1, le=200),
+    user: Optional[Dict] = Depends(get_admin_user)
+):
+    """Athlete profile and latest activities in one response, fetched concurrently"""
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    tokens = await run_in_threadpool(strava_sync.get_valid_tokens, user['id'])
+    if not tokens:
+        raise HTTPException(status_code=401, detail="Strava not connected")
+    
+    access_token = tokens['access_token']
+    return await compose_dashboard({
+        "athlete": strava_api.get_athlete(access_token),
+        "activities": strava_api.get_activities(access_token, 1, per_page),
+    })
+
+@app.get("/api/scheduler")
+async def get_scheduler_status():
+    """Background sync jobs: which worker leads, and each job's interval, next run and last result"""
+    return await run_in_threadpool(scheduler.status)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: int):
+    """A queued job's status (queued, running, succeeded or failed), attempts and result"""
+    job = await run_in_threadpool(job_queue.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/api/strava/quota")
+async def get_strava_quota():
+    """Strava API quota usage for the 15-minute and daily windows"""
+    return strava_rate_limiter.snapshot()
+
 @app.get("/api/strava/summary")
-async def get_strava_summary(days: int = 30):
-    """Get Strava activity summary"""
+async def get_strava_summary(
+    days: int = 30,
+    start: Optional[str] = Query(None, pattern=DATE_PATTERN),
+    end: Optional[str] = Query(None, pattern=DATE_PATTERN),
+    period: Optional[str] = Query(None, pattern="^(week|month|year)$"),
+    user: Optional[Dict] = Depends(get_admin_user)
+):
+    """Get Strava activity summary from synced activities (last `days`, a start/end range, or this week/month/year)"""
     try:
-        # Get user ID
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Get summary
-        summary = strava_sync.get_activity_summary(user['id'], days)
+        summary = await run_in_threadpool(
+            strava_sync.get_activity_summary, user['id'], days, start, end, period
+        )
         
         return summary
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/strava/disconnect")
-async def disconnect_strava():
+async def disconnect_strava(user: Optional[Dict] = Depends(get_admin_user)):
     """Disconnect Strava and clear tokens"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        
         if user:
-            # Clear tokens
-            cursor.execute("DELETE FROM strava_tokens WHERE user_id = ?", (user['id'],))
-            # Clear athlete data
-            cursor.execute("DELETE FROM strava_athletes WHERE user_id = ?", (user['id'],))
-            # Clear activities
-            cursor.execute("DELETE FROM strava_activities WHERE user_id = ?", (user['id'],))
-            conn.commit()
+            # Clear tokens, athlete data and activities
+            await tokens_repo.clear_provider('strava', user['id'])
+            strava_sync.tokens.forget(user['id'])
+            strava_health.forget()
             print("âœ… Strava data cleared")
         
-        conn.close()
         return {"message": "Strava disconnected successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/strava/clear")
-async def clear_strava_tokens():
+async def clear_strava_tokens(user: Optional[Dict] = Depends(get_admin_user)):
     """Clear all Strava tokens and data (for troubleshooting)"""
-    conn = None
     try:
-        # Get user ID
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        
         if user:
             # Clear all Strava data
-            cursor.execute("DELETE FROM strava_tokens WHERE user_id = ?", (user['id'],))
-            cursor.execute("DELETE FROM strava_athletes WHERE user_id = ?", (user['id'],))
-            cursor.execute("DELETE FROM strava_activities WHERE user_id = ?", (user['id'],))
-            conn.commit()
+            await tokens_repo.clear_provider('strava', user['id'])
+            strava_sync.tokens.forget(user['id'])
+            strava_health.forget()
             print("ðŸ§¹ Cleared all Strava data for troubleshooting")
         
         return {"message": "Strava tokens and data cleared successfully"}
     except Exception as e:
         print(f"âŒ Error clearing Strava data: {e}")
         return {"error": str(e)}
-    finally:
-        if conn:
-            conn.close()
 
 @app.post("/api/db/reset")
 async def reset_database():
     """Reset database connections (for troubleshooting locked database)"""
     try:
-        # Force close any existing connections by reinitializing
-        init_db()
+        # Drop idle pooled connections and reinitialize
+        get_pool().reset()
+        await run_in_threadpool(init_db)
+        identity.invalidate()
+        strava_sync.tokens.forget()
+        spotify_sync.tokens.forget()
+        strava_health.forget()
+        spotify_health.forget()
         return {"message": "Database reset successfully"}
     except Exception as e:
         print(f"âŒ Error resetting database: {e}")
         return {"error": str(e)}
 
 @app.get("/api/strava/status")
-async def get_strava_status():
-    """Check if Strava is connected"""
-    conn = None
+async def get_strava_status(user: Optional[Dict] = Depends(get_admin_user)):
+    """Check if Strava is connected, from cached tokens and recent API outcomes (never calls Strava)"""
     try:
-        # Get user ID
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        
         if not user:
             return {"connected": False, "error": "User not found"}
         
-        # Check if tokens exist
-        cursor.execute("""
-            SELECT access_token, refresh_token, expires_at 
-            FROM strava_tokens 
-            WHERE user_id = ?
-        """, (user['id'],))
-        
-        tokens = cursor.fetchone()
-        
-        if not tokens:
-            return {"connected": False, "message": "No tokens found"}
-        
-        access_token, refresh_token, expires_at = tokens
-        expires_at = datetime.fromisoformat(expires_at)
-        
-        # Check if token is expired
-        if datetime.now() >= expires_at:
-            return {"connected": False, "message": "Token expired", "expired_at": expires_at.isoformat()}
-        
-        # Check if we can get athlete info
-        try:
-            athlete = strava_api.get_athlete(access_token)
-            return {
-                "connected": True,
-                "athlete": {
-                    "id": athlete.get('id'),
-                    "firstname": athlete.get('firstname'),
-                    "lastname": athlete.get('lastname')
-                },
-                "token_expires": expires_at.isoformat()
-            }
-        except Exception as e:
-            return {"connected": False, "message": f"Token invalid: {str(e)}"}
-            
+        return strava_health.status(await run_in_threadpool(strava_sync.tokens.state, user['id']))
     except Exception as e:
         print(f"âŒ Error in get_strava_status: {e}")
         return {"connected": False, "error": str(e)}
-    finally:
-        if conn:
-            conn.close()
 
 # Articles endpoints
-@app.get("/api/articles", response_model=List[Article])
-async def get_articles():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM articles ORDER BY published_at DESC")
-    articles = [dict(article) for article in cursor.fetchall()]
-    conn.close()
-    return articles
+# List endpoints return the whole table as a plain list unless `limit` or
+# `cursor` is given, in which case they return a Page with `next_cursor`
+@app.get("/api/articles", response_model=Union[List[Article], Page[Article]])
+async def get_articles(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    if limit is None and cursor is None:
+        return await articles_repo.list_articles()
+    return await fetch_page(articles_repo.page_articles, limit, cursor)
 
 @app.post("/api/articles", response_model=Article)
-async def create_article(article: ArticleBase, current_user: str = Depends(get_current_user)):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get user ID
-    cursor.execute("SELECT id FROM users WHERE username = ?", (current_user,))
-    user = cursor.fetchone()
-    if not user:
-        conn.close()
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    cursor.execute("""
-        INSERT INTO articles (user_id, title, content, type, url, tags)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (user['id'], article.title, article.content, article.type, article.url, article.tags))
-    
-    article_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+async def create_article(article: ArticleBase, user: Dict = Depends(get_current_user)):
+    article_id = await articles_repo.create(
+        user['id'], article.title, article.content, article.type, article.url, article.tags
+    )
     
     return {**article.dict(), "id": article_id, "user_id": user['id'], "published_at": datetime.now()}
 
 # Races endpoints
-@app.get("/api/races", response_model=List[Race])
-async def get_races():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM races ORDER BY date DESC")
-    races = [dict(race) for race in cursor.fetchall()]
-    conn.close()
-    return races
+@app.get("/api/races", response_model=Union[List[Race], Page[Race]])
+async def get_races(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    if limit is None and cursor is None:
+        return await races_repo.list_races()
+    return await fetch_page(races_repo.page_races, limit, cursor)
 
 # Workouts endpoints
-@app.get("/api/workouts", response_model=List[Workout])
-async def get_workouts():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM workouts ORDER BY date DESC")
-    workouts = [dict(workout) for workout in cursor.fetchall()]
-    conn.close()
-    return workouts
+@app.get("/api/workouts", response_model=Union[List[Workout], Page[Workout]])
+async def get_workouts(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    if limit is None and cursor is None:
+        return await workouts_repo.list_workouts()
+    return await fetch_page(workouts_repo.page_workouts, limit, cursor)
 
 @app.post("/api/workouts", response_model=Workout)
-async def create_workout(workout: WorkoutBase, current_user: str = Depends(get_current_user)):
-    conn = get_db()
-    cursor = conn.cursor()
+async def create_workout(workout: WorkoutBase, user: Dict = Depends(get_current_user)):
+    workout_id = await workouts_repo.create(
+        user['id'], workout.type, workout.distance, workout.duration, workout.date, workout.elevation
+    )
     
-    # Get user ID
-    cursor.execute("SELECT id FROM users WHERE username = ?", (current_user,))
-    user = cursor.fetchone()
+    return {**workout.dict(), "id": workout_id, "user_id": user['id'], "created_at": datetime.now()}
+
+# Fitness endpoints
+@app.get("/api/fitness/rollups")
+async def get_fitness_rollups(
+    grain: str = Query("week", pattern="^(day|week|month|year)$"),
+    start: Optional[str] = Query(None, alias="from", pattern=DATE_PATTERN),
+    end: Optional[str] = Query(None, alias="to", pattern=DATE_PATTERN),
+    user: Optional[Dict] = Depends(get_admin_user)
+):
+    """Workout totals per day/week/month/year (weeks start on Monday), read from the rollup table"""
     if not user:
-        conn.close()
         raise HTTPException(status_code=404, detail="User not found")
     
-    cursor.execute("""
-        INSERT INTO workouts (user_id, type, distance, duration, date, elevation)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (user['id'], workout.type, workout.distance, workout.duration, workout.date, workout.elevation))
-    
-    workout_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return {**workout.dict(), "id": workout_id, "user_id": user['id'], "created_at": datetime.now()}
+    try:
+        periods = await fitness_repo.rollups(user['id'], grain, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"grain": grain, "periods": periods}
 
 # Songs endpoints
-@app.get("/api/songs", response_model=List[Song])
-async def get_songs():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM songs ORDER BY pinned_at DESC")
-    songs = [dict(song) for song in cursor.fetchall()]
-    conn.close()
-    return songs
+@app.get("/api/songs", response_model=Union[List[Song], Page[Song]])
+async def get_songs(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    if limit is None and cursor is None:
+        return await songs_repo.list_songs()
+    return await fetch_page(songs_repo.page_songs, limit, cursor)
 
 @app.post("/api/songs", response_model=Song)
-async def create_song(song: SongBase, current_user: str = Depends(get_current_user)):
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get user ID
-    cursor.execute("SELECT id FROM users WHERE username = ?", (current_user,))
-    user = cursor.fetchone()
-    if not user:
-        conn.close()
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    cursor.execute("""
-        INSERT INTO songs (user_id, track_name, artist, album, album_art, personal_note)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (user['id'], song.track_name, song.artist, song.album, song.album_art, song.personal_note))
-    
-    song_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+async def create_song(song: SongBase, user: Dict = Depends(get_current_user)):
+    song_id = await songs_repo.create(
+        user['id'], song.track_name, song.artist, song.album, song.album_art, song.personal_note
+    )
     
     return {**song.dict(), "id": song_id, "user_id": user['id'], "pinned_at": datetime.now()}
 
@@ -1108,7 +1039,7 @@ async def spotify_auth():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/spotify/callback")
-async def spotify_callback(code: str):
+async def spotify_callback(code: str, user: Optional[Dict] = Depends(get_admin_user)):
     """Handle Spotify OAuth callback"""
     try:
         print(f"ðŸŽµ Spotify OAuth callback received with code: {code[:10]}...")
@@ -1116,26 +1047,19 @@ async def spotify_callback(code: str):
         # Exchange code for tokens
         print("ðŸ”„ Exchanging code for tokens...")
         try:
-            tokens = spotify_api.exchange_code_for_token(code)
+            tokens = await spotify_api.exchange_code_for_token(code)
             print(f"âœ… Token exchange successful: {list(tokens.keys())}")
         except Exception as token_error:
             print(f"âŒ Token exchange error: {token_error}")
             raise token_error
         
-        # Get user ID
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Save tokens to database
         print("ðŸ’¾ Saving Spotify tokens to database...")
         try:
-            spotify_sync.save_tokens(user['id'], tokens)
+            await run_in_threadpool(spotify_sync.save_tokens, user['id'], tokens)
             print("âœ… Spotify tokens saved successfully")
         except Exception as token_error:
             print(f"âŒ Token save error: {token_error}")
@@ -1144,7 +1068,7 @@ async def spotify_callback(code: str):
         # Get user profile
         print("ðŸŽµ Getting Spotify user profile...")
         try:
-            profile = spotify_api.get_user_profile(tokens['access_token'])
+            profile = await spotify_api.get_user_profile(tokens['access_token'])
             print(f"âœ… Profile received: {profile.get('display_name', 'Unknown')}")
         except Exception as profile_error:
             print(f"âŒ Profile fetch error: {profile_error}")
@@ -1153,7 +1077,7 @@ async def spotify_callback(code: str):
         # Save profile to database
         print("ðŸ’¾ Saving Spotify profile to database...")
         try:
-            spotify_sync.save_user_profile(user['id'], profile)
+            await run_in_threadpool(spotify_sync.save_user_profile, user['id'], profile)
             print("âœ… Spotify profile saved successfully")
         except Exception as db_error:
             print(f"âŒ Database save error: {db_error}")
@@ -1178,7 +1102,7 @@ async def spotify_callback(code: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/spotify/frontend-callback")
-async def spotify_frontend_callback(code: str):
+async def spotify_frontend_callback(code: str, user: Optional[Dict] = Depends(get_admin_user)):
     """Handle Spotify OAuth callback from frontend (port 3000)"""
     try:
         print(f"ðŸŽµ Spotify frontend callback received with code: {code[:10]}...")
@@ -1186,26 +1110,19 @@ async def spotify_frontend_callback(code: str):
         # Exchange code for tokens
         print("ðŸ”„ Exchanging code for tokens...")
         try:
-            tokens = spotify_api.exchange_code_for_token(code)
+            tokens = await spotify_api.exchange_code_for_token(code)
             print(f"âœ… Token exchange successful: {list(tokens.keys())}")
         except Exception as token_error:
             print(f"âŒ Token exchange error: {token_error}")
             raise token_error
         
-        # Get user ID
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Save tokens to database
         print("ðŸ’¾ Saving Spotify tokens to database...")
         try:
-            spotify_sync.save_tokens(user['id'], tokens)
+            await run_in_threadpool(spotify_sync.save_tokens, user['id'], tokens)
             print("âœ… Spotify tokens saved successfully")
         except Exception as token_error:
             print(f"âŒ Token save error: {token_error}")
@@ -1214,7 +1131,7 @@ async def spotify_frontend_callback(code: str):
         # Get user profile
         print("ðŸŽµ Getting Spotify user profile...")
         try:
-            profile = spotify_api.get_user_profile(tokens['access_token'])
+            profile = await spotify_api.get_user_profile(tokens['access_token'])
             print(f"âœ… Profile received: {profile.get('display_name', 'Unknown')}")
         except Exception as profile_error:
             print(f"âŒ Profile fetch error: {profile_error}")
@@ -1223,7 +1140,7 @@ async def spotify_frontend_callback(code: str):
         # Save profile to database
         print("ðŸ’¾ Saving Spotify profile to database...")
         try:
-            spotify_sync.save_user_profile(user['id'], profile)
+            await run_in_threadpool(spotify_sync.save_user_profile, user['id'], profile)
             print("âœ… Spotify profile saved successfully")
         except Exception as db_error:
             print(f"âŒ Database save error: {db_error}")
@@ -1248,29 +1165,13 @@ async def spotify_frontend_callback(code: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/spotify/profile")
-async def get_spotify_profile():
+async def get_spotify_profile(user: Optional[Dict] = Depends(get_admin_user)):
     """Get Spotify user profile"""
     try:
-        # Get user ID and tokens
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        print(f"ðŸ” Checking Spotify tokens for user {user['id']}")
-        tokens = spotify_sync.get_valid_tokens(user['id'])
-        if not tokens:
-            print("âŒ No valid Spotify tokens found")
-            raise HTTPException(status_code=401, detail="Spotify not connected")
-        
-        print(f"âœ… Spotify tokens found, fetching profile...")
-        # Get profile from Spotify
-        profile = spotify_api.get_user_profile(tokens['access_token'])
-        print(f"âœ… Spotify profile retrieved: {profile.get('display_name', 'Unknown')}")
+        profile = await spotify_read(user['id'], "profile", spotify_api.get_user_profile)
         
         return profile
     except Exception as e:
@@ -1282,37 +1183,15 @@ async def get_spotify_profile():
 @app.get("/api/spotify/top-tracks")
 async def get_spotify_top_tracks(
     time_range: str = 'short_term',
-    limit: int = 20
+    limit: int = 20,
+    user: Optional[Dict] = Depends(get_admin_user)
 ):
     """Get Spotify top tracks"""
     try:
-        # Get user ID and tokens
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        print(f"ðŸ” Checking Spotify tokens for user {user['id']} to get top tracks")
-        tokens = spotify_sync.get_valid_tokens(user['id'])
-        if not tokens:
-            print("âŒ No valid Spotify tokens found for top tracks")
-            raise HTTPException(status_code=401, detail="Spotify not connected")
-        
-        print(f"âœ… Spotify tokens found, fetching top tracks (time_range: {time_range}, limit: {limit})...")
-        # Get top tracks from Spotify
-        tracks = spotify_api.get_top_tracks(tokens['access_token'], time_range, limit)
-        print(f"âœ… Retrieved {len(tracks)} top tracks")
-        
-        # Save tracks to database
-        try:
-            spotify_sync.save_top_tracks(user['id'], tracks)
-            print("âœ… Top tracks saved to database")
-        except Exception as save_error:
-            print(f"âš ï¸ Warning: Could not save tracks to database: {save_error}")
+        tracks = await spotify_top_tracks(user['id'], time_range, limit)
         
         return tracks
     except Exception as e:
@@ -1322,157 +1201,141 @@ async def get_spotify_top_tracks(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/spotify/recently-played")
-async def get_spotify_recently_played(limit: int = 20):
+async def get_spotify_recently_played(limit: int = 20, user: Optional[Dict] = Depends(get_admin_user)):
     """Get Spotify recently played tracks"""
     try:
-        # Get user ID and tokens
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        tokens = spotify_sync.get_valid_tokens(user['id'])
-        if not tokens:
-            raise HTTPException(status_code=401, detail="Spotify not connected")
-        
-        # Get recently played from Spotify
-        tracks = spotify_api.get_recently_played(tokens['access_token'], limit)
+        tracks = await spotify_read(user['id'], "recently_played", spotify_api.get_recently_played, limit)
         
         return tracks
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/spotify/dashboard")
+async def get_spotify_dashboard(
+    time_range: str = 'short_term',
+    limit: int = 20,
+    user: Optional[Dict] = Depends(get_admin_user)
+):
+    """Profile, top tracks and recently played in one response, fetched concurrently"""
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    tokens = await run_in_threadpool(spotify_sync.get_valid_tokens, user['id'])
+    if not tokens:
+        raise HTTPException(status_code=401, detail="Spotify not connected")
+    
+    access_token = tokens['access_token']
+    return await compose_dashboard({
+        "profile": spotify_read(user['id'], "profile", spotify_api.get_user_profile, access_token=access_token),
+        "top_tracks": spotify_top_tracks(user['id'], time_range, limit, access_token),
+        "recently_played": spotify_read(
+            user['id'], "recently_played", spotify_api.get_recently_played, limit, access_token=access_token
+        ),
+    })
+
+@app.get("/api/spotify/cache")
+async def get_spotify_cache_stats():
+    """Spotify response cache hit/miss counters"""
+    return spotify_cache.stats()
+
+@app.post("/api/spotify/cache/purge")
+async def purge_spotify_cache(
+    endpoint: Optional[str] = Query(None, pattern="^(profile|top_tracks|recently_played)$"),
+    user: Optional[Dict] = Depends(get_admin_user)
+):
+    """Drop cached Spotify responses for the user (one endpoint, or all of them)"""
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    prefix = f"spotify:{user['id']}:" + (endpoint or "")
+    purged = await spotify_cache.purge(prefix)
+    return {"message": f"Purged {purged} cached responses", "purged": purged}
+
 @app.get("/api/spotify/current-playback")
-async def get_spotify_current_playback():
+async def get_spotify_current_playback(user: Optional[Dict] = Depends(get_admin_user)):
     """Get Spotify current playback state"""
     try:
-        # Get user ID and tokens
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
-        
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        tokens = spotify_sync.get_valid_tokens(user['id'])
-        if not tokens:
-            raise HTTPException(status_code=401, detail="Spotify not connected")
-        
-        # Get current playback from Spotify
-        playback = spotify_api.get_current_playback(tokens['access_token'])
+        # Served from the now-playing poller, which calls Spotify at most every few seconds
+        playback = await now_playing.current()
         
         if not playback:
             return {"message": "No active playback"}
         
         return playback
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/spotify/now-playing/stream")
+async def stream_spotify_now_playing():
+    """Server-Sent Events: a snapshot of what's playing, then only what changes"""
+    queue = now_playing.subscribe()
+    
+    async def events():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), NOW_PLAYING_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"  # stops proxies from closing an idle stream
+                    continue
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        finally:
+            now_playing.unsubscribe(queue)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
 @app.get("/api/spotify/status")
-async def get_spotify_status():
-    """Check if Spotify is connected"""
+async def get_spotify_status(user: Optional[Dict] = Depends(get_admin_user)):
+    """Check if Spotify is connected, from cached tokens and recent API outcomes (never calls Spotify)"""
     try:
-        # Get user ID
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        conn.close()
-        
         if not user:
             return {"connected": False, "error": "User not found"}
         
-        # Check if tokens exist
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT access_token, refresh_token, expires_at 
-            FROM spotify_tokens 
-            WHERE user_id = ?
-        """, (user['id'],))
-        
-        tokens = cursor.fetchone()
-        conn.close()
-        
-        if not tokens:
-            return {"connected": False, "message": "No tokens found"}
-        
-        access_token, refresh_token, expires_at = tokens
-        expires_at = datetime.fromisoformat(expires_at)
-        
-        # Check if token is expired
-        if datetime.now() >= expires_at:
-            return {"connected": False, "message": "Token expired", "expired_at": expires_at.isoformat()}
-        
-        # Check if we can get user profile
-        try:
-            profile = spotify_api.get_user_profile(access_token)
-            return {
-                "connected": True,
-                "profile": {
-                    "id": profile.get('id'),
-                    "display_name": profile.get('display_name'),
-                    "email": profile.get('email')
-                },
-                "token_expires": expires_at.isoformat()
-            }
-        except Exception as e:
-            return {"connected": False, "message": f"Token invalid: {str(e)}"}
-            
+        return spotify_health.status(await run_in_threadpool(spotify_sync.tokens.state, user['id']))
     except Exception as e:
         print(f"âŒ Error in get_spotify_status: {e}")
         return {"connected": False, "error": str(e)}
 
 @app.post("/api/spotify/disconnect")
-async def disconnect_spotify():
+async def disconnect_spotify(user: Optional[Dict] = Depends(get_admin_user)):
     """Disconnect Spotify and clear tokens"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        
         if user:
-            # Clear tokens
-            cursor.execute("DELETE FROM spotify_tokens WHERE user_id = ?", (user['id'],))
-            # Clear profile
-            cursor.execute("DELETE FROM spotify_profiles WHERE user_id = ?", (user['id'],))
-            # Clear tracks
-            cursor.execute("DELETE FROM spotify_tracks WHERE user_id = ?", (user['id'],))
-            conn.commit()
+            # Clear tokens, profile and tracks
+            await tokens_repo.clear_provider('spotify', user['id'])
+            spotify_sync.tokens.forget(user['id'])
+            spotify_health.forget()
+            await spotify_cache.purge(f"spotify:{user['id']}:")
             print("ðŸ§¹ Cleared all Spotify data")
         
-        conn.close()
         return {"message": "Spotify disconnected successfully"}
     except Exception as e:
         print(f"âŒ Error disconnecting Spotify: {e}")
         return {"error": str(e)}
 
 @app.post("/api/spotify/clear")
-async def clear_spotify_data():
+async def clear_spotify_data(user: Optional[Dict] = Depends(get_admin_user)):
     """Clear all Spotify data (for troubleshooting)"""
     try:
-        # Get user ID
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-        user = cursor.fetchone()
-        
         if user:
             # Clear all Spotify data
-            cursor.execute("DELETE FROM spotify_tokens WHERE user_id = ?", (user['id'],))
-            cursor.execute("DELETE FROM spotify_profiles WHERE user_id = ?", (user['id'],))
-            cursor.execute("DELETE FROM spotify_tracks WHERE user_id = ?", (user['id'],))
-            conn.commit()
+            await tokens_repo.clear_provider('spotify', user['id'])
+            spotify_sync.tokens.forget(user['id'])
+            spotify_health.forget()
+            await spotify_cache.purge(f"spotify:{user['id']}:")
             print("ðŸ§¹ Cleared all Spotify data for troubleshooting")
         
-        conn.close()
         return {"message": "Spotify data cleared successfully"}
     except Exception as e:
         print(f"âŒ Error clearing Spotify data: {e}")
@@ -1520,58 +1383,88 @@ class ArticleResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ArticleSearchResult(ArticleResponse):
+    snippet: str = ""
+    score: float
+
 # Enhanced Articles endpoints
-@app.get("/api/articles/enhanced", response_model=List[ArticleResponse])
-async def get_articles_enhanced():
-    """Get all articles with enhanced format"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, title, url, content as description, type as category, tags, 
-               published_at as dateAdded, 0 as isRead, 0 as isFavorite
-        FROM articles 
-        ORDER BY published_at DESC
-    """)
-    articles = []
-    for row in cursor.fetchall():
-        article = dict(row)
-        # Parse tags from string to list
-        article['tags'] = [tag.strip() for tag in (article['tags'] or '').split(',') if tag.strip()]
-        # Convert datetime to string
-        article['dateAdded'] = article['dateAdded'].split('T')[0] if article['dateAdded'] else ''
-        articles.append(ArticleResponse(**article))
-    conn.close()
-    return articles
+class ArticleFacets(Page[ArticleResponse]):
+    categories: Dict[str, int] = {}
+    tags: Dict[str, int] = {}
+
+def to_article_response(article: Dict) -> ArticleResponse:
+    # Convert datetime to string
+    article['dateAdded'] = article['dateAdded'].split('T')[0] if article['dateAdded'] else ''
+    return ArticleResponse(**article)
+
+@app.get("/api/articles/enhanced", response_model=Union[List[ArticleResponse], Page[ArticleResponse]])
+async def get_articles_enhanced(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """Get all articles with enhanced format (paginated when limit or cursor is given)"""
+    if limit is None and cursor is None:
+        return [to_article_response(article) for article in await articles_repo.list_enhanced()]
+
+    page = await fetch_page(articles_repo.page_enhanced, limit, cursor)
+    page['items'] = [to_article_response(article) for article in page['items']]
+    return page
+
+@app.get("/api/articles/search", response_model=Page[ArticleSearchResult])
+async def search_articles(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """Full-text search over article titles, content and tags (`word*` for prefixes)"""
+    try:
+        items, next_cursor = await articles_repo.search(q, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    results = []
+    for item in items:
+        snippet, score = item.pop('snippet'), item.pop('score')
+        article = to_article_response(item).dict()
+        results.append(ArticleSearchResult(**article, snippet=snippet or '', score=score))
+    return {"items": results, "next_cursor": next_cursor}
+
+@app.get("/api/articles/facets", response_model=ArticleFacets)
+async def get_article_facets(
+    category: Optional[str] = None,
+    tags: Optional[str] = None,
+    match: str = Query("any", pattern="^(any|all)$"),
+    start: Optional[str] = Query(None, pattern=DATE_PATTERN),
+    end: Optional[str] = Query(None, pattern=DATE_PATTERN),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """Filter articles by category, tags (comma-separated, any/all) and date range, with facet counts"""
+    try:
+        result = await articles_repo.facets(
+            limit, cursor, category, split_tags(tags), match == "all", start, end
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    result['items'] = [to_article_response(article) for article in result['items']]
+    return result
 
 @app.post("/api/articles/enhanced", response_model=ArticleResponse)
-async def create_article_enhanced(article: ArticleCreate):
+async def create_article_enhanced(article: ArticleCreate, user: Optional[Dict] = Depends(get_admin_user)):
     """Create a new article with enhanced format"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get admin user ID
-    cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-    user = cursor.fetchone()
     if not user:
-        conn.close()
         raise HTTPException(status_code=404, detail="Admin user not found")
     
     # Insert article
-    cursor.execute("""
-        INSERT INTO articles (user_id, title, content, type, url, tags)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (
+    article_id = await articles_repo.create(
         user['id'], 
         article.title, 
         article.description, 
         article.category, 
         article.url, 
         article.tags
-    ))
-    
-    article_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    )
     
     # Return the created article
     return ArticleResponse(
@@ -1580,7 +1473,7 @@ async def create_article_enhanced(article: ArticleCreate):
         url=article.url,
         description=article.description,
         category=article.category,
-        tags=[tag.strip() for tag in (article.tags or '').split(',') if tag.strip()],
+        tags=split_tags(article.tags),
         readTime=article.readTime,
         source=article.source,
         dateAdded=datetime.now().strftime('%Y-%m-%d'),
@@ -1591,58 +1484,30 @@ async def create_article_enhanced(article: ArticleCreate):
 @app.put("/api/articles/enhanced/{article_id}", response_model=ArticleResponse)
 async def update_article_enhanced(article_id: int, article: ArticleUpdate):
     """Update an existing article with enhanced format"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Check if article exists
-    cursor.execute("SELECT * FROM articles WHERE id = ?", (article_id,))
-    existing_article = cursor.fetchone()
-    if not existing_article:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Article not found")
-    
-    # Build update query dynamically
-    update_fields = []
-    update_values = []
+    # Build update dynamically
+    update_fields = {}
     
     if article.title is not None:
-        update_fields.append("title = ?")
-        update_values.append(article.title)
+        update_fields["title"] = article.title
     
     if article.url is not None:
-        update_fields.append("url = ?")
-        update_values.append(article.url)
+        update_fields["url"] = article.url
     
     if article.description is not None:
-        update_fields.append("content = ?")
-        update_values.append(article.description)
+        update_fields["content"] = article.description
     
     if article.category is not None:
-        update_fields.append("type = ?")
-        update_values.append(article.category)
+        update_fields["type"] = article.category
     
     if article.tags is not None:
-        update_fields.append("tags = ?")
-        update_values.append(article.tags)
+        update_fields["tags"] = article.tags
     
-    if update_fields:
-        update_values.append(article_id)
-        cursor.execute(f"""
-            UPDATE articles 
-            SET {', '.join(update_fields)}
-            WHERE id = ?
-        """, update_values)
-        conn.commit()
+    # Check if article exists while updating
+    if not await articles_repo.update(article_id, update_fields):
+        raise HTTPException(status_code=404, detail="Article not found")
     
     # Get updated article
-    cursor.execute("""
-        SELECT id, title, url, content as description, type as category, tags, 
-               published_at as dateAdded
-        FROM articles 
-        WHERE id = ?
-    """, (article_id,))
-    updated_article = cursor.fetchone()
-    conn.close()
+    updated_article = await articles_repo.get_enhanced(article_id)
     
     return ArticleResponse(
         id=updated_article['id'],
@@ -1650,7 +1515,7 @@ async def update_article_enhanced(article_id: int, article: ArticleUpdate):
         url=updated_article['url'],
         description=updated_article['description'],
         category=updated_article['category'],
-        tags=[tag.strip() for tag in (updated_article['tags'] or '').split(',') if tag.strip()],
+        tags=updated_article['tags'],
         readTime=article.readTime,
         source=article.source,
         dateAdded=updated_article['dateAdded'].split('T')[0] if updated_article['dateAdded'] else '',
@@ -1661,35 +1526,15 @@ async def update_article_enhanced(article_id: int, article: ArticleUpdate):
 @app.delete("/api/articles/enhanced/{article_id}")
 async def delete_article_enhanced(article_id: int):
     """Delete an article"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Check if article exists
-    cursor.execute("SELECT id FROM articles WHERE id = ?", (article_id,))
-    if not cursor.fetchone():
-        conn.close()
+    if not await articles_repo.delete(article_id):
         raise HTTPException(status_code=404, detail="Article not found")
     
-    # Delete article
-    cursor.execute("DELETE FROM articles WHERE id = ?", (article_id,))
-    conn.commit()
-    conn.close()
-    
     return {"message": "Article deleted successfully"}
 
 @app.get("/api/articles/enhanced/{article_id}", response_model=ArticleResponse)
 async def get_article_enhanced(article_id: int):
     """Get a specific article with enhanced format"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, title, url, content as description, type as category, tags, 
-               published_at as dateAdded
-        FROM articles 
-        WHERE id = ?
-    """, (article_id,))
-    article = cursor.fetchone()
-    conn.close()
+    article = await articles_repo.get_enhanced(article_id)
     
     if not article:
         raise HTTPException(status_code=404, detail="Article not found")
@@ -1700,7 +1545,7 @@ async def get_article_enhanced(article_id: int):
         url=article['url'],
         description=article['description'],
         category=article['category'],
-        tags=[tag.strip() for tag in (article['tags'] or '').split(',') if tag.strip()],
+        tags=article['tags'],
         readTime=None,
         source=None,
         dateAdded=article['dateAdded'].split('T')[0] if article['dateAdded'] else '',
@@ -1751,57 +1596,37 @@ class RaceResponse(BaseModel):
 @app.get("/api/races", response_model=List[RaceResponse])
 async def get_races():
     """Get all races"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, race_name, date, location, time, placement, notes, created_at
-        FROM races 
-        ORDER BY date DESC
-    """)
     races = []
-    for row in cursor.fetchall():
-        race = dict(row)
+    for race in await races_repo.list_races():
         # Extract year from date
         race['year'] = datetime.strptime(race['date'], '%Y-%m-%d').year
+        race['raceName'] = race['race_name']
         # Use actual values from database
-        race['distance'] = race.get('distance', '5k')  # Use database value or default
-        race['raceType'] = race.get('race_type', 'running')  # Use database value or default
+        race['distance'] = race.get('distance') or '5k'  # Use database value or default
+        race['raceType'] = race.get('race_type') or 'running'  # Use database value or default
         races.append(RaceResponse(**race))
-    conn.close()
     return races
 
 
 
 @app.post("/api/races", response_model=RaceResponse)
-async def create_race(race: RaceCreate):
+async def create_race(race: RaceCreate, user: Optional[Dict] = Depends(get_admin_user)):
     """Create a new race"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Get admin user ID
-    cursor.execute("SELECT id FROM users WHERE username = 'admin'")
-    user = cursor.fetchone()
     if not user:
-        conn.close()
         raise HTTPException(status_code=404, detail="Admin user not found")
     
     # Insert race
-    cursor.execute("""
-        INSERT INTO races (user_id, race_name, date, location, time, placement, notes)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (
+    race_id = await races_repo.create(
         user['id'], 
         race.raceName, 
         race.date, 
         race.location, 
         race.time, 
         race.placement, 
-        race.notes
-    ))
-    
-    race_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        race.notes,
+        race.distance,
+        race.raceType
+    )
     
     # Return the created race
     return RaceResponse(
@@ -1820,61 +1645,39 @@ async def create_race(race: RaceCreate):
 @app.put("/api/races/{race_id}", response_model=RaceResponse)
 async def update_race(race_id: int, race: RaceUpdate):
     """Update an existing race"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Check if race exists
-    cursor.execute("SELECT * FROM races WHERE id = ?", (race_id,))
-    existing_race = cursor.fetchone()
-    if not existing_race:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Race not found")
-    
-    # Build update query dynamically
-    update_fields = []
-    update_values = []
+    # Build update dynamically
+    update_fields = {}
     
     if race.raceName is not None:
-        update_fields.append("race_name = ?")
-        update_values.append(race.raceName)
+        update_fields["race_name"] = race.raceName
     
     if race.date is not None:
-        update_fields.append("date = ?")
-        update_values.append(race.date)
+        update_fields["date"] = race.date
     
     if race.location is not None:
-        update_fields.append("location = ?")
-        update_values.append(race.location)
+        update_fields["location"] = race.location
     
     if race.time is not None:
-        update_fields.append("time = ?")
-        update_values.append(race.time)
+        update_fields["time"] = race.time
     
     if race.placement is not None:
-        update_fields.append("placement = ?")
-        update_values.append(race.placement)
+        update_fields["placement"] = race.placement
     
     if race.notes is not None:
-        update_fields.append("notes = ?")
-        update_values.append(race.notes)
+        update_fields["notes"] = race.notes
     
-    if update_fields:
-        update_values.append(race_id)
-        cursor.execute(f"""
-            UPDATE races 
-            SET {', '.join(update_fields)}
-            WHERE id = ?
-        """, update_values)
-        conn.commit()
+    if race.distance is not None:
+        update_fields["distance"] = race.distance
+    
+    if race.raceType is not None:
+        update_fields["race_type"] = race.raceType
+    
+    # Check if race exists while updating
+    if not await races_repo.update(race_id, update_fields):
+        raise HTTPException(status_code=404, detail="Race not found")
     
     # Get updated race
-    cursor.execute("""
-        SELECT id, race_name, date, location, time, placement, notes
-        FROM races 
-        WHERE id = ?
-    """, (race_id,))
-    updated_race = cursor.fetchone()
-    conn.close()
+    updated_race = await races_repo.get(race_id)
     
     return RaceResponse(
         id=updated_race['id'],
@@ -1883,8 +1686,8 @@ async def update_race(race_id: int, race: RaceUpdate):
         location=updated_race['location'],
         time=updated_race['time'],
         placement=updated_race['placement'],
-        distance='5k',  # Default since column doesn't exist
-        raceType='running',  # Default since column doesn't exist
+        distance=updated_race['distance'],
+        raceType=updated_race['race_type'],
         notes=updated_race['notes'],
         year=datetime.strptime(updated_race['date'], '%Y-%m-%d').year
     )
@@ -1892,34 +1695,15 @@ async def update_race(race_id: int, race: RaceUpdate):
 @app.delete("/api/races/{race_id}")
 async def delete_race(race_id: int):
     """Delete a race"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Check if race exists
-    cursor.execute("SELECT id FROM races WHERE id = ?", (race_id,))
-    if not cursor.fetchone():
-        conn.close()
+    if not await races_repo.delete(race_id):
         raise HTTPException(status_code=404, detail="Race not found")
     
-    # Delete race
-    cursor.execute("DELETE FROM races WHERE id = ?", (race_id,))
-    conn.commit()
-    conn.close()
-    
     return {"message": "Race deleted successfully"}
 
 @app.get("/api/races/{race_id}", response_model=RaceResponse)
 async def get_race(race_id: int):
     """Get a specific race"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, race_name, date, location, time, placement, notes
-        FROM races 
-        WHERE id = ?
-    """, (race_id,))
-    race = cursor.fetchone()
-    conn.close()
+    race = await races_repo.get(race_id)
     
     if not race:
         raise HTTPException(status_code=404, detail="Race not found")
@@ -1931,8 +1715,8 @@ async def get_race(race_id: int):
         location=race['location'],
         time=race['time'],
         placement=race['placement'],
-        distance='5k',  # Default
-        raceType='running',  # Default
+        distance=race['distance'],
+        raceType=race['race_type'],
         notes=race['notes'],
         year=datetime.strptime(race['date'], '%Y-%m-%d').year
     )
@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations.
+
+The schema version lives in SQLite's `PRAGMA user_version`. Each migration is a
+function that brings the schema from version N-1 to N; `migrate()` applies only
+the pending ones inside a single transaction. When the schema is already
+current, startup costs one pragma read.
+
+Usage: python migrations.py   (applies pending migrations to DATABASE_PATH)
+"""
+
+import sqlite3
+from typing import Callable, List, Tuple
+
+from database import get_pool
+from repositories import set_article_tags, split_tags
+from rollups import create_rollup_triggers, rebuild_rollups
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [column[1] for column in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """Add a column unless an older ad-hoc migration already added it"""
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _initial_schema(conn: sqlite3.Connection):
+    """Core tables and the default admin user"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            name TEXT NOT NULL,
+            bio TEXT,
+            profile_photo TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS strava_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            access_token TEXT NOT NULL,
+            refresh_token TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS strava_athletes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            strava_id TEXT NOT NULL,
+            username TEXT,
+            firstname TEXT,
+            lastname TEXT,
+            city TEXT,
+            state TEXT,
+            country TEXT,
+            sex TEXT,
+            premium BOOLEAN DEFAULT FALSE,
+            profile_medium TEXT,
+            profile TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS strava_activities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            strava_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            distance REAL,
+            moving_time INTEGER,
+            elapsed_time INTEGER,
+            total_elevation_gain REAL,
+            start_date TIMESTAMP,
+            start_date_local TIMESTAMP,
+            average_speed REAL,
+            max_speed REAL,
+            average_heartrate REAL,
+            max_heartrate REAL,
+            calories INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    # Workouts table (for manual entries)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS workouts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            strava_id TEXT,
+            type TEXT NOT NULL,
+            distance REAL,
+            duration INTEGER,
+            date DATE NOT NULL,
+            elevation REAL,
+            route_data TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS songs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            spotify_id TEXT,
+            track_name TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            album TEXT,
+            album_art TEXT,
+            personal_note TEXT,
+            pinned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS photos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            race_id INTEGER,
+            filename TEXT NOT NULL,
+            caption TEXT,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (race_id) REFERENCES races (id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS articles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT,
+            type TEXT DEFAULT 'manual',
+            url TEXT,
+            tags TEXT,
+            published_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS races (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            race_name TEXT NOT NULL,
+            date DATE NOT NULL,
+            location TEXT,
+            time TEXT,
+            placement TEXT,
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spotify_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            access_token TEXT NOT NULL,
+            refresh_token TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spotify_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            spotify_id TEXT NOT NULL,
+            display_name TEXT NOT NULL,
+            email TEXT,
+            country TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spotify_tracks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            spotify_id TEXT NOT NULL,
+            track_name TEXT NOT NULL,
+            artist TEXT NOT NULL,
+            album TEXT,
+            album_art TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+    # Insert default admin user if not exists
+    if not conn.execute("SELECT 1 FROM users WHERE username = 'admin'").fetchone():
+        # In production, use proper password hashing
+        conn.execute("""
+            INSERT INTO users (username, email, password_hash, name, bio)
+            VALUES (?, ?, ?, ?, ?)
+        """, ("admin", "admin@example.com", "admin123", "Maya A. Ramirez", "Admin user"))
+
+
+def _spotify_profile_and_track_details(conn: sqlite3.Connection):
+    """Profile image/follower count and track duration/popularity/preview"""
+    _add_column(conn, "spotify_profiles", "profile_image", "TEXT")
+    _add_column(conn, "spotify_profiles", "followers_count", "INTEGER")
+    _add_column(conn, "spotify_tracks", "duration_ms", "INTEGER")
+    _add_column(conn, "spotify_tracks", "popularity", "INTEGER")
+    _add_column(conn, "spotify_tracks", "preview_url", "TEXT")
+
+
+def _race_type_and_distance(conn: sqlite3.Connection):
+    """Race type and distance (previously migrate_races.py)"""
+    _add_column(conn, "races", "race_type", "TEXT DEFAULT 'running'")
+    _add_column(conn, "races", "distance", "TEXT DEFAULT '5k'")
+
+
+def _reconcile_legacy_articles(conn: sqlite3.Connection):
+    """Rebuild an articles table created by the old add_articles_table.py script"""
+    columns = _columns(conn, "articles")
+    if "published_at" in columns:
+        return
+
+    admin = conn.execute("SELECT id FROM users WHERE username = 'admin'").fetchone()
+    conn.execute("ALTER TABLE articles RENAME TO articles_legacy")
+    conn.execute("""
+        CREATE TABLE articles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT,
+            type TEXT DEFAULT 'manual',
+            url TEXT,
+            tags TEXT,
+            published_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    conn.execute("""
+        INSERT INTO articles (id, user_id, title, content, type, url, tags, published_at)
+        SELECT id, ?, title, description, category, url, tags, COALESCE(date_added, created_at)
+        FROM articles_legacy
+    """, (admin[0],))
+    conn.execute("DROP TABLE articles_legacy")
+
+
+# Managed secondary indexes: name -> (table, columns, unique)
+# Migration 5 creates every entry here, so this set is frozen: new indexes go in
+# LATER_INDEXES and are created by name from their own migration
+INDEXES = {
+    # One token/profile row per user so INSERT OR REPLACE upserts
+    "ux_strava_tokens_user": ("strava_tokens", "user_id", True),
+    "ux_spotify_tokens_user": ("spotify_tokens", "user_id", True),
+    "ux_spotify_profiles_user": ("spotify_profiles", "user_id", True),
+    # One row per synced Strava activity (manual workouts leave strava_id NULL)
+    "ux_workouts_strava_id": ("workouts", "strava_id", True),
+    "ux_strava_activities_strava_id": ("strava_activities", "strava_id", True),
+    # List endpoints sort and paginate on these; SQLite appends the rowid to
+    # every index entry, so each one is a (column, id) keyset index
+    "ix_articles_published_at": ("articles", "published_at", False),
+    "ix_races_date": ("races", "date", False),
+    "ix_workouts_date": ("workouts", "date", False),
+    "ix_songs_pinned_at": ("songs", "pinned_at", False),
+    # Per-user lookups
+    "ix_strava_athletes_user": ("strava_athletes", "user_id", False),
+    "ix_strava_activities_user_start": ("strava_activities", "user_id, start_date", False),
+    "ix_spotify_tracks_user": ("spotify_tracks", "user_id", False),
+}
+
+LATER_INDEXES = {
+    # Activities whose streams haven't been fetched yet, newest first
+    "ix_strava_activities_streams_pending": (
+        "strava_activities", "user_id, streams_synced_at, start_date", False
+    ),
+    # Whole-channel reads across a user's activities, in file order for the mmap backend
+    "ix_stream_segments_user_channel": ("stream_segments", "user_id, channel, offset", False),
+    "ix_strava_streams_user_channel": ("strava_streams", "user_id, channel", False),
+    # Activity summaries aggregate straight from this index
+    "ix_strava_activities_summary": (
+        "strava_activities",
+        "user_id, start_date_local, type, distance, moving_time, total_elevation_gain",
+        False,
+    ),
+    # Faceted article filters
+    "ix_articles_type_published_at": ("articles", "type, published_at", False),
+    "ix_article_tags_tag": ("article_tags", "tag_id, article_id", False),
+}
+
+# Rows that would violate the unique indexes above, keeping the newest row
+_DEDUPLICATE = (
+    "DELETE FROM strava_tokens WHERE id NOT IN (SELECT MAX(id) FROM strava_tokens GROUP BY user_id)",
+    "DELETE FROM spotify_tokens WHERE id NOT IN (SELECT MAX(id) FROM spotify_tokens GROUP BY user_id)",
+    "DELETE FROM spotify_profiles WHERE id NOT IN (SELECT MAX(id) FROM spotify_profiles GROUP BY user_id)",
+    """DELETE FROM workouts WHERE strava_id IS NOT NULL
+       AND id NOT IN (SELECT MAX(id) FROM workouts WHERE strava_id IS NOT NULL GROUP BY strava_id)""",
+    "DELETE FROM strava_activities WHERE id NOT IN (SELECT MAX(id) FROM strava_activities GROUP BY strava_id)",
+)
+
+
+def create_indexes(conn: sqlite3.Connection, names=None):
+    """Create managed indexes (all of INDEXES, or only the given names from either set)"""
+    for name in names or INDEXES:
+        table, columns, unique = INDEXES[name] if name in INDEXES else LATER_INDEXES[name]
+        conn.execute(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+        )
+
+
+def _managed_indexes(conn: sqlite3.Connection):
+    """Secondary indexes and the unique keys the upserts rely on"""
+    for statement in _DEDUPLICATE:
+        conn.execute(statement)
+    create_indexes(conn)
+
+
+def _article_search(conn: sqlite3.Connection):
+    """FTS5 index over article title, content and tags, kept in sync by triggers"""
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+            title, content, tags,
+            content='articles', content_rowid='id',
+            tokenize='porter unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS articles_fts_insert AFTER INSERT ON articles BEGIN
+            INSERT INTO articles_fts (rowid, title, content, tags)
+            VALUES (new.id, new.title, new.content, new.tags);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS articles_fts_delete AFTER DELETE ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, content, tags)
+            VALUES ('delete', old.id, old.title, old.content, old.tags);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS articles_fts_update AFTER UPDATE OF title, content, tags ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, content, tags)
+            VALUES ('delete', old.id, old.title, old.content, old.tags);
+            INSERT INTO articles_fts (rowid, title, content, tags)
+            VALUES (new.id, new.title, new.content, new.tags);
+        END
+    """)
+    # Index the articles that already exist
+    conn.execute("INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')")
+
+
+def _normalized_tags(conn: sqlite3.Connection):
+    """tags/article_tags tables, filled from the comma-separated articles.tags strings"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS article_tags (
+            article_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            tag_id INTEGER NOT NULL,
+            PRIMARY KEY (article_id, position),
+            FOREIGN KEY (article_id) REFERENCES articles (id),
+            FOREIGN KEY (tag_id) REFERENCES tags (id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS article_tags_delete AFTER DELETE ON articles BEGIN
+            DELETE FROM article_tags WHERE article_id = old.id;
+        END
+    """)
+    create_indexes(conn, ["ix_articles_type_published_at", "ix_article_tags_tag"])
+
+    for article_id, value in conn.execute("SELECT id, tags FROM articles").fetchall():
+        names = split_tags(value)
+        set_article_tags(conn, article_id, names)
+        conn.execute("UPDATE articles SET tags = ? WHERE id = ?", (", ".join(names) or None, article_id))
+
+
+def _strava_sync_state(conn: sqlite3.Connection):
+    """Resumable checkpoint for the Strava history backfill and incremental syncs"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS strava_sync_state (
+            user_id INTEGER PRIMARY KEY,
+            oldest_start INTEGER,
+            newest_start INTEGER,
+            backfill_pages INTEGER NOT NULL DEFAULT 0,
+            backfill_complete BOOLEAN NOT NULL DEFAULT FALSE,
+            incremental_after INTEGER,
+            incremental_page INTEGER NOT NULL DEFAULT 0,
+            activities_synced INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+
+
+def _activity_summary_index(conn: sqlite3.Connection):
+    """Covering index for local activity summaries"""
+    create_indexes(conn, ["ix_strava_activities_summary"])
+
+
+def _fitness_rollups(conn: sqlite3.Connection):
+    """Per-type workout totals by day, week, month and year, maintained by triggers"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fitness_rollups (
+            user_id INTEGER NOT NULL,
+            grain TEXT NOT NULL,
+            period TEXT NOT NULL,
+            type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            distance REAL NOT NULL DEFAULT 0,
+            duration INTEGER NOT NULL DEFAULT 0,
+            elevation REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, grain, period, type)
+        ) WITHOUT ROWID
+    """)
+    create_rollup_triggers(conn)
+    rebuild_rollups(conn)
+
+
+def _strava_streams(conn: sqlite3.Connection):
+    """Compressed per-channel activity streams (see streams.py)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS strava_streams (
+            strava_id TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            codec TEXT NOT NULL,
+            dtype TEXT NOT NULL,
+            samples INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (strava_id, channel),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    _add_column(conn, "strava_activities", "streams_synced_at", "TIMESTAMP")
+    create_indexes(conn, ["ix_strava_activities_streams_pending"])
+
+
+def _stream_segments(conn: sqlite3.Connection):
+    """Offsets index for the memory-mapped stream backend, and per-channel stream scans"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stream_segments (
+            strava_id TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            PRIMARY KEY (strava_id, channel),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    """)
+    create_indexes(conn, ["ix_stream_segments_user_channel", "ix_strava_streams_user_channel"])
+
+
+def _response_cache(conn: sqlite3.Connection):
+    """On-disk tier of the upstream response cache (see response_cache.py)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            stored_at REAL NOT NULL
+        )
+    """)
+
+
+def _background_sync(conn: sqlite3.Connection):
+    """Scheduler leases and job state (see scheduler.py), and Spotify listening history"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            name TEXT PRIMARY KEY,
+            interval REAL NOT NULL,
+            next_run_at REAL NOT NULL,
+            last_run_at REAL,
+            last_result TEXT
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS spotify_plays (
+            user_id INTEGER NOT NULL,
+            played_at INTEGER NOT NULL,
+            spotify_id TEXT NOT NULL,
+            track_name TEXT NOT NULL,
+            artist TEXT,
+            album TEXT,
+            album_art TEXT,
+            duration_ms INTEGER,
+            PRIMARY KEY (user_id, played_at),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID
+    """)
+
+
+def _job_queue(conn: sqlite3.Connection):
+    """Durable job queue (see job_queue.py)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            priority INTEGER NOT NULL DEFAULT 0,
+            dedup_key TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            timeout REAL NOT NULL,
+            run_at REAL NOT NULL,
+            claimed_by TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    # Partial indexes, which INDEXES can't express: unfinished jobs are claimed and deduplicated,
+    # finished ones pruned
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS ix_jobs_claimable
+        ON jobs (priority DESC, run_at) WHERE status IN ('queued', 'running')
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_dedup_key
+        ON jobs (dedup_key) WHERE status IN ('queued', 'running')
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS ix_jobs_finished
+        ON jobs (updated_at) WHERE status IN ('succeeded', 'failed')
+    """)
+
+
+# (version, description, step) - append new migrations, never reorder or edit old ones
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "initial schema", _initial_schema),
+    (2, "spotify profile and track details", _spotify_profile_and_track_details),
+    (3, "race type and distance", _race_type_and_distance),
+    (4, "reconcile legacy articles table", _reconcile_legacy_articles),
+    (5, "managed indexes", _managed_indexes),
+    (6, "article full-text search", _article_search),
+    (7, "normalized article tags", _normalized_tags),
+    (8, "strava sync checkpoint", _strava_sync_state),
+    (9, "activity summary index", _activity_summary_index),
+    (10, "fitness rollups", _fitness_rollups),
+    (11, "strava activity streams", _strava_streams),
+    (12, "memory-mapped stream segments", _stream_segments),
+    (13, "response cache", _response_cache),
+    (14, "background sync scheduler", _background_sync),
+    (15, "job queue", _job_queue),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply pending migrations in one transaction; returns the number applied"""
+    if schema_version(conn) >= LATEST_VERSION:
+        return 0
+
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # manage the transaction explicitly so DDL stays inside it
+    try:
+        # Take the write lock first so concurrent workers don't migrate twice
+        conn.execute("BEGIN IMMEDIATE")
+        current = schema_version(conn)
+        pending = [migration for migration in MIGRATIONS if migration[0] > current]
+        for version, description, step in pending:
+            print(f"🔄 Applying migration {version}: {description}...")
+            step(conn)
+        conn.execute(f"PRAGMA user_version = {LATEST_VERSION}")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+
+    if pending:
+        print(f"✅ Database schema migrated to version {LATEST_VERSION}")
+    return len(pending)
+
+
+def run_migrations(db_path: str = None) -> int:
+    """Migrate the database at db_path (defaults to DATABASE_PATH)"""
+    with get_pool(db_path).connection() as conn:
+        return migrate(conn)
+
+
+if __name__ == "__main__":
+    applied = run_migrations()
+    if not applied:
+        print(f"✅ Database schema already at version {LATEST_VERSION}")
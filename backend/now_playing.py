@@ -0,0 +1,170 @@
+"""
+Now-playing fan-out.
+
+One `PlaybackPoller` asks Spotify what the site owner is playing, however many
+visitors are watching, and pushes what changed to each of them through their
+own queue (the SSE endpoint drains one per connection). The poll interval
+follows playback: just after the current track should end while playing (capped
+so skips and pauses still show up quickly), slower when paused, slowest when
+nothing is playing or Spotify keeps failing. Polling stops when the last
+subscriber leaves.
+
+Subscribers get the full state when they connect and then only the fields that
+changed (track, play/pause, device). Progress rides along with each event so
+clients can advance the position locally between them.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+PLAYING_MIN_INTERVAL = 2.0
+PLAYING_MAX_INTERVAL = 15.0
+PAUSED_INTERVAL = 30.0
+IDLE_INTERVAL = 60.0
+ERROR_MAX_INTERVAL = 300.0
+# Plain reads of the current playback reuse a poll this recent
+PLAYBACK_MAX_AGE = 5.0
+SUBSCRIBER_QUEUE_SIZE = 16
+TRACKED_FIELDS = ('is_playing', 'track', 'device')
+
+
+def playback_state(playback: Optional[Dict]) -> Dict:
+    """What visitors see, from a /me/player response (None when nothing is playing)"""
+    item = (playback or {}).get('item')
+    if not item:
+        return {'is_playing': False, 'track': None, 'device': None, 'progress_ms': None}
+    album = item.get('album') or {}
+    images = album.get('images') or []
+    return {
+        'is_playing': bool(playback.get('is_playing')),
+        'track': {
+            'id': item.get('id'),
+            'name': item.get('name'),
+            'artists': [artist.get('name') for artist in item.get('artists', [])],
+            'album': album.get('name'),
+            'image_url': images[0]['url'] if images else None,
+            'duration_ms': item.get('duration_ms'),
+            'url': (item.get('external_urls') or {}).get('spotify'),
+        },
+        'device': (playback.get('device') or {}).get('name'),
+        'progress_ms': playback.get('progress_ms'),
+    }
+
+
+def state_diff(old: Optional[Dict], new: Dict) -> Dict:
+    """Tracked fields whose value changed"""
+    old = old or {}
+    return {field: new[field] for field in TRACKED_FIELDS if field not in old or old[field] != new[field]}
+
+
+def next_interval(state: Dict) -> float:
+    """Seconds until the next poll for this playback state"""
+    track = state['track']
+    if not track:
+        return IDLE_INTERVAL
+    if not state['is_playing']:
+        return PAUSED_INTERVAL
+    if track['duration_ms'] is None or state['progress_ms'] is None:
+        return PLAYING_MAX_INTERVAL
+    remaining = (track['duration_ms'] - state['progress_ms']) / 1000
+    return min(PLAYING_MAX_INTERVAL, max(PLAYING_MIN_INTERVAL, remaining + 0.5))
+
+
+class PlaybackPoller:
+    """Single upstream poller for the current playback, fanned out to subscriber queues"""
+
+    def __init__(self, fetch: Callable[[], Awaitable[Optional[Dict]]]):
+        self.fetch = fetch
+        self.playback: Optional[Dict] = None
+        self.state: Optional[Dict] = None
+        self.updated_at: Optional[float] = None
+        self.interval = IDLE_INTERVAL
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0
+        self.polls = 0
+        self.errors = 0
+        self.events = 0
+
+    def _event(self, kind: str, data: Dict) -> Dict:
+        return {'event': kind, 'data': {**data, 'progress_ms': self.state['progress_ms'], 'at': self.updated_at}}
+
+    def _deliver(self, queue: asyncio.Queue, event: Dict):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client this far behind gets a fresh snapshot instead of the backlog
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(self._event('snapshot', self.state))
+        self.events += 1
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of events for one visitor, starting with a snapshot once one is known"""
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        if self.state is not None:
+            self._deliver(queue, self._event('snapshot', self.state))
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    async def poll(self) -> Optional[Dict]:
+        """Fetch playback once and tell subscribers what changed; returns the raw playback"""
+        playback = await self.fetch()
+        self.polls += 1
+        state = playback_state(playback)
+        changes = state_diff(self.state, state)
+        first = self.state is None
+        self.playback, self.state, self.updated_at = playback, state, time.time()
+        self.interval = next_interval(state)
+        if changes:
+            event = self._event('snapshot' if first else 'change', state if first else changes)
+            for queue in list(self._subscribers):
+                self._deliver(queue, event)
+        return playback
+
+    async def current(self) -> Optional[Dict]:
+        """Raw playback, polling only when the last poll is older than PLAYBACK_MAX_AGE"""
+        if self.updated_at is not None and time.time() - self.updated_at < min(self.interval, PLAYBACK_MAX_AGE):
+            return self.playback
+        return await self.poll()
+
+    async def _run(self):
+        while self._subscribers:
+            try:
+                await self.poll()
+                self._failures = 0
+                delay = self.interval
+            except Exception as e:
+                self.errors += 1
+                self._failures += 1
+                delay = min(ERROR_MAX_INTERVAL, IDLE_INTERVAL * 2 ** (self._failures - 1))
+                print(f"⚠️ Now-playing poll failed (retrying in {delay:.0f}s): {e}")
+            # Wake early if the last subscriber leaves, so polling stops promptly
+            deadline = time.monotonic() + delay
+            while self._subscribers and time.monotonic() < deadline:
+                await asyncio.sleep(min(1.0, deadline - time.monotonic()))
+
+    def stats(self) -> Dict:
+        """Poll and fan-out counters"""
+        return {
+            'subscribers': len(self._subscribers),
+            'polling': self._task is not None and not self._task.done(),
+            'interval': self.interval,
+            'polls': self.polls,
+            'errors': self.errors,
+            'events': self.events,
+        }
+
+    async def close(self):
+        """Stop polling (called at shutdown)"""
+        self._subscribers.clear()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
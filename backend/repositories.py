@@ -0,0 +1,550 @@
+"""
+Async data-access layer.
+
+Each repository method hands a plain function to `run_db`, which executes it
+on the dedicated database executor with a pooled connection, so the `async def`
+route handlers in main.py await their queries instead of blocking the event
+loop on sqlite3.
+"""
+
+import base64
+import json
+import sqlite3
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from database import register_query, run_db
+from rollups import GRAINS, group_rollups, period_key
+
+
+def _rows(cursor: sqlite3.Cursor) -> List[Dict]:
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def _row(cursor: sqlite3.Cursor) -> Optional[Dict]:
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+def _update(conn: sqlite3.Connection, table: str, row_id: int, fields: Dict) -> int:
+    """Apply a partial update; returns the number of rows changed"""
+    if not fields:
+        return 0
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    cursor = conn.execute(
+        f"UPDATE {table} SET {assignments} WHERE id = ?",
+        (*fields.values(), row_id)
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def _delete(conn: sqlite3.Connection, table: str, row_id: int) -> bool:
+    cursor = conn.execute(f"DELETE FROM {table} WHERE id = ?", (row_id,))
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+def split_tags(value) -> List[str]:
+    """Tag names from a comma-separated string (or a legacy JSON list), deduplicated in order"""
+    if not value:
+        return []
+    names = None
+    if value.lstrip().startswith("["):
+        try:
+            names = [str(name) for name in json.loads(value)]
+        except ValueError:
+            pass
+    if names is None:
+        names = value.split(",")
+
+    tags, seen = [], set()
+    for name in (name.strip() for name in names):
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            tags.append(name)
+    return tags
+
+
+def set_article_tags(conn: sqlite3.Connection, article_id: int, names: List[str]):
+    """Replace an article's tags, creating any tag names that don't exist yet"""
+    conn.execute("DELETE FROM article_tags WHERE article_id = ?", (article_id,))
+    for position, name in enumerate(names):
+        conn.execute("INSERT INTO tags (name) VALUES (?) ON CONFLICT (name) DO NOTHING", (name,))
+        conn.execute("""
+            INSERT INTO article_tags (article_id, position, tag_id)
+            SELECT ?, ?, id FROM tags WHERE name = ?
+        """, (article_id, position, name))
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(sort_value: Any, row_id: int) -> str:
+    """Opaque cursor pointing just past the given (sort value, id) position"""
+    raw = json.dumps([sort_value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    """Inverse of encode_cursor; raises ValueError for anything malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(row_id, int):
+        raise ValueError("Invalid cursor")
+    return sort_value, row_id
+
+
+class Keyset:
+    """Newest-first keyset pagination over (sort_column, id)
+
+    Pages seek straight to the cursor position through the sort column's index
+    (SQLite indexes carry the rowid, so they are (sort_column, id) keys), which
+    makes page N cost the same as page one.
+    """
+
+    def __init__(self, name: str, select: str, sort_column: str, sort_key: str = None,
+                 decode: Callable[[Dict], Dict] = None):
+        self.select = select
+        self.sort_column = sort_column
+        self.sort_key = sort_key or sort_column
+        self.decode = decode
+        self.first = register_query(f"{name}.page", self.sql())
+        self.after = register_query(f"{name}.page_after", self.sql(after=True))
+
+    def sql(self, where: str = "", after: bool = False) -> str:
+        """Page query, optionally narrowed by an extra WHERE condition"""
+        conditions = [where] if where else []
+        if after:
+            conditions.append(f"({self.sort_column}, id) < (?, ?)")
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"{self.select} {where_clause} ORDER BY {self.sort_column} DESC, id DESC LIMIT ?"
+
+    def page(self, conn: sqlite3.Connection, limit: int, cursor: Optional[str] = None,
+             where: str = "", params: tuple = ()) -> Tuple[List[Dict], Optional[str]]:
+        """Fetch one page; returns (rows, next_cursor or None on the last page)"""
+        if cursor:
+            sql = self.sql(where, after=True) if where else self.after
+            rows = _rows(conn.execute(sql, (*params, *decode_cursor(cursor), limit + 1)))
+        else:
+            sql = self.sql(where) if where else self.first
+            rows = _rows(conn.execute(sql, (*params, limit + 1)))
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][self.sort_key], rows[-1]["id"])
+        if self.decode:
+            rows = [self.decode(row) for row in rows]
+        return rows, next_cursor
+
+
+USER_BY_USERNAME = register_query("users.by_username", "SELECT * FROM users WHERE username = ?")
+
+def _tag_list_column(article: str) -> str:
+    """JSON array of an article's tag names, in the order they were entered"""
+    return f"""(
+        SELECT json_group_array(name) FROM (
+            SELECT t.name FROM article_tags at
+            JOIN tags t ON t.id = at.tag_id
+            WHERE at.article_id = {article}.id
+            ORDER BY at.position
+        )
+    )"""
+
+
+def _decode_tags(row: Dict) -> Dict:
+    row["tags"] = json.loads(row["tags"]) if row["tags"] else []
+    return row
+
+
+ENHANCED_ARTICLE_COLUMNS = f"""
+    id, title, url, content as description, type as category,
+    {_tag_list_column("articles")} as tags,
+    published_at as dateAdded
+"""
+
+LIST_ARTICLES = register_query(
+    "articles.list", "SELECT * FROM articles ORDER BY published_at DESC"
+)
+LIST_ENHANCED_ARTICLES = register_query("articles.list_enhanced", f"""
+    SELECT {ENHANCED_ARTICLE_COLUMNS}
+    FROM articles
+    ORDER BY published_at DESC
+""")
+GET_ENHANCED_ARTICLE = register_query("articles.get_enhanced", f"""
+    SELECT {ENHANCED_ARTICLE_COLUMNS}
+    FROM articles
+    WHERE id = ?
+""")
+LIST_RACES = register_query("races.list", "SELECT * FROM races ORDER BY date DESC")
+GET_RACE = register_query("races.get", "SELECT * FROM races WHERE id = ?")
+LIST_WORKOUTS = register_query("workouts.list", "SELECT * FROM workouts ORDER BY date DESC")
+LIST_SONGS = register_query("songs.list", "SELECT * FROM songs ORDER BY pinned_at DESC")
+
+ARTICLES_PAGE = Keyset("articles", "SELECT * FROM articles", "published_at")
+ENHANCED_ARTICLES_PAGE = Keyset(
+    "articles.enhanced", f"SELECT {ENHANCED_ARTICLE_COLUMNS} FROM articles", "published_at", "dateAdded",
+    decode=_decode_tags
+)
+# BM25 weights: title matches count most, then tags, then body text
+ARTICLE_SEARCH_SCORE = "bm25(articles_fts, 10.0, 1.0, 5.0)"
+ARTICLE_SEARCH = f"""
+    SELECT a.id, a.title, a.url, a.content as description, a.type as category,
+           {_tag_list_column("a")} as tags,
+           a.published_at as dateAdded,
+           snippet(articles_fts, -1, '<mark>', '</mark>', '…', 16) as snippet,
+           {ARTICLE_SEARCH_SCORE} as score
+    FROM articles_fts
+    JOIN articles a ON a.id = articles_fts.rowid
+    WHERE articles_fts MATCH ?
+"""
+SEARCH_ARTICLES = register_query(
+    "articles.search", f"{ARTICLE_SEARCH} ORDER BY score, a.id LIMIT ?"
+)
+SEARCH_ARTICLES_AFTER = register_query(
+    "articles.search_after",
+    f"{ARTICLE_SEARCH} AND ({ARTICLE_SEARCH_SCORE}, a.id) > (?, ?) ORDER BY score, a.id LIMIT ?"
+)
+
+
+def article_filter(category: Optional[str] = None, tags: Optional[List[str]] = None,
+                   match_all: bool = False, start: Optional[str] = None,
+                   end: Optional[str] = None) -> Tuple[str, tuple]:
+    """WHERE condition over articles for the faceted filters; dates are inclusive YYYY-MM-DD"""
+    conditions, params = [], []
+    if category:
+        conditions.append("type = ?")
+        params.append(category)
+    if start:
+        conditions.append("published_at >= ?")
+        params.append(start)
+    if end:
+        conditions.append("published_at < date(?, '+1 day')")
+        params.append(end)
+    if tags:
+        tagged = f"""
+            SELECT at.article_id FROM article_tags at
+            JOIN tags t ON t.id = at.tag_id
+            WHERE t.name IN ({", ".join("?" * len(tags))})
+        """
+        params.extend(tags)
+        if match_all:
+            tagged += " GROUP BY at.article_id HAVING COUNT(*) = ?"
+            params.append(len(tags))
+        conditions.append(f"id IN ({tagged})")
+    return " AND ".join(conditions), tuple(params)
+
+
+def _facet_counts_sql(where: str) -> str:
+    """Per-category and per-tag counts over the articles matching `where`"""
+    where = where or "1"
+    return f"""
+        SELECT 'category' as facet, type as value, COUNT(*) as count
+        FROM articles WHERE {where}
+        GROUP BY type
+        UNION ALL
+        SELECT 'tag' as facet, t.name as value, c.count
+        FROM (
+            SELECT at.tag_id, COUNT(*) as count FROM article_tags at
+            WHERE at.article_id IN (SELECT id FROM articles WHERE {where})
+            GROUP BY at.tag_id
+        ) c
+        JOIN tags t ON t.id = c.tag_id
+    """
+
+
+# Representative shapes of the dynamic facet queries, for the plan audit
+_all_filters = article_filter("category", ["tag"], True, "2020-01-01", "2020-12-31")[0]
+register_query("articles.facet_counts", _facet_counts_sql(_all_filters))
+register_query("articles.facet_page", ENHANCED_ARTICLES_PAGE.sql(_all_filters))
+register_query("articles.facet_page_after", ENHANCED_ARTICLES_PAGE.sql(_all_filters, after=True))
+
+RACES_PAGE = Keyset("races", "SELECT * FROM races", "date")
+WORKOUTS_PAGE = Keyset("workouts", "SELECT * FROM workouts", "date")
+SONGS_PAGE = Keyset("songs", "SELECT * FROM songs", "pinned_at")
+
+
+def fts_query(text: str) -> str:
+    """Turn user input into an FTS5 query: every word must match, `word*` matches a prefix"""
+    terms = []
+    for word in text.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    if not terms:
+        raise ValueError("Empty search query")
+    return " ".join(terms)
+
+
+class UserRepository:
+    async def get_by_username(self, username: str) -> Optional[Dict]:
+        """Get a user row by username"""
+        def query(conn):
+            return _row(conn.execute(USER_BY_USERNAME, (username,)))
+        return await run_db(query)
+
+
+class ArticleRepository:
+    async def list_articles(self) -> List[Dict]:
+        """Get all articles, newest first"""
+        def query(conn):
+            return _rows(conn.execute(LIST_ARTICLES))
+        return await run_db(query)
+
+    async def page_articles(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of articles, newest first, plus the cursor for the next page"""
+        return await run_db(ARTICLES_PAGE.page, limit, cursor)
+
+    async def list_enhanced(self) -> List[Dict]:
+        """Get all articles in the enhanced (frontend) column layout"""
+        def query(conn):
+            return [_decode_tags(row) for row in _rows(conn.execute(LIST_ENHANCED_ARTICLES))]
+        return await run_db(query)
+
+    async def page_enhanced(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of articles in the enhanced column layout"""
+        return await run_db(ENHANCED_ARTICLES_PAGE.page, limit, cursor)
+
+    async def get_enhanced(self, article_id: int) -> Optional[Dict]:
+        """Get one article in the enhanced column layout"""
+        def query(conn):
+            row = _row(conn.execute(GET_ENHANCED_ARTICLE, (article_id,)))
+            return _decode_tags(row) if row else None
+        return await run_db(query)
+
+    async def facets(self, limit: int, cursor: Optional[str] = None, category: Optional[str] = None,
+                     tags: Optional[List[str]] = None, match_all: bool = False,
+                     start: Optional[str] = None, end: Optional[str] = None) -> Dict:
+        """One page of filtered articles plus per-category and per-tag counts over all matches"""
+        where, params = article_filter(category, tags, match_all, start, end)
+
+        def query(conn):
+            conn.execute("BEGIN")  # page and counts from the same snapshot
+            try:
+                items, next_cursor = ENHANCED_ARTICLES_PAGE.page(conn, limit, cursor, where, params)
+                counts = {"category": {}, "tag": {}}
+                for facet, value, count in conn.execute(_facet_counts_sql(where), params * 2):
+                    counts[facet][value] = count
+            finally:
+                conn.commit()
+            return {
+                "items": items,
+                "next_cursor": next_cursor,
+                "categories": counts["category"],
+                "tags": counts["tag"],
+            }
+        return await run_db(query)
+
+    async def search(self, text: str, limit: int,
+                     cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Best-matching articles first, with highlighted snippets, plus the next-page cursor"""
+        match = fts_query(text)
+
+        def query(conn):
+            if cursor:
+                score, article_id = decode_cursor(cursor)
+                rows = _rows(conn.execute(SEARCH_ARTICLES_AFTER, (match, score, article_id, limit + 1)))
+            else:
+                rows = _rows(conn.execute(SEARCH_ARTICLES, (match, limit + 1)))
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1]["score"], rows[-1]["id"])
+            return [_decode_tags(row) for row in rows], next_cursor
+        return await run_db(query)
+
+    async def create(self, user_id: int, title: str, content: Optional[str], type: str,
+                     url: Optional[str], tags: Optional[str]) -> int:
+        """Insert an article and its tags; returns the new id"""
+        names = split_tags(tags)
+
+        def query(conn):
+            cursor = conn.execute("""
+                INSERT INTO articles (user_id, title, content, type, url, tags)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, title, content, type, url, ", ".join(names) or None))
+            set_article_tags(conn, cursor.lastrowid, names)
+            conn.commit()
+            return cursor.lastrowid
+        return await run_db(query)
+
+    async def update(self, article_id: int, fields: Dict) -> bool:
+        """Update the given columns; returns False if the article doesn't exist"""
+        def query(conn):
+            if not conn.execute("SELECT 1 FROM articles WHERE id = ?", (article_id,)).fetchone():
+                return False
+            updates = dict(fields)
+            if "tags" in updates:
+                names = split_tags(updates["tags"])
+                set_article_tags(conn, article_id, names)
+                updates["tags"] = ", ".join(names) or None
+            _update(conn, "articles", article_id, updates)
+            return True
+        return await run_db(query)
+
+    async def delete(self, article_id: int) -> bool:
+        """Delete an article; returns False if it doesn't exist"""
+        return await run_db(_delete, "articles", article_id)
+
+
+class RaceRepository:
+    async def list_races(self) -> List[Dict]:
+        """Get all races, most recent first"""
+        def query(conn):
+            return _rows(conn.execute(LIST_RACES))
+        return await run_db(query)
+
+    async def page_races(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of races, most recent first, plus the cursor for the next page"""
+        return await run_db(RACES_PAGE.page, limit, cursor)
+
+    async def get(self, race_id: int) -> Optional[Dict]:
+        """Get a race by id"""
+        def query(conn):
+            return _row(conn.execute(GET_RACE, (race_id,)))
+        return await run_db(query)
+
+    async def create(self, user_id: int, race_name: str, date: str, location: Optional[str],
+                     time: Optional[str], placement: Optional[str], notes: Optional[str],
+                     distance: str = "5k", race_type: str = "running") -> int:
+        """Insert a race and return its id"""
+        def query(conn):
+            cursor = conn.execute("""
+                INSERT INTO races (user_id, race_name, date, location, time, placement, notes, distance, race_type)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, race_name, date, location, time, placement, notes, distance, race_type))
+            conn.commit()
+            return cursor.lastrowid
+        return await run_db(query)
+
+    async def update(self, race_id: int, fields: Dict) -> bool:
+        """Update the given columns; returns False if the race doesn't exist"""
+        def query(conn):
+            if not conn.execute("SELECT 1 FROM races WHERE id = ?", (race_id,)).fetchone():
+                return False
+            _update(conn, "races", race_id, fields)
+            return True
+        return await run_db(query)
+
+    async def delete(self, race_id: int) -> bool:
+        """Delete a race; returns False if it doesn't exist"""
+        return await run_db(_delete, "races", race_id)
+
+
+class WorkoutRepository:
+    async def list_workouts(self) -> List[Dict]:
+        """Get all workouts, most recent first"""
+        def query(conn):
+            return _rows(conn.execute(LIST_WORKOUTS))
+        return await run_db(query)
+
+    async def page_workouts(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of workouts, most recent first, plus the cursor for the next page"""
+        return await run_db(WORKOUTS_PAGE.page, limit, cursor)
+
+    async def create(self, user_id: int, type: str, distance: Optional[float], duration: Optional[int],
+                     date: str, elevation: Optional[float]) -> int:
+        """Insert a manual workout and return its id"""
+        def query(conn):
+            cursor = conn.execute("""
+                INSERT INTO workouts (user_id, type, distance, duration, date, elevation)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, type, distance, duration, date, elevation))
+            conn.commit()
+            return cursor.lastrowid
+        return await run_db(query)
+
+
+ROLLUPS_IN_RANGE = register_query("fitness_rollups.range", """
+    SELECT period, type, count, distance, duration, elevation
+    FROM fitness_rollups
+    WHERE user_id = ? AND grain = ? AND period BETWEEN ? AND ?
+    ORDER BY period, type
+""")
+
+
+class FitnessRepository:
+    async def rollups(self, user_id: int, grain: str, start: Optional[str] = None,
+                      end: Optional[str] = None) -> List[Dict]:
+        """Rollup totals per period between the periods containing start and end (inclusive)"""
+        low = period_key(grain, start) if start else ""
+        high = period_key(grain, end) if end else "9999"
+
+        def query(conn):
+            return group_rollups(_rows(conn.execute(ROLLUPS_IN_RANGE, (user_id, grain, low, high))))
+        return await run_db(query)
+
+
+class SongRepository:
+    async def list_songs(self) -> List[Dict]:
+        """Get all pinned songs, newest first"""
+        def query(conn):
+            return _rows(conn.execute(LIST_SONGS))
+        return await run_db(query)
+
+    async def page_songs(self, limit: int, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of pinned songs, newest first, plus the cursor for the next page"""
+        return await run_db(SONGS_PAGE.page, limit, cursor)
+
+    async def create(self, user_id: int, track_name: str, artist: str, album: Optional[str],
+                     album_art: Optional[str], personal_note: Optional[str]) -> int:
+        """Insert a song and return its id"""
+        def query(conn):
+            cursor = conn.execute("""
+                INSERT INTO songs (user_id, track_name, artist, album, album_art, personal_note)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (user_id, track_name, artist, album, album_art, personal_note))
+            conn.commit()
+            return cursor.lastrowid
+        return await run_db(query)
+
+
+class TokenRepository:
+    # Tables cleared when a provider is disconnected
+    PROVIDER_TABLES = {
+        "strava": ("strava_tokens", "strava_athletes", "strava_activities", "strava_sync_state",
+                   "strava_streams", "stream_segments"),
+        "spotify": ("spotify_tokens", "spotify_profiles", "spotify_tracks", "spotify_plays"),
+    }
+
+    TOKENS_QUERIES = {
+        provider: register_query(f"{provider}.tokens", f"""
+            SELECT access_token, refresh_token, expires_at
+            FROM {tables[0]}
+            WHERE user_id = ?
+        """)
+        for provider, tables in PROVIDER_TABLES.items()
+    }
+
+    async def get_tokens(self, provider: str, user_id: int) -> Optional[Dict]:
+        """Get the stored OAuth tokens for a provider without refreshing them"""
+        sql = self.TOKENS_QUERIES[provider]
+
+        def query(conn):
+            return _row(conn.execute(sql, (user_id,)))
+        return await run_db(query)
+
+    async def clear_provider(self, provider: str, user_id: int):
+        """Delete tokens and cached data for a provider"""
+        tables = self.PROVIDER_TABLES[provider]
+
+        def query(conn):
+            for table in tables:
+                conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            conn.commit()
+        await run_db(query)
+
+
+async def count_rows(tables: List[str]) -> Dict[str, int]:
+    """Count rows in each table (used by the database test endpoint)"""
+    def query(conn):
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in tables
+        }
+    return await run_db(query)
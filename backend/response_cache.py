@@ -0,0 +1,157 @@
+"""
+Tiered response cache.
+
+Upstream read responses are kept in a bounded in-memory LRU backed by the
+`response_cache` table, so they survive restarts. Each read names its own TTL.
+Within the TTL the cached value is served as is; after it, for up to
+`stale_seconds` more, the stale value is still served immediately while one
+background task fetches a fresh copy (stale-while-revalidate). Past that, or
+on a miss, the caller waits for the fetch; concurrent misses for one key share
+a single fetch.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from database import register_query, run_db
+from integrations.coalesce import SingleFlight
+
+CACHE_MEMORY_ENTRIES = 512
+CACHE_STALE_SECONDS = 24 * 60 * 60
+
+CACHE_GET = register_query("response_cache.get", "SELECT value, stored_at FROM response_cache WHERE key = ?")
+
+CACHE_PUT = """
+    INSERT INTO response_cache (key, value, stored_at) VALUES (?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET value = excluded.value, stored_at = excluded.stored_at
+"""
+
+# Keys under a prefix form one primary-key range
+CACHE_PURGE_PREFIX = register_query(
+    "response_cache.purge_prefix", "DELETE FROM response_cache WHERE key >= ? AND key < ?"
+)
+
+
+def _disk_get(conn, key: str) -> Optional[Tuple[Any, float]]:
+    row = conn.execute(CACHE_GET, (key,)).fetchone()
+    return (json.loads(row["value"]), row["stored_at"]) if row else None
+
+
+def _disk_put(conn, key: str, value: Any, stored_at: float):
+    conn.execute(CACHE_PUT, (key, json.dumps(value), stored_at))
+    conn.commit()
+
+
+def _disk_purge(conn, prefix: Optional[str]) -> int:
+    if prefix:
+        deleted = conn.execute(CACHE_PURGE_PREFIX, (prefix, prefix + "\uffff")).rowcount
+    else:
+        deleted = conn.execute("DELETE FROM response_cache").rowcount
+    conn.commit()
+    return deleted
+
+
+class ResponseCache:
+    """Memory LRU over an on-disk store with per-read TTLs and stale-while-revalidate"""
+
+    def __init__(self, max_entries: int = CACHE_MEMORY_ENTRIES, stale_seconds: float = CACHE_STALE_SECONDS):
+        self.max_entries = max_entries
+        self.stale_seconds = stale_seconds
+        self._memory: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._loads = SingleFlight()
+        self.counters = {
+            "memory_hits": 0, "disk_hits": 0, "stale_hits": 0,
+            "misses": 0, "revalidations": 0, "errors": 0,
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _remember(self, key: str, entry: Tuple[Any, float]):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    async def _lookup(self, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry
+        entry = await run_db(_disk_get, key)
+        if entry is not None:
+            self._count("disk_hits")
+            self._remember(key, entry)
+        return entry
+
+    async def _store(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        value = await fetch()
+        entry = (value, time.time())
+        self._remember(key, entry)
+        await run_db(_disk_put, key, *entry)
+        return value
+
+    async def _revalidate(self, key: str, fetch: Callable[[], Awaitable[Any]]):
+        try:
+            await self._store(key, fetch)
+            self._count("revalidations")
+        except Exception as e:
+            # Keep serving the stale value; the next read tries again
+            self._count("errors")
+            print(f"⚠️ Cache revalidation failed for {key}: {e}")
+        finally:
+            self._refreshing.pop(key, None)
+
+    async def get(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Cached value for key, calling fetch() on a miss or (in the background) once it is stale"""
+        entry = await self._lookup(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            if age < ttl:
+                return value
+            if age < ttl + self.stale_seconds:
+                self._count("stale_hits")
+                if key not in self._refreshing:
+                    self._refreshing[key] = asyncio.create_task(self._revalidate(key, fetch))
+                return value
+        self._count("misses")
+        return await self._loads.do_async(key, self._store, key, fetch)
+
+    async def purge(self, prefix: Optional[str] = None) -> int:
+        """Drop every entry (or those whose key starts with prefix); returns how many disk rows went"""
+        with self._lock:
+            for key in [key for key in self._memory if prefix is None or key.startswith(prefix)]:
+                del self._memory[key]
+        return await run_db(_disk_purge, prefix)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and sizes"""
+        with self._lock:
+            counters = dict(self.counters)
+            memory_entries = len(self._memory)
+        hits = counters["memory_hits"] + counters["disk_hits"]
+        lookups = hits + counters["misses"]
+        return {
+            **counters,
+            "hit_ratio": round(hits / lookups, 3) if lookups else None,
+            "memory_entries": memory_entries,
+            "refreshing": len(self._refreshing),
+        }
+
+    async def close(self):
+        """Cancel background revalidations (called at shutdown)"""
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Training rollups.
+
+`fitness_rollups` holds per-type totals (count, distance, moving time,
+elevation) of the workouts table by day, ISO week, month and year. Triggers on
+workouts keep it current as rows are inserted, updated or deleted, which covers
+both manual workouts and the Strava sync. `rebuild_rollups()` recomputes it
+from scratch.
+
+Usage: python rollups.py   (rebuilds the rollups in DATABASE_PATH)
+"""
+
+import sqlite3
+from datetime import date, timedelta
+from typing import Dict, List
+
+from database import get_pool
+
+GRAINS = ("day", "week", "month", "year")
+
+
+def period_sql(grain: str, day: str) -> str:
+    """SQL expression for the period key containing the date expression `day`
+
+    Keys sort as text: day 'YYYY-MM-DD', week is the date of its Monday,
+    month 'YYYY-MM', year 'YYYY'. NULL when `day` isn't a valid date.
+    """
+    if grain == "day":
+        return f"date({day})"
+    if grain == "week":
+        return f"date({day}, '-' || ((CAST(strftime('%w', {day}) AS INTEGER) + 6) % 7) || ' days')"
+    if grain == "month":
+        return f"strftime('%Y-%m', {day})"
+    if grain == "year":
+        return f"strftime('%Y', {day})"
+    raise ValueError(f"grain must be one of {', '.join(GRAINS)}")
+
+
+def period_key(grain: str, day: str) -> str:
+    """Python twin of period_sql for a YYYY-MM-DD string; raises ValueError if it isn't a date"""
+    value = date.fromisoformat(day)
+    if grain == "day":
+        return value.isoformat()
+    if grain == "week":
+        return (value - timedelta(days=value.weekday())).isoformat()
+    if grain == "month":
+        return value.strftime("%Y-%m")
+    if grain == "year":
+        return value.strftime("%Y")
+    raise ValueError(f"grain must be one of {', '.join(GRAINS)}")
+
+
+def _apply_workout_sql(row: str, sign: int) -> str:
+    """Add (sign=1) or remove (sign=-1) one workout row (`new`/`old`) in every grain"""
+    periods = " UNION ALL ".join(
+        f"SELECT '{grain}' as grain, {period_sql(grain, f'{row}.date')} as period" for grain in GRAINS
+    )
+    return f"""
+        INSERT INTO fitness_rollups (user_id, grain, period, type, count, distance, duration, elevation)
+        SELECT {row}.user_id, grain, period, {row}.type, {sign},
+               {sign} * COALESCE({row}.distance, 0), {sign} * COALESCE({row}.duration, 0),
+               {sign} * COALESCE({row}.elevation, 0)
+        FROM ({periods})
+        WHERE period IS NOT NULL
+        ON CONFLICT (user_id, grain, period, type) DO UPDATE SET
+            count = count + excluded.count,
+            distance = distance + excluded.distance,
+            duration = duration + excluded.duration,
+            elevation = elevation + excluded.elevation;
+    """
+
+
+def _prune_sql(row: str) -> str:
+    """Drop the buckets a removed workout left empty"""
+    periods = ", ".join(period_sql(grain, f"{row}.date") for grain in GRAINS)
+    return f"""
+        DELETE FROM fitness_rollups
+        WHERE user_id = {row}.user_id AND grain IN ({", ".join(repr(grain) for grain in GRAINS)})
+          AND period IN ({periods}) AND type = {row}.type AND count <= 0;
+    """
+
+
+def create_rollup_triggers(conn: sqlite3.Connection):
+    """Keep fitness_rollups in step with every write to workouts"""
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS workouts_rollup_insert AFTER INSERT ON workouts BEGIN
+            {_apply_workout_sql("new", 1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS workouts_rollup_delete AFTER DELETE ON workouts BEGIN
+            {_apply_workout_sql("old", -1)}
+            {_prune_sql("old")}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS workouts_rollup_update
+        AFTER UPDATE OF user_id, type, distance, duration, date, elevation ON workouts BEGIN
+            {_apply_workout_sql("old", -1)}
+            {_apply_workout_sql("new", 1)}
+            {_prune_sql("old")}
+        END
+    """)
+
+
+def rebuild_rollups(conn: sqlite3.Connection):
+    """Recompute every rollup from the workouts table (does not commit)"""
+    conn.execute("DELETE FROM fitness_rollups")
+    for grain in GRAINS:
+        period = period_sql(grain, "date")
+        conn.execute(f"""
+            INSERT INTO fitness_rollups (user_id, grain, period, type, count, distance, duration, elevation)
+            SELECT user_id, '{grain}', {period}, type, COUNT(*),
+                   COALESCE(SUM(distance), 0), COALESCE(SUM(duration), 0), COALESCE(SUM(elevation), 0)
+            FROM workouts
+            WHERE {period} IS NOT NULL
+            GROUP BY user_id, {period}, type
+        """)
+
+
+def group_rollups(rows: List[Dict]) -> List[Dict]:
+    """Fold per-type rollup rows into one entry per period with a per-type breakdown"""
+    periods: Dict[str, Dict] = {}
+    for row in rows:
+        entry = periods.setdefault(row["period"], {
+            "period": row["period"], "count": 0, "distance": 0.0, "duration": 0, "elevation": 0.0, "types": {}
+        })
+        for field in ("count", "distance", "duration", "elevation"):
+            entry[field] += row[field]
+        entry["types"][row["type"]] = {
+            field: row[field] for field in ("count", "distance", "duration", "elevation")
+        }
+    return list(periods.values())
+
+
+if __name__ == "__main__":
+    with get_pool().connection() as conn:
+        rebuild_rollups(conn)
+        conn.commit()
+        count = conn.execute("SELECT COUNT(*) FROM fitness_rollups").fetchone()[0]
+    print(f"✅ Rebuilt {count} rollup rows")
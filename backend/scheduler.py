@@ -0,0 +1,229 @@
+"""
+Background sync scheduler.
+
+Runs the periodic sync jobs (Strava incremental sync, Spotify listening history
+and top-track snapshots) from the FastAPI lifespan. Every uvicorn worker starts
+a `Scheduler`, but only the one holding the `scheduler_leases` row runs jobs.
+The lease is a row with an expiry that its holder keeps pushing forward; any
+worker may take it over once it lapses, so if the leader dies another picks up
+within LEASE_SECONDS.
+
+Each job's interval adapts to what its last run found: after a run that
+brought in new data it drops back to the job's minimum, and after each idle or
+failed run it doubles, up to the job's maximum. A run deferred by the Strava
+rate limiter is retried when the quota resets. The schedule lives in
+`scheduler_jobs`, so a new leader carries on from where the old one stopped.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from database import get_pool, register_query
+
+LEASE_SECONDS = 60.0
+# Held leases are renewed (and free ones tried) this often
+LEASE_RENEW_SECONDS = 20.0
+
+# Take the lease if it is free, expired or already ours; rowcount says whether we hold it
+CLAIM_LEASE = """
+    INSERT INTO scheduler_leases (name, holder, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+    WHERE scheduler_leases.holder = excluded.holder OR scheduler_leases.expires_at < ?
+"""
+
+RELEASE_LEASE = register_query(
+    "scheduler_leases.release", "DELETE FROM scheduler_leases WHERE name = ? AND holder = ?"
+)
+
+LEASE_HOLDER = register_query(
+    "scheduler_leases.holder", "SELECT holder, expires_at FROM scheduler_leases WHERE name = ?"
+)
+
+JOB_STATE = register_query("scheduler_jobs.get", "SELECT * FROM scheduler_jobs WHERE name = ?")
+
+SAVE_JOB_STATE = """
+    INSERT INTO scheduler_jobs (name, interval, next_run_at, last_run_at, last_result) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET
+        interval = excluded.interval,
+        next_run_at = excluded.next_run_at,
+        last_run_at = excluded.last_run_at,
+        last_result = excluded.last_result
+"""
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp else None
+
+
+class Lease:
+    """A named lease in SQLite that at most one holder has at a time"""
+
+    def __init__(self, name: str, seconds: float = LEASE_SECONDS, db_path: str = None):
+        self.name = name
+        self.seconds = seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.pool = get_pool(db_path)
+
+    def acquire(self) -> bool:
+        """Take or renew the lease; False while another holder's lease is live"""
+        now = time.time()
+        with self.pool.connection() as conn:
+            claimed = conn.execute(CLAIM_LEASE, (self.name, self.holder, now + self.seconds, now)).rowcount
+            conn.commit()
+        return claimed == 1
+
+    def release(self):
+        """Give the lease up so another worker can take it straight away"""
+        with self.pool.connection() as conn:
+            conn.execute(RELEASE_LEASE, (self.name, self.holder))
+            conn.commit()
+
+    def current(self) -> Optional[Dict]:
+        with self.pool.connection() as conn:
+            row = conn.execute(LEASE_HOLDER, (self.name,)).fetchone()
+        return {'holder': row['holder'], 'expires_at': _iso(row['expires_at'])} if row else None
+
+
+class Job:
+    """A periodic sync; run() returns a result dict and active(result) says whether it found new data"""
+
+    def __init__(self, name: str, run: Callable[[], Dict], active: Callable[[Dict], bool],
+                 min_interval: float, max_interval: float):
+        self.name = name
+        self.run = run
+        self.active = active
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+    def next_interval(self, interval: float, result: Optional[Dict]) -> float:
+        if result is not None and self.active(result):
+            return self.min_interval
+        return min(self.max_interval, max(self.min_interval, interval * 2))
+
+
+class Scheduler:
+    """Runs due jobs one at a time in a worker thread, while this process holds the lease"""
+
+    def __init__(self, jobs: List[Job], lease: Lease):
+        self.jobs = jobs
+        self.lease = lease
+        self.pool = lease.pool
+        self.leader = False
+        self.running: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._job_task: Optional[asyncio.Task] = None
+
+    def _state(self, job: Job) -> Dict:
+        with self.pool.connection() as conn:
+            row = conn.execute(JOB_STATE, (job.name,)).fetchone()
+        if row:
+            return dict(row)
+        return {'name': job.name, 'interval': job.min_interval, 'next_run_at': 0.0,
+                'last_run_at': None, 'last_result': None}
+
+    def _save_state(self, state: Dict):
+        with self.pool.connection() as conn:
+            conn.execute(SAVE_JOB_STATE, (
+                state['name'], state['interval'], state['next_run_at'], state['last_run_at'], state['last_result']
+            ))
+            conn.commit()
+
+    async def _hold_lease(self) -> bool:
+        try:
+            self.leader = await asyncio.to_thread(self.lease.acquire)
+        except Exception as e:
+            print(f"⚠️ Scheduler lease check failed: {e}")
+            self.leader = False
+        return self.leader
+
+    async def _run_job(self, job: Job, state: Dict):
+        """Run one job, renewing the lease while it works, then schedule its next run"""
+        self.running = job.name
+        started = time.time()
+        work = asyncio.ensure_future(asyncio.to_thread(job.run))
+        while not work.done():
+            await asyncio.wait({work}, timeout=LEASE_RENEW_SECONDS)
+            if not work.done():
+                await self._hold_lease()
+        self.running = None
+
+        try:
+            result = work.result()
+        except Exception as e:
+            print(f"❌ Scheduled job {job.name} failed: {e}")
+            result, outcome = None, {'error': str(e)}
+        else:
+            outcome = result
+        interval = job.next_interval(state['interval'], result)
+        next_run_at = time.time() + interval
+        deferred_until = (result or {}).get('deferred_until')
+        if deferred_until:
+            next_run_at = datetime.fromisoformat(deferred_until).timestamp()
+        await asyncio.to_thread(self._save_state, {
+            **state, 'interval': interval, 'next_run_at': next_run_at,
+            'last_run_at': started, 'last_result': json.dumps(outcome)
+        })
+        print(f"🔄 Scheduled job {job.name} done; next run in {next_run_at - time.time():.0f}s")
+
+    async def _run(self):
+        while True:
+            wait = LEASE_RENEW_SECONDS
+            if await self._hold_lease():
+                for job in self.jobs:
+                    state = await asyncio.to_thread(self._state, job)
+                    if state['next_run_at'] <= time.time():
+                        # Shielded so close() can let a job that is under way finish first
+                        self._job_task = asyncio.ensure_future(self._run_job(job, state))
+                        await asyncio.shield(self._job_task)
+                        if not self.leader:
+                            break  # lost the lease mid-run; whoever holds it now carries on
+                    else:
+                        wait = min(wait, state['next_run_at'] - time.time())
+            await asyncio.sleep(max(wait, 1.0))
+
+    def start(self):
+        """Start competing for the lease and running jobs"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop scheduling and hand the lease over (called at shutdown)"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._job_task and not self._job_task.done():
+            # The job's thread can't be stopped; keep the lease (renewed) until it ends so no
+            # other worker starts the same job alongside it
+            print(f"⏳ Waiting for scheduled job {self.running} to finish...")
+            await asyncio.gather(self._job_task, return_exceptions=True)
+        self._job_task = None
+        if self.leader:
+            await asyncio.to_thread(self.lease.release)
+            self.leader = False
+
+    def status(self) -> Dict:
+        """Leader, lease and per-job schedule (reads the database; call from a worker thread)"""
+        jobs = []
+        for job in self.jobs:
+            state = self._state(job)
+            jobs.append({
+                'name': job.name,
+                'interval': state['interval'],
+                'next_run_at': _iso(state['next_run_at']),
+                'last_run_at': _iso(state['last_run_at']),
+                'last_result': json.loads(state['last_result']) if state['last_result'] else None,
+            })
+        return {
+            'leader': self.leader,
+            'holder': self.lease.holder,
+            'lease': self.lease.current(),
+            'running': self.running,
+            'jobs': jobs,
+        }
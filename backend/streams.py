@@ -0,0 +1,298 @@
+"""
+Activity stream storage.
+
+Strava streams (time, GPS, heart rate, cadence, altitude, ...) are stored one
+channel per row in `strava_streams` as a zlib-compressed typed array instead of
+JSON. Integer channels are delta-encoded into the narrowest integer type that
+holds every step, latlng is stored as delta-encoded 1e-7 degree fixed point
+(the precision of an encoded polyline), real-valued channels as float32 and
+`moving` as packed bits. Decoding is a single `np.frombuffer` (plus `cumsum`
+for deltas) per channel, so no per-sample Python objects are created.
+
+With STREAM_BACKEND=mmap, streams go to MmapStreamStore instead: one
+append-only, uncompressed file per channel under STREAM_DIR and an offsets
+index in `stream_segments`, read back as `numpy.memmap` slices without copying.
+Both stores have the same methods, and `open_stream_store()` picks one.
+"""
+
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from database import DATABASE_PATH, get_pool, register_query
+
+STREAM_BACKEND = os.getenv("STREAM_BACKEND", "sqlite")
+STREAM_DIR = os.getenv("STREAM_DIR")
+
+# Strava stream type -> codec
+CHANNEL_CODECS = {
+    "time": "delta",
+    "distance": "float32",
+    "latlng": "latlng",
+    "altitude": "float32",
+    "velocity_smooth": "float32",
+    "heartrate": "delta",
+    "cadence": "delta",
+    "watts": "delta",
+    "temp": "delta",
+    "moving": "bool",
+    "grade_smooth": "float32",
+}
+STREAM_TYPES = tuple(CHANNEL_CODECS)
+
+LATLNG_SCALE = 1e7
+COMPRESSION_LEVEL = 6
+_DELTA_DTYPES = ("<i1", "<i2", "<i4", "<i8")
+
+# On-disk element type of each codec in the mmap backend
+MMAP_DTYPES = {"delta": "<i4", "latlng": "<f8", "float32": "<f4", "bool": "|b1"}
+
+STREAMS_BY_ACTIVITY = register_query("strava_streams.by_activity", """
+    SELECT channel, codec, dtype, samples, data
+    FROM strava_streams
+    WHERE strava_id = ? AND user_id = ?
+""")
+
+STREAMS_BY_CHANNEL = register_query("strava_streams.by_channel", """
+    SELECT strava_id, codec, dtype, samples, data
+    FROM strava_streams
+    WHERE user_id = ? AND channel = ?
+""")
+
+SEGMENTS_BY_ACTIVITY = register_query("stream_segments.by_activity", """
+    SELECT channel, offset, samples
+    FROM stream_segments
+    WHERE strava_id = ? AND user_id = ?
+""")
+
+SEGMENTS_BY_CHANNEL = register_query("stream_segments.by_channel", """
+    SELECT strava_id, offset, samples
+    FROM stream_segments
+    WHERE user_id = ? AND channel = ?
+    ORDER BY offset
+""")
+
+UPSERT_SEGMENT = """
+    INSERT INTO stream_segments (user_id, strava_id, channel, offset, samples)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (strava_id, channel) DO UPDATE SET
+        user_id = excluded.user_id,
+        offset = excluded.offset,
+        samples = excluded.samples
+"""
+
+UPSERT_STREAM = """
+    INSERT INTO strava_streams (user_id, strava_id, channel, codec, dtype, samples, data)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (strava_id, channel) DO UPDATE SET
+        user_id = excluded.user_id,
+        codec = excluded.codec,
+        dtype = excluded.dtype,
+        samples = excluded.samples,
+        data = excluded.data
+"""
+
+
+def _narrowest_int(values: np.ndarray) -> str:
+    """Smallest little-endian integer dtype that can hold every value"""
+    if not len(values):
+        return _DELTA_DTYPES[0]
+    low, high = int(values.min()), int(values.max())
+    for dtype in _DELTA_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return _DELTA_DTYPES[-1]
+
+
+def _deltas(values: np.ndarray) -> Tuple[str, bytes]:
+    steps = np.diff(values, prepend=values.dtype.type(0))
+    dtype = _narrowest_int(steps)
+    return dtype, steps.astype(dtype).tobytes()
+
+
+def _channel_values(channel: str, data: Iterable) -> Tuple[str, np.ndarray]:
+    """Codec and decoded-form array for one stream's raw samples"""
+    codec = CHANNEL_CODECS.get(channel)
+    if codec is None:
+        raise ValueError(f"Unknown stream type: {channel}")
+
+    # Gaps in a stream come through as null; they decode as 0 (ints) or NaN (floats)
+    values = np.asarray(data if isinstance(data, np.ndarray) else list(data), dtype=np.float64)
+    if codec == "delta":
+        return codec, np.rint(np.nan_to_num(values)).astype(np.int64)
+    if codec == "latlng":
+        # Quantized like the SQLite store so both backends return the same points
+        return codec, np.rint(np.nan_to_num(values.reshape(-1, 2)) * LATLNG_SCALE) / LATLNG_SCALE
+    if codec == "bool":
+        return codec, np.nan_to_num(values) != 0
+    return codec, values.astype("<f4")
+
+
+def encode_channel(channel: str, data: Iterable) -> Tuple[str, str, int, bytes]:
+    """Encode one stream's samples; returns (codec, dtype, samples, compressed blob)"""
+    codec, values = _channel_values(channel, data)
+    samples = len(values)
+    if codec == "delta":
+        dtype, raw = _deltas(values)
+    elif codec == "latlng":
+        dtype, raw = _deltas(np.rint(values * LATLNG_SCALE).astype(np.int64).ravel())
+    elif codec == "bool":
+        dtype, raw = "bits", np.packbits(values).tobytes()
+    else:
+        dtype, raw = "<f4", values.tobytes()
+    return codec, dtype, samples, zlib.compress(raw, COMPRESSION_LEVEL)
+
+
+def decode_channel(codec: str, dtype: str, samples: int, blob: bytes) -> np.ndarray:
+    """Inverse of encode_channel; float32 arrays are read-only views of the decompressed buffer"""
+    raw = zlib.decompress(blob)
+    if codec == "bool":
+        return np.unpackbits(np.frombuffer(raw, dtype=np.uint8), count=samples).astype(bool)
+    values = np.frombuffer(raw, dtype=dtype)
+    if codec == "delta":
+        return np.cumsum(values, dtype=np.int64)
+    if codec == "latlng":
+        return np.cumsum(values, dtype=np.int64).reshape(samples, 2) / LATLNG_SCALE
+    return values
+
+
+def _stream_data(streams: Dict[str, Dict]) -> Iterator[Tuple[str, Iterable]]:
+    """(channel, samples) for the stream types we store"""
+    for channel, stream in streams.items():
+        if channel in CHANNEL_CODECS:
+            yield channel, stream["data"] if isinstance(stream, dict) else stream
+
+
+def stream_rows(user_id: int, strava_id: str, streams: Dict[str, Dict]) -> List[tuple]:
+    """strava_streams rows for a Strava streams response keyed by type"""
+    return [
+        (user_id, str(strava_id), channel, *encode_channel(channel, data))
+        for channel, data in _stream_data(streams)
+    ]
+
+
+class SQLiteStreamStore:
+    """Encoded activity streams in the strava_streams table"""
+
+    def __init__(self, db_path: str = None):
+        self.pool = get_pool(db_path)
+
+    def save(self, cursor: sqlite3.Cursor, user_id: int, strava_id: str, streams: Dict[str, Dict]) -> int:
+        """Store every channel of one activity inside the caller's transaction; returns bytes stored"""
+        rows = stream_rows(user_id, strava_id, streams)
+        cursor.executemany(UPSERT_STREAM, rows)
+        return sum(len(row[-1]) for row in rows)
+
+    def load(self, user_id: int, strava_id: str, channels: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """Decode the stored channels of one activity (all of them unless `channels` is given)"""
+        wanted = set(channels) if channels is not None else None
+        with self.pool.connection() as conn:
+            rows = conn.execute(STREAMS_BY_ACTIVITY, (str(strava_id), user_id)).fetchall()
+        return {
+            row["channel"]: decode_channel(row["codec"], row["dtype"], row["samples"], row["data"])
+            for row in rows
+            if wanted is None or row["channel"] in wanted
+        }
+
+    def channel(self, user_id: int, channel: str) -> Iterator[Tuple[str, np.ndarray]]:
+        """(strava_id, samples) for one channel of every activity a user has stored"""
+        with self.pool.connection() as conn:
+            rows = conn.execute(STREAMS_BY_CHANNEL, (user_id, channel)).fetchall()
+        for row in rows:
+            yield row["strava_id"], decode_channel(row["codec"], row["dtype"], row["samples"], row["data"])
+
+
+class MmapStreamStore:
+    """Uncompressed activity streams in append-only per-channel files, indexed by stream_segments
+
+    Every save appends; re-saving an activity points its segments at the new
+    bytes and leaves the old ones unreferenced. Arrays handed out are read-only
+    views into a shared memory map.
+    """
+
+    def __init__(self, directory: str = None, db_path: str = None):
+        self.pool = get_pool(db_path)
+        self.directory = directory or os.path.join(os.path.dirname(db_path or DATABASE_PATH), "streams")
+        os.makedirs(self.directory, exist_ok=True)
+        self._maps: Dict[str, np.memmap] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, channel: str) -> str:
+        return os.path.join(self.directory, f"{channel}.bin")
+
+    def _append(self, channel: str, values: np.ndarray) -> int:
+        """Append values to a channel file; returns the element offset they start at"""
+        raw = values.tobytes()
+        # O_APPEND writes land at the end even with several writers, so the
+        # position after the write tells us where ours started
+        fd = os.open(self._path(channel), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = 0
+            while written < len(raw):
+                written += os.write(fd, raw[written:])
+            end = os.lseek(fd, 0, os.SEEK_CUR)
+        finally:
+            os.close(fd)
+        return (end - len(raw)) // values.dtype.itemsize
+
+    def _map(self, channel: str, end: int) -> np.memmap:
+        """Memory map of a channel file covering at least `end` elements"""
+        mapped = self._maps.get(channel)
+        if mapped is None or len(mapped) < end:
+            with self._lock:
+                mapped = self._maps.get(channel)
+                if mapped is None or len(mapped) < end:
+                    dtype = np.dtype(MMAP_DTYPES[CHANNEL_CODECS[channel]])
+                    elements = os.path.getsize(self._path(channel)) // dtype.itemsize
+                    mapped = np.memmap(self._path(channel), dtype=dtype, mode="r", shape=(elements,))
+                    self._maps[channel] = mapped
+        return mapped
+
+    def _slice(self, channel: str, offset: int, samples: int) -> np.ndarray:
+        if CHANNEL_CODECS[channel] == "latlng":
+            return self._map(channel, offset + samples * 2)[offset:offset + samples * 2].reshape(samples, 2)
+        return self._map(channel, offset + samples)[offset:offset + samples]
+
+    def save(self, cursor: sqlite3.Cursor, user_id: int, strava_id: str, streams: Dict[str, Dict]) -> int:
+        """Append every channel of one activity and index it inside the caller's transaction; returns bytes stored"""
+        stored = 0
+        for channel, data in _stream_data(streams):
+            codec, values = _channel_values(channel, data)
+            values = np.ascontiguousarray(values, dtype=MMAP_DTYPES[codec])
+            offset = self._append(channel, values)
+            cursor.execute(UPSERT_SEGMENT, (user_id, str(strava_id), channel, offset, len(values)))
+            stored += values.nbytes
+        return stored
+
+    def load(self, user_id: int, strava_id: str, channels: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """Memory-mapped views of the stored channels of one activity (all of them unless `channels` is given)"""
+        wanted = set(channels) if channels is not None else None
+        with self.pool.connection() as conn:
+            rows = conn.execute(SEGMENTS_BY_ACTIVITY, (str(strava_id), user_id)).fetchall()
+        return {
+            row["channel"]: self._slice(row["channel"], row["offset"], row["samples"])
+            for row in rows
+            if wanted is None or row["channel"] in wanted
+        }
+
+    def channel(self, user_id: int, channel: str) -> Iterator[Tuple[str, np.ndarray]]:
+        """(strava_id, samples) for one channel of every activity a user has stored, in file order"""
+        with self.pool.connection() as conn:
+            rows = conn.execute(SEGMENTS_BY_CHANNEL, (user_id, channel)).fetchall()
+        for row in rows:
+            yield row["strava_id"], self._slice(channel, row["offset"], row["samples"])
+
+
+def open_stream_store(db_path: str = None, backend: str = None):
+    """The stream store selected by STREAM_BACKEND (sqlite or mmap)"""
+    backend = backend or STREAM_BACKEND
+    if backend == "mmap":
+        return MmapStreamStore(STREAM_DIR, db_path)
+    if backend == "sqlite":
+        return SQLiteStreamStore(db_path)
+    raise ValueError(f"Unknown STREAM_BACKEND: {backend}")
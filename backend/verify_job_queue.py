@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Job Queue Check
+Runs queued Strava syncs against a stubbed sync on a throwaway database and
+checks that:
+- a sync the rate limiter defers is re-run at its retry time without using up
+  an attempt
+- a scheduled sync only enqueues (sharing the job already queued for the user)
+  instead of running the sync itself
+Exits non-zero if any check fails.
+
+Usage: python verify_job_queue.py [--defer-seconds 1]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--defer-seconds", type=float, default=1.0, help="how far ahead the stub defers the sync")
+    args = parser.parse_args()
+
+    # Point the app at a throwaway database before anything is imported
+    workdir = tempfile.mkdtemp(prefix="job-queue-check-")
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "website.db")
+    os.environ.setdefault("SPOTIFY_CLIENT_ID", "check")
+    os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "check")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import main as app_module
+    from job_queue import PRIORITY_HIGH, WorkerPool
+
+    app_module.init_db()
+    user_id = app_module.owner_id()
+    app_module.strava_sync.save_tokens(user_id, {"access_token": "check", "refresh_token": "check", "expires_in": 3600})
+
+    # First run hits the rate limit, the second completes
+    runs = []
+    retry_at = time.time() + args.defer_seconds
+
+    def stub_backfill(user_id, per_page=50, max_pages=None, progress=None):
+        runs.append(time.time())
+        deferred = len(runs) == 1
+        return {
+            'synced_count': 0 if deferred else 3,
+            'total_activities': 3,
+            'deferred_until': datetime.fromtimestamp(retry_at, timezone.utc).isoformat() if deferred else None,
+        }
+
+    app_module.strava_sync.backfill = stub_backfill
+
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'✅' if ok else '❌'} {name}{f': {detail}' if detail else ''}")
+        if not ok:
+            failures.append(name)
+
+    job_id, _ = app_module.enqueue_strava_sync(user_id, 50, PRIORITY_HIGH)
+    scheduled = app_module.scheduled_strava_sync()
+    check("scheduled sync shares the queued job", scheduled['job_id'] == job_id and scheduled['deduplicated'],
+          str(scheduled))
+    check("scheduled sync doesn't run the sync itself", not runs)
+
+    pool = WorkerPool(app_module.job_queue, 2)
+    pool.start()
+    deadline = time.time() + args.defer_seconds + 10
+    job = app_module.job_queue.get(job_id)
+    while job['status'] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.1)
+        job = app_module.job_queue.get(job_id)
+    pool.stop()
+
+    check("deferred sync succeeds", job['status'] == "succeeded", job['status'])
+    check("deferred sync is run twice", len(runs) == 2, f"{len(runs)} runs")
+    check("rerun waits for the retry time", len(runs) == 2 and runs[1] >= retry_at)
+    check("deferral doesn't use an attempt", job['attempts'] == 1, f"{job['attempts']} attempts")
+    check("result is the completed run's", (job['result'] or {}).get('synced_count') == 3, str(job['result']))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
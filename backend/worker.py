@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Job Queue Worker
+Runs queued jobs (see job_queue.py) in their own process, sharing the web
+server's database. Importing the app registers the job kinds. Set
+JOB_WORKERS=0 on the web server to leave every job to processes like this one.
+
+Usage: python -m worker [--concurrency 2]   (from backend/)
+"""
+
+import argparse
+import signal
+import threading
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=2, help="jobs run at the same time")
+    args = parser.parse_args()
+
+    import main as app_module  # registers the job kinds
+    from database import close_pools
+    from integrations.http_session import close_session
+    from job_queue import WorkerPool
+
+    app_module.init_db()
+    pool = WorkerPool(app_module.job_queue, args.concurrency)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    pool.start()
+    while not stopping.wait(1.0):
+        pass
+    print("🛑 Job workers stopping...")
+    pool.stop(timeout=60.0)
+    close_session()
+    close_pools()
+
+
+if __name__ == "__main__":
+    main()
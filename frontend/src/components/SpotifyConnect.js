@@ -13,21 +13,20 @@ const SpotifyConnect = () => {
   const fetchSpotifyData = async () => {
     try {
       setLoading(true);
-      const [profileResponse, topTracksResponse, recentlyPlayedResponse] = await Promise.all([
-        fetch('http://localhost:8000/api/spotify/profile'),
-        fetch('http://localhost:8000/api/spotify/top-tracks'),
-        fetch('http://localhost:8000/api/spotify/recently-played')
-      ]);
-
-      console.log('Profile response status:', profileResponse.status, profileResponse.ok);
-      console.log('Top tracks response status:', topTracksResponse.status, topTracksResponse.ok);
-      console.log('Recently played response status:', recentlyPlayedResponse.status, recentlyPlayedResponse.ok);
+      // One request; the backend fetches the sections concurrently
+      const response = await fetch('http://localhost:8000/api/spotify/dashboard');
+      console.log('Dashboard response status:', response.status, response.ok);
       
-      if (profileResponse.ok && topTracksResponse.ok && recentlyPlayedResponse.ok) {
-        const profile = await profileResponse.json();
-        const topTracks = await topTracksResponse.json();
-        const recentlyPlayed = await recentlyPlayedResponse.json();
-        setSpotifyData({ profile, topTracks, recentlyPlayed });
+      const dashboard = response.ok ? await response.json() : null;
+      if (dashboard && dashboard.profile) {
+        if (Object.keys(dashboard.errors).length > 0) {
+          console.log('Dashboard sections failed:', dashboard.errors);
+        }
+        setSpotifyData({
+          profile: dashboard.profile,
+          topTracks: dashboard.top_tracks || [],
+          recentlyPlayed: dashboard.recently_played || []
+        });
       } else {
         setError('Unable to load Spotify data');
       }
@@ -13,21 +13,18 @@ const StravaConnect = () => {
   const fetchStravaData = async () => {
     try {
       setLoading(true);
-      const [athleteResponse, activitiesResponse] = await Promise.all([
-        fetch('http://localhost:8000/api/strava/athlete'),
-        fetch('http://localhost:8000/api/strava/activities?per_page=10')
-      ]);
-
-      console.log('Athlete response status:', athleteResponse.status, athleteResponse.ok);
-      console.log('Activities response status:', activitiesResponse.status, activitiesResponse.ok);
+      // One request; the backend fetches the sections concurrently
+      const response = await fetch('http://localhost:8000/api/strava/dashboard?per_page=10');
+      console.log('Dashboard response status:', response.status, response.ok);
       
-      if (athleteResponse.ok && activitiesResponse.ok) {
-        const athlete = await athleteResponse.json();
-        const activities = await activitiesResponse.json();
-        setStravaData({ athlete, activities });
+      const dashboard = response.ok ? await response.json() : null;
+      if (dashboard && dashboard.athlete) {
+        if (Object.keys(dashboard.errors).length > 0) {
+          console.log('Dashboard sections failed:', dashboard.errors);
+        }
+        setStravaData({ athlete: dashboard.athlete, activities: dashboard.activities || [] });
       } else {
-        console.log('Athlete response error:', athleteResponse.status, await athleteResponse.text());
-        console.log('Activities response error:', activitiesResponse.status, await activitiesResponse.text());
+        console.log('Dashboard response error:', response.status, dashboard ? dashboard.errors : await response.text());
         setError('Unable to load Strava data');
       }
     } catch (err) {